@@ -1,15 +1,72 @@
+import functools
 from typing import Literal, Any
 
 from langgraph.constants import END
 from langgraph.graph import StateGraph
 
 from agent.model import AgentState
-from agent.nodes import analyze_code, run_code, analyze_error, fix_code, add_iter, create_tests, postprocess_code
+from agent.tracing import traced
+from agent.nodes import analyze_code, run_code, analyze_error, fix_code, add_iter, create_tests, postprocess_code, \
+    validate_code, check_performance, one_shot_fix, escalate, aanalyze_code, arun_code, aanalyze_error, afix_code, \
+    acreate_tests, apostprocess_code, avalidate_code, acheck_performance, aone_shot_fix
+
+SYNC_NODES = {
+    "one_shot_fix": one_shot_fix,
+    "escalate": escalate,
+    "analyze_code": analyze_code,
+    "create_tests": create_tests,
+    "validate_code": validate_code,
+    "run_code": run_code,
+    "check_performance": check_performance,
+    "analyze_error": analyze_error,
+    "fix_code": fix_code,
+    "add_iter": add_iter,
+    "postprocess_code": postprocess_code,
+}
+
+ASYNC_NODES = {
+    "one_shot_fix": aone_shot_fix,
+    "escalate": escalate,
+    "analyze_code": aanalyze_code,
+    "create_tests": acreate_tests,
+    "validate_code": avalidate_code,
+    "run_code": arun_code,
+    "check_performance": acheck_performance,
+    "analyze_error": aanalyze_error,
+    "fix_code": afix_code,
+    "add_iter": add_iter,
+    "postprocess_code": apostprocess_code,
+}
+
+
+def _one_shot(state: AgentState) -> bool:
+    # the fix being checked is the cascade's one-shot fix, it is not fixed again but escalated
+    return state.get("escalated") is False
+
+
+def decide_entry(state: AgentState) -> Literal["one_shot", "graph"]:
+    return "one_shot" if state.get("cascade") else "graph"
+
+
+def decide_after_run(state: AgentState) -> Literal["ok", "has_error", "check_performance", "escalate"]:
+    rr = state.get("run_result") or {}
+    if not (rr.get("success") and rr.get("return_code") == 0):
+        return "escalate" if _one_shot(state) else "has_error"
+    # the profile is taken from the calls in the tests, without them there is nothing to time
+    return "check_performance" if state.get("check_performance") and state.get("tests") else "ok"
 
 
-def decide_after_run(state: AgentState) -> Literal["ok", "has_error"]:
-    rr = state.get("run_result") or {}
-    return "ok" if rr.get("success") and rr.get("return_code") == 0 else "has_error"
+def decide_after_performance(state: AgentState) -> Literal["ok", "has_error", "escalate"]:
+    result = (state.get("run_result") or {}).get("performance")
+    if result is None or result["passed"]:
+        return "ok"
+    return "escalate" if _one_shot(state) else "has_error"
+
+
+def decide_after_validation(state: AgentState) -> Literal["ok", "has_error", "escalate"]:
+    if not state.get("static_error"):
+        return "ok"
+    return "escalate" if _one_shot(state) else "has_error"
 
 
 def decide_next(state: AgentState) -> Literal["continue", "stop"]:
@@ -23,43 +80,75 @@ def tests_edge(state: AgentState) -> Literal["yes", "no"]:
 
 
 def after_tests(state: AgentState) -> Literal["yes", "no"]:
-    if state["tests"]:
+    # without parsable tests after max_test_attempts the code is run on its own, only crashes are caught then
+    if state["tests"] or state.get("test_attempts", 0) >= state.get("max_test_attempts", 3):
         return "yes"
     return "no"
 
 
-def build_graph(generic_type: Any) -> StateGraph:
+def build_graph(generic_type: Any, use_async: bool = False) -> StateGraph:
+    """
+    :param generic_type: state type of the graph
+    :param use_async: use the async nodes (LLM via ainvoke, sandbox via asyncio subprocess), compile and run with ainvoke
+    """
     workflow = StateGraph(generic_type)
 
-    workflow.set_entry_point("analyze_code")
+    # with cascade a one-shot fix is tried first, the full graph only runs if it fails
+    workflow.set_conditional_entry_point(
+        decide_entry,
+        {
+            "one_shot": "one_shot_fix",
+            "graph": "analyze_code",
+        }
+    )
 
-    workflow.add_node("analyze_code", analyze_code)
-    workflow.add_node("create_tests", create_tests)
-    workflow.add_node("run_code", run_code)
-    workflow.add_node("analyze_error", analyze_error)
-    workflow.add_node("fix_code", fix_code)
-    workflow.add_node("add_iter", add_iter)
-    workflow.add_node("postprocess_code", postprocess_code)
+    for name, node in (ASYNC_NODES if use_async else SYNC_NODES).items():
+        # every node reports its wall time, tokens and calls in state["trace"]
+        workflow.add_node(name, traced(name, node))
 
     workflow.add_edge("analyze_error", "fix_code")
     workflow.add_edge("fix_code", "postprocess_code")
     workflow.add_edge("postprocess_code", "add_iter")
+    workflow.add_edge("escalate", "analyze_code")
 
     workflow.add_conditional_edges(
         "add_iter",
         decide_next,
         {
-            "continue": "run_code",
+            "continue": "validate_code",
             "stop": END,
         }
     )
 
+    workflow.add_conditional_edges(
+        "validate_code",
+        decide_after_validation,
+        {
+            "ok": "run_code",
+            # a static error needs no analysis, it goes straight to fixing
+            "has_error": "fix_code",
+            "escalate": "escalate",
+        }
+    )
+
     workflow.add_conditional_edges(
         "run_code",
         decide_after_run,
         {
             "ok": END,
             "has_error": "analyze_error",
+            "check_performance": "check_performance",
+            "escalate": "escalate",
+        }
+    )
+
+    workflow.add_conditional_edges(
+        "check_performance",
+        decide_after_performance,
+        {
+            "ok": END,
+            "has_error": "analyze_error",
+            "escalate": "escalate",
         }
     )
 
@@ -68,7 +157,16 @@ def build_graph(generic_type: Any) -> StateGraph:
         tests_edge,
         {
             "yes": "create_tests",
-            "no": "run_code",
+            "no": "validate_code",
+        }
+    )
+
+    workflow.add_conditional_edges(
+        "one_shot_fix",
+        tests_edge,
+        {
+            "yes": "create_tests",
+            "no": "validate_code",
         }
     )
 
@@ -76,9 +174,18 @@ def build_graph(generic_type: Any) -> StateGraph:
         "create_tests",
         after_tests,
         {
-            "yes": "run_code",
+            "yes": "validate_code",
             "no": "create_tests",
         }
     )
 
     return workflow
+
+
+@functools.lru_cache(maxsize=None)
+def compile_graph(use_async: bool = False):
+    """
+    The agent graph over AgentState, compiled once per process. A compiled graph keeps no state between runs,
+    so it is shared by every run.
+    """
+    return build_graph(AgentState, use_async).compile()
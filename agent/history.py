@@ -0,0 +1,160 @@
+from typing import Callable, Optional
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, ToolMessage
+
+from agent.cache import ResultCache, make_key
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+SANDBOX_MESSAGE_NAME = "run_code_in_sandbox"
+# every chat message costs a few tokens on top of its content
+MESSAGE_OVERHEAD_TOKENS = 4
+# the most recent messages are what the current node works on, they are never dropped
+KEEP_LAST_MESSAGES = 4
+
+_encodings = {}
+_summaries = ResultCache(max_entries=256)
+
+
+def _encoding(model_name: str):
+    if tiktoken is None:
+        return None
+    if model_name not in _encodings:
+        try:
+            try:
+                _encodings[model_name] = tiktoken.encoding_for_model(model_name)
+            except KeyError:
+                _encodings[model_name] = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            # the encoding files are downloaded on first use, offline the count is approximated
+            _encodings[model_name] = None
+    return _encodings[model_name]
+
+
+def _text(message: BaseMessage) -> str:
+    text = message.content if isinstance(message.content, str) else str(message.content)
+    for tool_call in getattr(message, "tool_calls", None) or []:
+        text += tool_call["name"] + str(tool_call["args"])
+    return text
+
+
+def count_tokens(messages: list[BaseMessage], model_name: str = "gpt-4o") -> int:
+    """
+    Prompt size of the messages. Approximated by 4 characters per token if tiktoken or its encoding files
+    are not available.
+    """
+    encoding = _encoding(model_name)
+    total = 0
+    for message in messages:
+        text = _text(message)
+        total += MESSAGE_OVERHEAD_TOKENS + (len(encoding.encode(text, disallowed_special=())) if encoding
+                                            else len(text) // 4)
+    return total
+
+
+def _is_sandbox_output(message: BaseMessage) -> bool:
+    return isinstance(message, HumanMessage) and message.name == SANDBOX_MESSAGE_NAME
+
+
+def _deduplicate(messages: list[BaseMessage]) -> list[BaseMessage]:
+    # only the last copy of a repeated message is kept. Tool calls and their results always stay together
+    last_seen = {}
+    for index, message in enumerate(messages):
+        if isinstance(message, ToolMessage) or getattr(message, "tool_calls", None):
+            continue
+        last_seen[(message.type, message.name, _text(message))] = index
+
+    deduplicated = []
+    for index, message in enumerate(messages):
+        if isinstance(message, ToolMessage) or getattr(message, "tool_calls", None):
+            deduplicated.append(message)
+        elif last_seen[(message.type, message.name, _text(message))] == index:
+            deduplicated.append(message)
+    return deduplicated
+
+
+def _truncate(text: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    half = max_chars // 2
+    return f"{text[:half]}\n... [{len(text) - 2 * half} characters truncated] ...\n{text[-half:]}"
+
+
+def _truncate_sandbox_outputs(messages: list[BaseMessage], keep_outputs: int, max_chars: int) -> list[BaseMessage]:
+    outputs = [index for index, message in enumerate(messages) if _is_sandbox_output(message)]
+    old_outputs = set(outputs[:-keep_outputs] if keep_outputs else outputs)
+    return [
+        message.model_copy(update={"content": _truncate(message.content, max_chars)})
+        if index in old_outputs and isinstance(message.content, str) else message
+        for index, message in enumerate(messages)
+    ]
+
+
+def _units(messages: list[BaseMessage]) -> list[list[BaseMessage]]:
+    # a model message with tool calls and the tool results answering it can only be dropped together
+    units = []
+    for message in messages:
+        if isinstance(message, ToolMessage) and units:
+            units[-1].append(message)
+        else:
+            units.append([message])
+    return units
+
+
+def _drop_oldest(messages: list[BaseMessage], budget: int, model_name: str,
+                 summarizer: Optional[Callable[[list[BaseMessage]], str]]) -> list[BaseMessage]:
+    # the system prompts and the task (first human message) are always kept
+    head_size = 0
+    while head_size < len(messages) and isinstance(messages[head_size], SystemMessage):
+        head_size += 1
+    if head_size < len(messages) and isinstance(messages[head_size], HumanMessage):
+        head_size += 1
+    head, units = messages[:head_size], _units(messages[head_size:])
+
+    unit_tokens = [count_tokens(unit, model_name) for unit in units]
+    total = count_tokens(head, model_name) + sum(unit_tokens)
+    dropped = []
+    while len(units) > KEEP_LAST_MESSAGES and total > budget:
+        dropped += units.pop(0)
+        total -= unit_tokens.pop(0)
+    if not dropped:
+        return messages
+
+    if summarizer is not None:
+        key = make_key(*(f"{message.type}:{_text(message)}" for message in dropped))
+        cached = _summaries.get(key)
+        summary = cached["summary"] if cached is not None else summarizer(dropped)
+        _summaries.put(key, {"summary": summary})
+        note = HumanMessage(content=f"Summary of the earlier iterations: {summary}")
+    else:
+        note = HumanMessage(content=f"[{len(dropped)} earlier messages were omitted to fit the context]")
+    return head + [note] + sum(units, [])
+
+
+def compact_history(messages: list[BaseMessage], budget: Optional[int], model_name: str = "gpt-4o",
+                    keep_outputs: int = 1, max_output_chars: int = 2000,
+                    summarizer: Optional[Callable[[list[BaseMessage]], str]] = None) -> tuple[list[BaseMessage], dict]:
+    """
+    Fits a prompt into a token budget. Repeated messages are removed, sandbox outputs except the last keep_outputs
+    are truncated, and if the prompt is still too long the oldest messages are dropped (or summarized by summarizer).
+    The given messages are not modified.
+    :param messages: full prompt, system prompts first
+    :param budget: prompt tokens to fit in. Nothing is compacted if None
+    :param model_name: tokenizer to count with
+    :param keep_outputs: number of the latest sandbox outputs that are never truncated
+    :param max_output_chars: length older sandbox outputs are truncated to
+    :param summarizer: turns dropped messages into a short text. The dropped messages are only mentioned if None
+    :return: compacted prompt and {"tokens_before", "tokens_after"}
+    """
+    tokens_before = count_tokens(messages, model_name)
+    if budget is None:
+        return messages, {"tokens_before": tokens_before, "tokens_after": tokens_before}
+
+    compacted = _truncate_sandbox_outputs(_deduplicate(messages), keep_outputs, max_output_chars)
+    if count_tokens(compacted, model_name) > budget:
+        compacted = _drop_oldest(compacted, budget, model_name, summarizer)
+    return compacted, {"tokens_before": tokens_before, "tokens_after": count_tokens(compacted, model_name)}
+
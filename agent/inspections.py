@@ -0,0 +1,288 @@
+import ast
+import builtins
+import json
+import shutil
+import subprocess
+import symtable
+import tempfile
+from json import JSONDecodeError
+from pathlib import Path
+from typing import Callable, Optional
+
+from agent.cache import ResultCache, make_key
+from agent.validation import undefined_names
+
+# the name of the inspected file in the reports, the same as the sandboxed file
+FILENAME = "buggy_code.py"
+ROOT = Path.cwd()
+AGENT_DIR = Path(".agent")
+RESOURCES_DIR = Path("resources")
+PATH_TO_INSPECTIONS_SCRIPT = Path("scripts", "inspect.sh")
+DESCRIPTIONS_FILENAME = ".descriptions.json"
+
+# comprehensions and lambdas have their own scopes, their unused names are not worth a warning
+_ANONYMOUS_SCOPES = {"listcomp", "setcomp", "dictcomp", "genexpr", "lambda"}
+_BUILTIN_NAMES = {name for name in dir(builtins) if not name.startswith("_")}
+
+
+def _problem(inspection_id: str, name: str, severity: str, line: Optional[int], element: str,
+             description: str) -> dict:
+    # the fields of PyCharm's JSON report that the agent reads
+    return {
+        "file": FILENAME,
+        "line": line,
+        "problem_class": {"id": inspection_id, "name": name, "severity": severity},
+        "highlighted_element": element,
+        "description": description,
+    }
+
+
+def _first_line(node: ast.AST, name: str, store: bool) -> Optional[int]:
+    lines = []
+    for child in ast.walk(node):
+        if isinstance(child, ast.Name) and child.id == name and isinstance(child.ctx, ast.Store) == store:
+            lines.append(child.lineno)
+        elif store and isinstance(child, ast.arg) and child.arg == name:
+            lines.append(child.lineno)
+        elif store and isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and child.name == name:
+            lines.append(child.lineno)
+        elif store and isinstance(child, (ast.Import, ast.ImportFrom)):
+            if any((alias.asname or alias.name.split(".")[0]) == name for alias in child.names):
+                lines.append(child.lineno)
+    return min(lines) if lines else None
+
+
+def _scopes(table: symtable.SymbolTable, tree: ast.Module) -> list[tuple[symtable.SymbolTable, ast.AST]]:
+    """
+    Function scopes of the module with their AST nodes, matched by name and line.
+    """
+    nodes = {(node.name, node.lineno): node for node in ast.walk(tree)
+             if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))}
+    scopes = []
+    tables = list(table.get_children())
+    while tables:
+        child = tables.pop()
+        tables.extend(child.get_children())
+        node = nodes.get((child.get_name(), child.get_lineno()))
+        if child.get_type() == "function" and child.get_name() not in _ANONYMOUS_SCOPES and node is not None:
+            scopes.append((child, node))
+    return scopes
+
+
+def _unused(table: symtable.SymbolTable, tree: ast.Module, scopes: list) -> list[dict]:
+    problems = []
+    # names used only by other scopes are still used
+    used_globally = {symbol.get_name() for scope, _ in scopes for symbol in scope.get_symbols()
+                     if symbol.is_global() and symbol.is_referenced()}
+    for symbol in table.get_symbols():
+        name = symbol.get_name()
+        if symbol.is_imported() and not symbol.is_referenced() and name not in used_globally:
+            problems.append(_problem("PyUnusedImportsInspection", "Unused import", "WEAK WARNING",
+                                     _first_line(tree, name, store=True), name, f"Unused import statement '{name}'"))
+    for scope, node in scopes:
+        # like PyCharm, loop variables are not reported
+        loop_variables = {target.id for loop in ast.walk(node) if isinstance(loop, (ast.For, ast.AsyncFor))
+                          for target in ast.walk(loop.target) if isinstance(target, ast.Name)}
+        for symbol in scope.get_symbols():
+            name = symbol.get_name()
+            if (symbol.is_local() and symbol.is_assigned() and not symbol.is_referenced() and not symbol.is_parameter()
+                    and not name.startswith("_") and name not in loop_variables):
+                problems.append(_problem("PyUnusedLocalInspection", "Unused local symbols", "WEAK WARNING",
+                                         _first_line(node, name, store=True), name,
+                                         f"Local variable '{name}' value is not used"))
+    return problems
+
+
+def _shadowing(table: symtable.SymbolTable, scopes: list) -> list[dict]:
+    problems = []
+    module_variables = {symbol.get_name() for symbol in table.get_symbols()
+                        if symbol.is_assigned() and not symbol.is_imported() and not symbol.is_namespace()}
+    for scope, node in scopes:
+        for symbol in scope.get_symbols():
+            name = symbol.get_name()
+            if not symbol.is_local() or not (symbol.is_assigned() or symbol.is_parameter()):
+                continue
+            line = _first_line(node, name, store=True)
+            if name in _BUILTIN_NAMES:
+                problems.append(_problem("PyShadowingBuiltinsInspection", "Shadowing built-ins", "WEAK WARNING",
+                                         line, name, f"Shadows built-in name '{name}'"))
+            elif name in module_variables:
+                problems.append(_problem("PyShadowingNamesInspection", "Shadowing names from outer scopes",
+                                         "WEAK WARNING", line, name, f"Shadows name '{name}' from outer scope"))
+    return problems
+
+
+def _constant_type(node: ast.AST) -> Optional[type]:
+    if isinstance(node, ast.JoinedStr):
+        return str
+    if isinstance(node, ast.Constant) and node.value is not None and node.value is not Ellipsis:
+        return type(node.value)
+    if isinstance(node, (ast.List, ast.ListComp)):
+        return list
+    if isinstance(node, (ast.Dict, ast.DictComp)):
+        return dict
+    return None
+
+
+def _operands_misused(node: ast.BinOp) -> bool:
+    left, right = _constant_type(node.left), _constant_type(node.right)
+    if left is None or right is None:
+        return False
+    numbers = (int, float, complex, bool)
+    if left in numbers and right in numbers or left == right == dict and isinstance(node.op, ast.BitOr):
+        return False
+    if isinstance(node.op, ast.Add):
+        return left != right
+    if isinstance(node.op, ast.Mult):
+        # repeating a sequence
+        return not ({left, right} & {str, bytes, list} and {left, right} & {int, bool} and left != right)
+    # "%d" % 5 formats, other operators need numbers
+    return not (isinstance(node.op, ast.Mod) and left in (str, bytes))
+
+
+def _type_misuse(tree: ast.Module) -> list[dict]:
+    """
+    Operations on literals that always raise a TypeError or are always wrong.
+    """
+    problems = []
+    for node in ast.walk(tree):
+        description = None
+        if isinstance(node, ast.BinOp) and _operands_misused(node):
+            description = (f"Unsupported operand types for {type(node.op).__name__}: "
+                           f"'{_constant_type(node.left).__name__}' and '{_constant_type(node.right).__name__}'")
+        elif isinstance(node, ast.Call) and _constant_type(node.func) is not None:
+            description = f"'{_constant_type(node.func).__name__}' object is not callable"
+        elif (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "len"
+              and len(node.args) == 1 and _constant_type(node.args[0]) in (int, float, complex, bool)):
+            description = f"object of type '{_constant_type(node.args[0]).__name__}' has no len()"
+        elif isinstance(node, ast.Compare) and any(
+                isinstance(operator, (ast.Is, ast.IsNot)) and _constant_type(comparator) not in (None, bool)
+                for operator, comparator in zip(node.ops, node.comparators)):
+            description = "Comparison with a literal by identity, use == instead of is"
+        if description is not None:
+            problems.append(_problem("PyTypeCheckerInspection", "Incorrect type", "WARNING", node.lineno,
+                                     ast.unparse(node), description))
+    return problems
+
+
+def builtin_inspections(code: str) -> dict:
+    """
+    In-process analysis with ast and symtable: unresolved and unused references, shadowed names and obvious misuse
+    of types. Takes milliseconds. Same shape as the PyCharm report: one entry per inspection with its problems.
+    """
+    try:
+        tree = ast.parse(code)
+        table = symtable.symtable(code, FILENAME, "exec")
+    except (SyntaxError, ValueError) as e:
+        problems = [_problem("PySyntaxErrorInspection", "Syntax error", "ERROR", getattr(e, "lineno", None), "",
+                             getattr(e, "msg", str(e)))]
+        return {"PySyntaxErrorInspection.json": {"problems": problems}}
+
+    scopes = _scopes(table, tree)
+    problems = [
+        _problem("PyUnresolvedReferencesInspection", "Unresolved references", "ERROR", line, name,
+                 f"Unresolved reference '{name}'")
+        for name, line in sorted(undefined_names(code).items(), key=lambda item: item[1])
+    ]
+    problems += _unused(table, tree, scopes) + _shadowing(table, scopes) + _type_misuse(tree)
+
+    report = {}
+    for problem in problems:
+        report.setdefault(f"{problem['problem_class']['id']}.json", {"problems": []})["problems"].append(problem)
+    return report
+
+
+def pycharm_inspections(code: str) -> dict:
+    """
+    PyCharm's offline inspections (scripts/inspect.sh, pycharm_bin_directory in config.yaml). Starts the IDE for every
+    call, so it takes tens of seconds. Every call gets its own results directory, concurrent calls do not clash.
+    """
+    AGENT_DIR.mkdir(parents=True, exist_ok=True)
+    work_dir = Path(tempfile.mkdtemp(dir=AGENT_DIR, prefix="inspections_"))
+    try:
+        with open(work_dir / FILENAME, "w") as file_path:
+            file_path.write(code)
+
+        inspections_xml_path = str(ROOT / RESOURCES_DIR / "profiles_settings.xml")
+        result_path = work_dir / "inspections"
+        result_path.mkdir()
+
+        commands = [str(PATH_TO_INSPECTIONS_SCRIPT), str(ROOT), inspections_xml_path, str(ROOT / result_path), "-v2",
+                    "-d", str(ROOT / work_dir),
+                    "-format", "json"]
+        try:
+            proc = subprocess.run(commands, cwd=str(ROOT))
+        except OSError:
+            return {}
+
+        if proc.returncode != 0:
+            return {}
+
+        output = {}
+
+        for file in result_path.iterdir():
+            if file.name != DESCRIPTIONS_FILENAME:
+                try:
+                    with open(file, "r", encoding="utf-8") as json_file:
+                        output[file.name] = json.load(json_file)
+                except (JSONDecodeError, KeyError, AttributeError, TypeError, ValueError):
+                    continue
+        return output
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# name -> function from code to the report, see register_backend
+BACKENDS: dict[str, Callable[[str], dict]] = {
+    "builtin": builtin_inspections,
+    "pycharm": pycharm_inspections,
+}
+
+_backend = "builtin"
+_cache: Optional[ResultCache] = ResultCache(256)
+
+
+def register_backend(name: str, inspect: Callable[[str], dict]) -> None:
+    """
+    Adds an inspections backend: a function from code to a dict of reports (see builtin_inspections).
+    """
+    BACKENDS[name] = inspect
+
+
+def configure(backend: str = "builtin", cache_enabled: bool = True, cache_size: int = 256) -> None:
+    """
+    Selects the backend of the inspections tool.
+    :param backend: "builtin" (in-process ast/symtable analysis), "pycharm" (needs a PyCharm installation)
+    or a registered one
+    :param cache_enabled: reuse the report of already inspected code
+    :param cache_size: reports kept in memory
+    """
+    global _backend, _cache
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inspections backend: {backend}. Available: {', '.join(BACKENDS)}")
+    _backend = backend
+    _cache = ResultCache(cache_size) if cache_enabled else None
+
+
+def configure_from_config(cfg: dict) -> None:
+    configure(cfg.get("inspections_backend", "builtin"), bool(cfg.get("inspections_cache", True)))
+
+
+def inspect(code: str) -> dict:
+    """
+    Report of the configured backend for the code, cached by the code's hash.
+    """
+    key = make_key("inspections", _backend, code)
+    cache = _cache
+    if cache is not None:
+        report = cache.get(key)
+        if report is not None:
+            return report
+    report = BACKENDS[_backend](code)
+    if cache is not None:
+        cache.put(key, report)
+    return report
+
+
+def cache_stats() -> dict:
+    return _cache.stats() if _cache is not None else {}
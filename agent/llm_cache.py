@@ -0,0 +1,223 @@
+import hashlib
+import json
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+
+from agent import tracing
+
+MODES = ("off", "read_write", "record", "replay")
+
+
+class LLMCacheMiss(Exception):
+    """
+    Raised in replay mode when a response was never recorded.
+    """
+
+
+class LLMCache(ABC):
+    """
+    Interface of an LLM response store. Values are serialized messages (see message_to_dict).
+    A backend missing one of the methods cannot be instantiated.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[dict]:
+        """
+        :return: the stored value, None if there is none
+        """
+
+    @abstractmethod
+    def put(self, key: str, value: dict) -> None:
+        """
+        Stores the value under the key, replacing an older one.
+        """
+
+
+class SQLiteLLMCache(LLMCache):
+    """
+    Responses in a single SQLite file. Entries older than ttl_seconds are ignored and deleted,
+    the least recently used ones are evicted when there are more than max_entries.
+    """
+
+    # eviction needs a COUNT(*), so it is not checked on every write
+    EVICTION_PERIOD = 100
+
+    def __init__(self, path: str, ttl_seconds: Optional[float] = None, max_entries: int = 100_000):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if self.ttl_seconds is not None and now - created > self.ttl_seconds:
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self._connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(value)
+
+    def put(self, key: str, value: dict) -> None:
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now),
+            )
+            self._puts += 1
+            if self._puts % self.EVICTION_PERIOD == 0:
+                self._evict()
+
+    def _evict(self) -> None:
+        if self.ttl_seconds is not None:
+            self._connection.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl_seconds,))
+        (count,) = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()
+        if count > self.max_entries:
+            self._connection.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+
+def _canonical_message(message: BaseMessage) -> dict:
+    # ids, usage and response metadata differ between runs of the same conversation, they are not part of the key
+    canonical = {"type": message.type, "content": message.content, "name": message.name}
+    tool_calls = getattr(message, "tool_calls", None)
+    if tool_calls:
+        canonical["tool_calls"] = [{"name": call["name"], "args": call["args"]} for call in tool_calls]
+    tool_call_id = getattr(message, "tool_call_id", None)
+    if tool_call_id:
+        canonical["tool_call_id"] = tool_call_id
+    return canonical
+
+
+def make_llm_key(model_name: str, messages: list[BaseMessage], tools: Optional[list] = None) -> str:
+    # only needed when the cache is on
+    from langchain_core.utils.function_calling import convert_to_openai_tool
+
+    payload = {
+        "model": model_name,
+        "tools": [convert_to_openai_tool(t) for t in tools or []],
+        "messages": [_canonical_message(message) for message in messages],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class CachedLLM:
+    """
+    Puts a response store in front of model calls.
+    Modes: "off" (no cache), "read_write" (use cached responses, store new ones), "record" (always call the model and
+    store its response), "replay" (never call the model, a missing response raises LLMCacheMiss).
+    """
+
+    def __init__(self, mode: str = "off", store: Optional[LLMCache] = None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown LLM cache mode: {mode}. Available: {', '.join(MODES)}")
+        if mode != "off" and store is None:
+            raise ValueError(f"LLM cache mode {mode} needs a store")
+        self.mode = mode
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def invoke(self, model_name: str, messages: list[BaseMessage], call, tools: Optional[list] = None) -> BaseMessage:
+        """
+        :param model_name: part of the key
+        :param messages: prompt, part of the key
+        :param call: zero-argument callable that asks the model, used on misses
+        :param tools: tools bound to the model, part of the key
+        """
+        if self.mode == "off":
+            return call()
+        key, cached = self._lookup(model_name, messages, tools)
+        if cached is not None:
+            return cached
+        out = call()
+        self.store.put(key, message_to_dict(out))
+        return out
+
+    async def ainvoke(self, model_name: str, messages: list[BaseMessage], acall,
+                      tools: Optional[list] = None) -> BaseMessage:
+        """
+        Async version of invoke, acall is a zero-argument coroutine function.
+        """
+        if self.mode == "off":
+            return await acall()
+        key, cached = self._lookup(model_name, messages, tools)
+        if cached is not None:
+            return cached
+        out = await acall()
+        self.store.put(key, message_to_dict(out))
+        return out
+
+    def _lookup(self, model_name: str, messages: list[BaseMessage],
+                tools: Optional[list]) -> tuple[str, Optional[BaseMessage]]:
+        key = make_llm_key(model_name, messages, tools)
+        if self.mode in ("read_write", "replay"):
+            cached = self.store.get(key)
+            if cached is not None:
+                with self._lock:
+                    self.hits += 1
+                tracing.annotate(cached=True)
+                return key, messages_from_dict([cached])[0]
+        with self._lock:
+            self.misses += 1
+        if self.mode == "replay":
+            raise LLMCacheMiss(f"No recorded response for {model_name} (key {key})")
+        return key, None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"mode": self.mode, "hits": self.hits, "misses": self.misses}
+
+
+_cached_llm = CachedLLM()
+
+
+def configure(mode: str = "off", path: str = ".agent/llm_cache.sqlite", ttl_hours: Optional[float] = None,
+              max_entries: int = 100_000) -> None:
+    """
+    Sets up the response cache used by agent.nodes.call_llm and call_llm_with_tools.
+    :param mode: "off", "read_write", "record" or "replay" (see CachedLLM)
+    :param path: SQLite file of the cache
+    :param ttl_hours: responses older than this are not used. Never expire if None
+    :param max_entries: number of stored responses after which the least recently used ones are evicted
+    """
+    global _cached_llm
+    store = None
+    if mode != "off":
+        store = SQLiteLLMCache(path, ttl_hours * 3600 if ttl_hours is not None else None, max_entries)
+    _cached_llm = CachedLLM(mode, store)
+
+
+def configure_from_config(cfg: dict) -> None:
+    configure(
+        cfg.get("llm_cache", "off"),
+        cfg.get("llm_cache_path", ".agent/llm_cache.sqlite"),
+        cfg.get("llm_cache_ttl_hours"),
+        int(cfg.get("llm_cache_max_entries", 100_000)),
+    )
+
+
+def get_cached_llm() -> CachedLLM:
+    return _cached_llm
@@ -1,32 +1,128 @@
 import argparse
+import asyncio
 import logging
 import sys
 
 from langchain_core.messages import SystemMessage
 
 from utils.utils import parse_config
-from agent.graph import build_graph
+from agent import inspections, llm_cache, sandbox, test_cache
 from agent.model import AgentState
 
 
-def run_agent(buggy_code: str, docstring: str, max_iter: int, recursion_limit: int, run_inspections: bool = False) -> AgentState:
-    app = build_graph(AgentState).compile()
-    _state: AgentState = {
+# Optional agent settings: name -> (type, default). All of them can be set in config.yaml
+AGENT_OPTIONS = {
+    "split_tests": (bool, False),
+    "speculative_k": (int, 1),
+    "speculative_temperature": (float, 0.8),
+    "history_token_budget": (int, None),
+    "history_summarize": (bool, False),
+    "validate_code": (bool, True),
+    "max_test_attempts": (int, 3),
+    "stream_llm": (bool, False),
+    "check_performance": (bool, False),
+    "performance_factor": (float, 3.0),
+    "performance_max_exponent": (float, 2.5),
+    "performance_timeout": (int, 30),
+    "cascade": (bool, False),
+    "cascade_model": (str, None),
+}
+
+
+def agent_options(cfg: dict) -> dict:
+    """
+    Optional agent settings (see AGENT_OPTIONS) taken from a parsed config, missing ones get their defaults.
+    """
+    options = {}
+    for name, (option_type, default) in AGENT_OPTIONS.items():
+        value = cfg.get(name, default)
+        options[name] = option_type(value) if value is not None else None
+    return options
+
+
+def _initial_state(buggy_code: str, docstring: str, max_iter: int, run_inspections: bool, **options) -> AgentState:
+    unknown = set(options) - set(AGENT_OPTIONS)
+    if unknown:
+        raise TypeError(f"Unknown agent options: {', '.join(sorted(unknown))}")
+    defaults = {name: default for name, (_, default) in AGENT_OPTIONS.items()}
+    return {
         "messages": [SystemMessage(content="Be extremely laconic in your responses.")],
         "code": buggy_code,
+        "original_code": buggy_code,
         "docstring": docstring,
         "tests": None,
+        "tests_source": None,
+        "tests_key": None,
+        "test_attempts": 0,
         "run_result": None,
         "error_summary": None,
         "phase": "analyze_code",
         "iter": 0,
         "max_iter": max_iter,
         "run_inspections": run_inspections,
+        **defaults,
+        **options,
+        "failed_tests": None,
+        "static_error": None,
+        "performance_baseline": None,
+        "escalated": None,
+        "speculation": None,
+        "postprocess": None,
+        "history_stats": [],
+        "trace": [],
     }
-    final = app.invoke(_state, {"recursion_limit": recursion_limit})
+
+
+def _compiled_graph(use_async: bool = False):
+    # the graph pulls in langgraph and the nodes, it is imported on the first run instead of with this module,
+    # so `--help`, bad arguments and importers of AGENT_OPTIONS stay fast
+    from agent.graph import compile_graph
+    return compile_graph(use_async)
+
+
+def run_agent_with_state(buggy_code: str, docstring: str, max_iter: int, recursion_limit: int,
+                         run_inspections: bool = False, **options) -> AgentState:
+    """
+    Runs the agent and returns its final state (fixed code in "code", per-run metrics like "speculation").
+    :param options: optional agent settings, see AGENT_OPTIONS
+    """
+    app = _compiled_graph()
+    _state = _initial_state(buggy_code, docstring, max_iter, run_inspections, **options)
+    return app.invoke(_state, {"recursion_limit": recursion_limit})
+
+
+def run_agent(buggy_code: str, docstring: str, max_iter: int, recursion_limit: int, run_inspections: bool = False,
+              **options) -> AgentState:
+    final = run_agent_with_state(buggy_code, docstring, max_iter, recursion_limit, run_inspections, **options)
+    return final.get("code")
+
+
+async def run_agent_async(buggy_code: str, docstring: str, max_iter: int, recursion_limit: int,
+                          run_inspections: bool = False, **options) -> AgentState:
+    """
+    Same as run_agent, but every LLM call and sandbox run is awaited, so many runs can share one event loop.
+    """
+    app = _compiled_graph(use_async=True)
+    _state = _initial_state(buggy_code, docstring, max_iter, run_inspections, **options)
+    final = await app.ainvoke(_state, {"recursion_limit": recursion_limit})
     return final.get("code")
 
 
+async def run_agents_async(tasks: list[dict], concurrency: int = 16) -> list:
+    """
+    Runs many fixes on the current event loop, at most `concurrency` at a time.
+    :param tasks: keyword arguments of run_agent_async, one dict per fix
+    :return: fixed code per task in the same order, or the exception a run raised
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _run(task: dict):
+        async with semaphore:
+            return await run_agent_async(**task)
+
+    return await asyncio.gather(*(_run(task) for task in tasks), return_exceptions=True)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Run agent on docstring and buggy code specified in config."
@@ -45,7 +141,12 @@ if __name__ == "__main__":
     # we do not parse dir python3 -m eval.main
     args = parser.parse_args(sys.argv[4:])
     args_from_config = parse_config(args.config)
+    sandbox.configure_from_config(args_from_config)
+    test_cache.configure_from_config(args_from_config)
+    inspections.configure_from_config(args_from_config)
+    llm_cache.configure_from_config(args_from_config)
 
     print(
         run_agent(args_from_config["buggy_code"], args_from_config["docstring"], int(args_from_config["max_iter"]), int(
-            args_from_config["recursion_limit"]), bool(args_from_config["run_inspections"])))
+            args_from_config["recursion_limit"]), bool(args_from_config["run_inspections"]),
+                  **agent_options(args_from_config)))
@@ -1,7 +1,66 @@
-from typing import TypedDict, Annotated, Optional, Literal
+import operator
+from typing import TypedDict, Annotated, Optional, Literal, NotRequired
 
 from langchain_core.messages import BaseMessage
-from langgraph.graph import add_messages
+
+
+def add_messages(left: list, right: list) -> list:
+    """
+    langgraph's add_messages reducer. langgraph is imported on the first merge, so the sandbox, the tools and other
+    modules that only need the types here do not pay for importing it.
+    """
+    from langgraph.graph.message import add_messages as _add_messages
+    return _add_messages(left, right)
+
+
+class TestCaseResult(TypedDict):
+    source: str
+    line: int
+    passed: Optional[bool]
+    error: Optional[str]
+
+
+class ExceptionFrame(TypedDict):
+    # line and function are None for the note that stands for collapsed recursion frames (the note is in source),
+    # function is None for the line of a SyntaxError
+    line: Optional[int]
+    function: Optional[str]
+    source: str
+
+
+class FailedAssertion(TypedDict):
+    source: str
+    # None for an assert that is not a single comparison, its value is then in left
+    operator: Optional[str]
+    # reprs of the values the operands had when the assert failed, None if they are not known
+    left: Optional[str]
+    right: Optional[str]
+
+
+class ExceptionInfo(TypedDict):
+    type: str
+    message: str
+    # frames of the sandboxed file, innermost last
+    frames: list[ExceptionFrame]
+    assertion: Optional[FailedAssertion]
+
+
+class PerformanceResult(TypedDict):
+    passed: bool
+    # why it did not pass, for analyze_error
+    reasons: list[str]
+    # CPU seconds per call summed over the test inputs, of the fixed and of the original code
+    cpu_seconds: Optional[float]
+    baseline_cpu_seconds: Optional[float]
+    # peak RSS increase while the test inputs run
+    peak_rss_kb: int
+    baseline_peak_rss_kb: Optional[int]
+    # lengths of the scaled input and the CPU seconds per call on them, None where the call ran out of time
+    lengths: list[int]
+    scaled_seconds: list[Optional[float]]
+    baseline_scaled_seconds: Optional[list[Optional[float]]]
+    growth_exponent: Optional[float]
+    baseline_growth_exponent: Optional[float]
 
 
 class RunResult(TypedDict):
@@ -10,19 +69,79 @@ class RunResult(TypedDict):
     stderr: str
     return_code: int
     tests_passed: bool
+    test_results: NotRequired[Optional[list[TestCaseResult]]]
+    # the uncaught exception as reported by agent/sandbox_runner.py, None if the run did not end with one
+    exception: NotRequired[Optional[ExceptionInfo]]
+    # sizes of the whole outputs, stdout and stderr are truncated beyond agent.sandbox.output_limits()
+    stdout_bytes: NotRequired[int]
+    stderr_bytes: NotRequired[int]
+    # set by the check_performance node on a successful run, see agent.performance
+    performance: NotRequired[Optional[PerformanceResult]]
+
+
+class StaticError(TypedDict):
+    kind: str
+    source: Literal["code", "tests"]
+    line: Optional[int]
+    name: Optional[str]
+    message: str
+
+
+class ExecResult(TypedDict):
+    # the head and the tail of the outputs, see agent.sandbox_output.BoundedOutput
+    stdout: str
+    stderr: str
+    return_code: int
+    timed_out: bool
+    # sizes of the whole outputs
+    stdout_bytes: int
+    stderr_bytes: int
 
 
 class AgentState(TypedDict):
     messages: Annotated[list[BaseMessage], add_messages]
     code: str
+    # the code as it was given, the baseline of check_performance
+    original_code: str
     docstring: Optional[str]
     tests: Optional[str]
+    # where the tests came from: "cache" (see agent.test_cache), "llm" or None while there are none
+    tests_source: Optional[Literal["cache", "llm"]]
+    tests_key: Optional[str]
+    test_attempts: int
+    max_test_attempts: int
     run_result: Optional[RunResult]
     error_summary: Optional[str]
-    phase: Literal["analyze_code", "run_code", "analyze_error", "fix_error"]
+    phase: Literal["one_shot_fix", "escalate", "analyze_code", "validate_code", "run_code", "check_performance",
+                   "analyze_error", "fix_error"]
     iter: int
     max_iter: int
     run_inspections: bool
+    validate_code: bool
+    stream_llm: bool
+    static_error: Optional[StaticError]
+    check_performance: bool
+    performance_factor: float
+    performance_max_exponent: float
+    performance_timeout: int
+    # profile of original_code, measured on the first check. {} if it could not be measured
+    performance_baseline: Optional[dict]
+    cascade: bool
+    cascade_model: Optional[str]
+    # None without cascade, False while (and if) the one-shot fix holds, True once the full graph took over
+    escalated: Optional[bool]
+    split_tests: bool
+    failed_tests: Optional[list[str]]
+    speculative_k: int
+    speculative_temperature: float
+    speculation: Optional[dict]
+    # runs of postprocess_code and how many of them needed the LLM
+    postprocess: Optional[dict]
+    history_token_budget: Optional[int]
+    history_summarize: bool
+    history_stats: Annotated[list[dict], operator.add]
+    # one span per executed node, see agent.tracing
+    trace: Annotated[list[dict], operator.add]
 
 
 class FileFragment(TypedDict):
@@ -1,93 +1,522 @@
+import asyncio
+import functools
 import json
+import threading
+import time
+from concurrent.futures import as_completed
 from json import JSONDecodeError
+from typing import Callable, Optional, TYPE_CHECKING
 
-from dotenv import load_dotenv
-from langchain_core.messages import HumanMessage, ToolMessage, BaseMessage
-from langchain_openai import ChatOpenAI
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage, BaseMessage
+from langchain_core.runnables.config import ContextThreadPoolExecutor
+from langgraph.config import get_config
 from pydantic import ValidationError
 
 from utils.utils import parse_config, parse_json_content
-from agent.model import AgentState
+from agent import performance, sandbox, test_cache, tracing
+from agent.history import compact_history, count_tokens
+from agent.llm_cache import get_cached_llm
+from agent.model import AgentState, RunResult
+from agent.postprocess import strip_tests
+from agent.streaming import JsonBlockScanner
 from agent.prompts import ANALYZE_CODE_SYSTEM_PROMPT, ANALYZE_ERROR_SYSTEM_PROMPT, FIX_ERROR_SYSTEM_PROMPT, \
     CREATE_TESTS_SYSTEM_PROMPT, UPDATE_TESTS_CODE_PROMPT, \
-    POSTPROCESS_CODE_SYSTEM_PROMPT
-from agent.tools import run_code_in_sandbox, parse_stack_trace, create_python_file_and_lookup_inspections
+    POSTPROCESS_CODE_SYSTEM_PROMPT, SUMMARIZE_HISTORY_PROMPT, ONE_SHOT_FIX_SYSTEM_PROMPT
+from agent.test_harness import failed_tests
+from agent.validation import validate_code as find_static_error, format_error, same_interpreter
+from agent.tools import run_code_in_sandbox, arun_code_in_sandbox, parse_stack_trace, \
+    create_python_file_and_lookup_inspections, exception_summary
+
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
+
+_model = None
+
+
+@functools.lru_cache(maxsize=None)
+def default_model_name() -> str:
+    # read on first use, not on import: config.yaml is only needed once a model is actually asked
+    return parse_config("config.yaml")["model_name"]
+
+
+def create_model(model_name: str, max_connections: int = 32, timeout: float = 600) -> "ChatOpenAI":
+    """
+    Chat model with its own pooled HTTP clients: connections are kept alive and reused between calls.
+    :param max_connections: connections to the API kept open at the same time (per client, sync and async)
+    :param timeout: seconds a request may take
+    """
+    # the OpenAI client takes a large part of the import time, it is imported only when a model is created
+    import httpx
+    from dotenv import load_dotenv
+    from langchain_openai import ChatOpenAI
+
+    load_dotenv()
+
+    # every request is counted in the running LLM call, so client retries show up in the trace
+    async def _acount_request(_request) -> None:
+        tracing.count_request()
+
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    return ChatOpenAI(
+        model=model_name,
+        temperature=0,
+        max_retries=2,
+        max_tokens=None,
+        http_client=httpx.Client(limits=limits, timeout=timeout,
+                                 event_hooks={"request": [lambda _request: tracing.count_request()]}),
+        http_async_client=httpx.AsyncClient(limits=limits, timeout=timeout,
+                                            event_hooks={"request": [_acount_request]}),
+    )
 
-load_dotenv()
 
-model = ChatOpenAI(
-    model=parse_config("config.yaml")["model_name"],
-    temperature=0,
-    max_retries=2,
-    max_tokens=None,
-)
+def _configurable() -> dict:
+    # a run can bring its own model in config["configurable"] (see AgentSession), outside a run there is none
+    try:
+        return get_config().get("configurable", {})
+    except RuntimeError:
+        return {}
+
+
+def get_model_name() -> str:
+    return _configurable().get("model_name") or default_model_name()
+
+
+def get_model() -> BaseChatModel:
+    """
+    The run's model: config["configurable"]["model"], or the one its "model_factory" (see AgentSession) gives for
+    the run's model_name. Only called on an LLM cache miss.
+    """
+    configurable = _configurable()
+    if configurable.get("model") is not None:
+        return configurable["model"]
+    if configurable.get("model_factory") is not None:
+        return configurable["model_factory"](get_model_name())
+    # created on first use: a run replayed from the LLM cache never needs an API key
+    global _model
+    if _model is None:
+        _model = create_model(default_model_name())
+    return _model
+
+
+@functools.lru_cache(maxsize=None)
+def _created_model(model_name: str) -> "ChatOpenAI":
+    return create_model(model_name)
+
+
+def get_tier_model(model_name: Optional[str]) -> BaseChatModel:
+    """
+    Model of a cascade tier (cascade_model). None or the run's model name is the run's own model, another name is
+    given by config["configurable"]["model_factory"] (see AgentSession) or created on first use.
+    """
+    if model_name is None or model_name == get_model_name():
+        return get_model()
+    factory = _configurable().get("model_factory")
+    return factory(model_name) if factory is not None else _created_model(model_name)
+
+
+def _invoke(model_name: str, messages: list[BaseMessage], call, tools: Optional[list] = None) -> BaseMessage:
+    with tracing.call("llm") as record:
+        out = get_cached_llm().invoke(model_name, messages, call, tools=tools)
+        tracing.record_usage(record, out)
+    return out
+
+
+async def _ainvoke(model_name: str, messages: list[BaseMessage], acall, tools: Optional[list] = None) -> BaseMessage:
+    with tracing.call("llm") as record:
+        out = await get_cached_llm().ainvoke(model_name, messages, acall, tools=tools)
+        tracing.record_usage(record, out)
+    return out
+
+
+def _streamed_message(scanner: JsonBlockScanner, chunks: Optional[BaseMessage], messages: list[BaseMessage],
+                      first_token_seconds: Optional[float]) -> BaseMessage:
+    tracing.annotate(streamed=True, cut_off=scanner.complete, first_token_seconds=first_token_seconds)
+    usage = getattr(chunks, "usage_metadata", None)
+    if not usage:
+        # a stream that is cut off never gets to the usage chunk at its end
+        prompt_tokens = count_tokens(messages, get_model_name())
+        completion_tokens = count_tokens([AIMessage(content=scanner.answer())], get_model_name())
+        usage = {"input_tokens": prompt_tokens, "output_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+    return AIMessage(content=scanner.answer(), usage_metadata=usage)
+
+
+def _stream_json(model, messages: list[BaseMessage]) -> BaseMessage:
+    """
+    Streams an answer in the ```json format of the prompts and stops reading it as soon as its block is complete,
+    the rest of the completion is not waited for.
+    """
+    scanner = JsonBlockScanner()
+    chunks = None
+    first_token_seconds = None
+    t0 = time.perf_counter()
+    stream = model.stream(messages)
+    try:
+        for chunk in stream:
+            if first_token_seconds is None:
+                first_token_seconds = round(time.perf_counter() - t0, 4)
+            chunks = chunk if chunks is None else chunks + chunk
+            if scanner.feed(chunk.content if isinstance(chunk.content, str) else ""):
+                break
+    finally:
+        # closes the HTTP response of a cut off stream
+        stream.close()
+    return _streamed_message(scanner, chunks, messages, first_token_seconds)
+
+
+async def _astream_json(model, messages: list[BaseMessage]) -> BaseMessage:
+    scanner = JsonBlockScanner()
+    chunks = None
+    first_token_seconds = None
+    t0 = time.perf_counter()
+    stream = model.astream(messages)
+    try:
+        async for chunk in stream:
+            if first_token_seconds is None:
+                first_token_seconds = round(time.perf_counter() - t0, 4)
+            chunks = chunk if chunks is None else chunks + chunk
+            if scanner.feed(chunk.content if isinstance(chunk.content, str) else ""):
+                break
+    finally:
+        await stream.aclose()
+    return _streamed_message(scanner, chunks, messages, first_token_seconds)
+
+
+def call_llm(messages: list[BaseMessage], stream: bool = False):
+    """
+    :param stream: the answer is in the ```json format, stream it and stop at the end of the block (see stream_llm)
+    """
+    if stream:
+        return _invoke(get_model_name(), messages, lambda: _stream_json(get_model(), messages))
+    return _invoke(get_model_name(), messages, lambda: get_model().invoke(messages))
+
+
+def call_tier_llm(model_name: Optional[str], messages: list[BaseMessage], stream: bool = False):
+    """
+    call_llm with the model of a cascade tier, see get_tier_model.
+    """
+    name = model_name or get_model_name()
+    if stream:
+        return _invoke(name, messages, lambda: _stream_json(get_tier_model(model_name), messages))
+    return _invoke(name, messages, lambda: get_tier_model(model_name).invoke(messages))
 
 
-def call_llm(messages: list[BaseMessage]):
-    return model.invoke(messages)
+def call_llm_with_tools(messages: list[BaseMessage], _tools):
+    return _invoke(get_model_name(), messages, lambda: get_model().bind_tools(_tools).invoke(messages), tools=_tools)
 
 
-def call_llm_with_tools(messages: list[BaseMessage], _tools):
-    _model = model.bind_tools(_tools)
-    return _model.invoke(messages)
+def call_llm_sampled(messages: list[BaseMessage], temperature: float, sample: int, stream: bool = False):
+    # the sample number is part of the cache key, otherwise every sample would be replayed as the same response
+    name = f"{get_model_name()}@{temperature}#{sample}"
+    if stream:
+        return _invoke(name, messages, lambda: _stream_json(get_model().bind(temperature=temperature), messages))
+    return _invoke(name, messages, lambda: get_model().bind(temperature=temperature).invoke(messages))
 
 
-def analyze_code(state: AgentState) -> dict:
+async def acall_llm(messages: list[BaseMessage], stream: bool = False):
+    if stream:
+        return await _ainvoke(get_model_name(), messages, lambda: _astream_json(get_model(), messages))
+    return await _ainvoke(get_model_name(), messages, lambda: get_model().ainvoke(messages))
+
+
+async def acall_tier_llm(model_name: Optional[str], messages: list[BaseMessage], stream: bool = False):
+    name = model_name or get_model_name()
+    if stream:
+        return await _ainvoke(name, messages, lambda: _astream_json(get_tier_model(model_name), messages))
+    return await _ainvoke(name, messages, lambda: get_tier_model(model_name).ainvoke(messages))
+
+
+async def acall_llm_with_tools(messages: list[BaseMessage], _tools):
+    return await _ainvoke(get_model_name(), messages, lambda: get_model().bind_tools(_tools).ainvoke(messages),
+                          tools=_tools)
+
+
+async def acall_llm_sampled(messages: list[BaseMessage], temperature: float, sample: int, stream: bool = False):
+    name = f"{get_model_name()}@{temperature}#{sample}"
+    if stream:
+        return await _ainvoke(name, messages,
+                              lambda: _astream_json(get_model().bind(temperature=temperature), messages))
+    return await _ainvoke(name, messages, lambda: get_model().bind(temperature=temperature).ainvoke(messages))
+
+
+def _summarize_history(messages: list[BaseMessage]) -> str:
+    transcript = "\n\n".join(f"{message.type}: {message.content}" for message in messages)
+    return call_llm([SUMMARIZE_HISTORY_PROMPT, HumanMessage(content=transcript)]).content
+
+
+def _compact(state: AgentState, messages: list[BaseMessage], node: str) -> tuple[list[BaseMessage], dict]:
+    """
+    Prompt that is actually sent: the history fitted into history_token_budget. The state keeps the full history.
+    """
+    summarizer = _summarize_history if state.get("history_summarize") else None
+    prompt, stats = compact_history(messages, state.get("history_token_budget"), get_model_name(),
+                                    summarizer=summarizer)
+    return prompt, {"node": node, "iter": state["iter"], **stats}
+
+
+async def _acompact(state: AgentState, messages: list[BaseMessage], node: str) -> tuple[list[BaseMessage], dict]:
+    # tokenizing and the optional summary call are blocking
+    return await asyncio.to_thread(_compact, state, messages, node)
+
+
+# Every node that talks to the model is split into the prompt and the state update around the call,
+# so the sync nodes and their async versions (a-prefixed, used by run_agent_async) share everything but the call.
+
+def _analyze_code_prompt(state: AgentState) -> list[BaseMessage]:
     human_message_content = f"Initial buggy code: {state['code']}"
     if state["docstring"] is not None:
         human_message_content += f"\nDocstring for the function: {state['docstring']}"
     if state["tests"] is not None:
         human_message_content += f"\nTests for the function: {state['tests']}"
 
-    messages = [ANALYZE_CODE_SYSTEM_PROMPT] + state["messages"] + [HumanMessage(content=human_message_content)]
+    return [ANALYZE_CODE_SYSTEM_PROMPT] + state["messages"] + [HumanMessage(content=human_message_content)]
 
-    out = call_llm(messages)
+
+def _analyze_code_update(messages: list[BaseMessage], out: BaseMessage, stats: dict) -> dict:
     messages.append(out)
     messages.pop(0)
-    return {"messages": messages, "phase": "analyze_code"}
+    return {"messages": messages, "phase": "analyze_code", "history_stats": [stats]}
 
 
-def run_code(state: AgentState) -> dict:
-    run_result = run_code_in_sandbox.invoke({"code": state["code"], "tests": state["tests"]})
+def _cached_tests(state: AgentState) -> dict:
+    """
+    Tests that a fix of the same function (same signature and docstring) passed in an earlier run,
+    see agent.test_cache. With a hit create_tests is skipped.
+    """
+    if state["tests"] is not None:
+        return {}
+    key = test_cache.tests_key(state["code"], state["docstring"])
+    tests = test_cache.lookup(key)
+    if tests is None:
+        return {"tests_key": key}
+    return {"tests_key": key, "tests": tests, "tests_source": "cache"}
+
+
+def analyze_code(state: AgentState) -> dict:
+    tests_update = _cached_tests(state)
+    messages = _analyze_code_prompt({**state, **tests_update})
+    prompt, stats = _compact(state, messages, "analyze_code")
+    return {**_analyze_code_update(messages, call_llm(prompt), stats), **tests_update}
+
+
+async def aanalyze_code(state: AgentState) -> dict:
+    tests_update = _cached_tests(state)
+    messages = _analyze_code_prompt({**state, **tests_update})
+    prompt, stats = await _acompact(state, messages, "analyze_code")
+    return {**_analyze_code_update(messages, await acall_llm(prompt), stats), **tests_update}
+
+
+def _one_shot_fix_prompt(state: AgentState) -> list[BaseMessage]:
+    human_message_content = f"Buggy code: {state['code']}"
+    if state["docstring"] is not None:
+        human_message_content += f"\nDocstring for the function: {state['docstring']}"
+    return [ONE_SHOT_FIX_SYSTEM_PROMPT, HumanMessage(content=human_message_content)]
+
+
+def _one_shot_fix_update(state: AgentState, out: BaseMessage, tests_update: dict) -> dict:
+    code = _parse_code(out, state["code"])
+    # tests left in the answer are removed like in postprocess_code, without an LLM fallback
+    code = strip_tests(code) or code
+    return {"messages": state["messages"] + [out], "phase": "one_shot_fix", "code": code, "escalated": False,
+            **tests_update}
+
+
+def one_shot_fix(state: AgentState) -> dict:
+    """
+    First tier of the cascade: the whole fix in one call to cascade_model. It is then checked like any fix (tests,
+    validate_code, run_code), a failed check escalates to the full graph (see escalate).
+    """
+    tests_update = _cached_tests(state)
+    out = call_tier_llm(state.get("cascade_model"), _one_shot_fix_prompt(state), state.get("stream_llm", False))
+    return _one_shot_fix_update(state, out, tests_update)
+
+
+async def aone_shot_fix(state: AgentState) -> dict:
+    tests_update = _cached_tests(state)
+    out = await acall_tier_llm(state.get("cascade_model"), _one_shot_fix_prompt(state),
+                               state.get("stream_llm", False))
+    return _one_shot_fix_update(state, out, tests_update)
+
+
+def escalate(state: AgentState) -> dict:
+    """
+    The one-shot fix failed its check: the full graph starts over from the original code with the run's own model.
+    The failed attempt and its result stay in the history, the tests are kept.
+    """
+    human_msg = HumanMessage(
+        content="[escalate] the one-shot fix above did not pass, the original code is fixed step by step now.",
+        name="escalate",
+    )
+    return {"messages": state["messages"] + [human_msg], "phase": "escalate", "code": state["original_code"],
+            "escalated": True, "run_result": None, "error_summary": None, "static_error": None,
+            "failed_tests": None}
+
+
+def validate_code(state: AgentState) -> dict:
+    """
+    Compiles the code and the tests in-process and resolves their names (see agent.validation). An error is reported
+    like a failed run, so fix_code gets it without a sandbox run and an analyze_error round-trip.
+    """
+    if not state.get("validate_code", True) or not same_interpreter():
+        return {"static_error": None}
+    error = find_static_error(state["code"], state["tests"])
+    if error is None:
+        return {"static_error": None}
+    error_text = format_error(error)
+    human_msg = HumanMessage(
+        content=f"[validate_code] the code was not run, it has a static error:\n"
+                f"{json.dumps(error, ensure_ascii=False, indent=2)}",
+        name="validate_code",
+    )
+    run_result = RunResult(success=False, stdout="", stderr=error_text, return_code=1, tests_passed=False)
+    return {"messages": state["messages"] + [human_msg], "phase": "validate_code", "static_error": error,
+            "run_result": run_result, "error_summary": error_text}
+
+
+async def avalidate_code(state: AgentState) -> dict:
+    # compiling is CPU-bound and fast, but the first call asks the sandbox interpreter for its version
+    return await asyncio.to_thread(validate_code, state)
+
+
+def _run_code_args(state: AgentState) -> dict:
+    sandbox_args = {"code": state["code"], "tests": state["tests"]}
+    previously_failed = state.get("failed_tests") or []
+    if state.get("split_tests"):
+        # after the first run only the known failures are interesting: they go first and the run stops on a failure
+        sandbox_args.update(split_tests=True, priority=previously_failed, fail_fast=bool(previously_failed))
+    return sandbox_args
+
+
+def _run_code_update(state: AgentState, run_result: RunResult) -> dict:
     human_msg = HumanMessage(
         content=f"[run_code_in_sandbox] result:\n{json.dumps(run_result, ensure_ascii=False, indent=2)}",
         name="run_code_in_sandbox",
     )
-    return {"messages": state["messages"] + [human_msg], "phase": "run_code", "run_result": run_result}
+    update = {"messages": state["messages"] + [human_msg], "phase": "run_code", "run_result": run_result}
+    if run_result["success"] and state["tests"] and state.get("tests_source") != "cache":
+        # the tests are kept once a fix passed them
+        test_cache.store(state.get("tests_key"), state["tests"])
+    if run_result.get("test_results") is not None:
+        update["failed_tests"] = failed_tests(run_result["test_results"], state.get("failed_tests"))
+    return update
 
 
-def create_tests(state: AgentState) -> dict:
-    messages = [CREATE_TESTS_SYSTEM_PROMPT] + [HumanMessage(content=f"code: {state['code']}"
-                                                                    f"docstring: {state['docstring']}")]
-    out = call_llm(messages)
+def run_code(state: AgentState) -> dict:
+    return _run_code_update(state, run_code_in_sandbox.invoke(_run_code_args(state)))
+
+
+async def arun_code(state: AgentState) -> dict:
+    return _run_code_update(state, await arun_code_in_sandbox(**_run_code_args(state)))
+
+
+def _check_performance_update(state: AgentState, profile: Optional[dict], baseline: dict) -> dict:
+    update = {"phase": "check_performance", "performance_baseline": baseline}
+    if profile is None:
+        # nothing to time or the profiling run failed, the fix is taken as it is
+        return update
+    result = performance.compare(profile, baseline or None, state["performance_factor"],
+                                 state["performance_max_exponent"])
+    human_msg = HumanMessage(content=f"[check_performance] result:\n{json.dumps(result, indent=2)}",
+                             name="check_performance")
+    update["messages"] = state["messages"] + [human_msg]
+    update["run_result"] = {**state["run_result"], "performance": result}
+    return update
+
+
+def check_performance(state: AgentState) -> dict:
+    """
+    Profiles the code that passed the tests against the original code, see agent.performance.
+    A fix that is much slower or grows faster with the input goes to analyze_error.
+    """
+    baseline = state.get("performance_baseline")
+    if baseline is None:
+        baseline = performance.measure(state["original_code"], state["tests"], state["performance_timeout"]) or {}
+    profile = performance.measure(state["code"], state["tests"], state["performance_timeout"])
+    return _check_performance_update(state, profile, baseline)
+
+
+async def acheck_performance(state: AgentState) -> dict:
+    baseline = state.get("performance_baseline")
+    if baseline is None:
+        baseline = await performance.ameasure(state["original_code"], state["tests"],
+                                              state["performance_timeout"]) or {}
+    profile = await performance.ameasure(state["code"], state["tests"], state["performance_timeout"])
+    return _check_performance_update(state, profile, baseline)
+
+
+def _create_tests_prompt(state: AgentState) -> list[BaseMessage]:
+    # the original code, a one-shot fix of the cascade must not shape the tests it is checked with
+    code = state.get("original_code") or state["code"]
+    return [CREATE_TESTS_SYSTEM_PROMPT] + [HumanMessage(content=f"code: {code}"
+                                                                f"docstring: {state['docstring']}")]
+
+
+def _create_tests_update(state: AgentState, out: BaseMessage) -> dict:
     messages = state["messages"] + [out]
+    attempts = state.get("test_attempts", 0) + 1
     try:
-        return {"messages": messages, "tests": parse_json_content(out.content)}
+        tests = parse_json_content(out.content)
     except (JSONDecodeError, KeyError, AttributeError, TypeError, ValueError):
-        return {"messages": messages}
+        tests = None
+    if not tests:
+        # retried until max_test_attempts, then the code is run without tests (see graph.after_tests)
+        return {"messages": messages, "test_attempts": attempts}
+    return {"messages": messages, "tests": tests, "tests_source": "llm", "test_attempts": attempts}
 
 
-def analyze_error(state: AgentState) -> dict:
-    stdout = state["run_result"]["stdout"]
-    stderr = state["run_result"]["stderr"]
+def create_tests(state: AgentState) -> dict:
+    return _create_tests_update(state, call_llm(_create_tests_prompt(state), state.get("stream_llm", False)))
+
+
+async def acreate_tests(state: AgentState) -> dict:
+    return _create_tests_update(state, await acall_llm(_create_tests_prompt(state), state.get("stream_llm", False)))
 
-    human_message = HumanMessage(content=
-                                 f"Here are stdout and stderr to fix: {stdout} and {stderr}")
-    messages = [ANALYZE_ERROR_SYSTEM_PROMPT] + state["messages"] + [human_message]
 
-    _tools = [
-        parse_stack_trace]
+def _slow_fix(run_result: RunResult) -> Optional[dict]:
+    result = run_result.get("performance")
+    return result if result is not None and not result["passed"] else None
+
+
+def _analyze_error_prompt(state: AgentState) -> tuple[list[BaseMessage], list]:
+    stdout = state["run_result"]["stdout"]
+    stderr = state["run_result"]["stderr"]
+    exception = state["run_result"].get("exception")
+    slow = _slow_fix(state["run_result"])
+
+    content = f"Here are stdout and stderr to fix: {stdout} and {stderr}"
+    if slow is not None:
+        # the tests pass, there is no error to parse
+        content = (f"The code passes the tests, but it is too slow: {'; '.join(slow['reasons'])}. Measurements: "
+                   f"{json.dumps(slow)}")
+        _tools = []
+    elif exception is not None:
+        # the sandbox already parsed the exception, there is no stack trace left to parse with a tool call
+        content += f"\nThe exception, with the frames of the code and the failed assert: {json.dumps(exception)}"
+        _tools = []
+    else:
+        _tools = [parse_stack_trace]
+    messages = [ANALYZE_ERROR_SYSTEM_PROMPT] + state["messages"] + [HumanMessage(content=content)]
 
     if state["run_inspections"]:
         _tools.append(create_python_file_and_lookup_inspections)
 
+    return messages, _tools
+
+
+def _analyze_error_update(state: AgentState, messages: list[BaseMessage], out: BaseMessage, _tools: list,
+                          stats: dict) -> dict:
     _tool_map = {t.name: t for t in _tools}
-    out = call_llm_with_tools(messages, _tools)
 
     messages.append(out)
     messages.pop(0)
 
-    _error_summary = None
+    exception = state["run_result"].get("exception")
+    slow = _slow_fix(state["run_result"])
+    if slow is not None:
+        _error_summary = "Too slow: " + "; ".join(slow["reasons"])
+    else:
+        _error_summary = exception_summary(exception) if exception is not None else None
 
     if hasattr(out, "tool_calls"):
         for tool_call in out.tool_calls:
@@ -107,41 +536,196 @@ def analyze_error(state: AgentState) -> dict:
                 )
             )
 
-    return {"messages": messages, "phase": "analyze_error", "error_summary": _error_summary}
+    return {"messages": messages, "phase": "analyze_error", "error_summary": _error_summary,
+            "history_stats": [stats]}
 
 
-def fix_code(state: AgentState) -> dict:
+def analyze_error(state: AgentState) -> dict:
+    messages, _tools = _analyze_error_prompt(state)
+    prompt, stats = _compact(state, messages, "analyze_error")
+    out = call_llm_with_tools(prompt, _tools) if _tools else call_llm(prompt)
+    return _analyze_error_update(state, messages, out, _tools, stats)
+
+
+async def aanalyze_error(state: AgentState) -> dict:
+    messages, _tools = _analyze_error_prompt(state)
+    prompt, stats = await _acompact(state, messages, "analyze_error")
+    out = await acall_llm_with_tools(prompt, _tools) if _tools else await acall_llm(prompt)
+    # the inspections tool may run PyCharm in a subprocess (inspections_backend), it must not block the event loop
+    return await asyncio.to_thread(_analyze_error_update, state, messages, out, _tools, stats)
+
+
+def _fix_tests_prompt(state: AgentState) -> list[BaseMessage]:
     # update tests code if there was a logical error in them...
-    tests_messages = [UPDATE_TESTS_CODE_PROMPT] + state["messages"] + [
-        HumanMessage(content=f"Tests code: {state['tests']}")]
-    tests_message = call_llm(tests_messages)
+    return [UPDATE_TESTS_CODE_PROMPT] + state["messages"] + [HumanMessage(content=f"Tests code: {state['tests']}")]
+
 
+def _fix_code_prompt(state: AgentState, tests_message: BaseMessage) -> list[BaseMessage]:
     # update current code
-    code_messages = [FIX_ERROR_SYSTEM_PROMPT] + state["messages"] + [tests_message]
-    code_message = call_llm(code_messages)
+    return [FIX_ERROR_SYSTEM_PROMPT] + state["messages"] + [tests_message]
 
-    try:
-        new_tests = parse_json_content(tests_message.content)
-    except (JSONDecodeError, KeyError, AttributeError, TypeError, ValueError):
-        new_tests = state["tests"]
 
+def _parse_code(message: BaseMessage, default: str) -> str:
     try:
-        new_code = parse_json_content(code_message.content)
+        return parse_json_content(message.content)
     except (JSONDecodeError, KeyError, AttributeError, TypeError, ValueError):
-        new_code = state["code"]
+        return default
+
+
+def _fix_code_update(state: AgentState, tests_message: BaseMessage, code_message: BaseMessage, stats: list[dict],
+                     speculation: Optional[dict] = None) -> dict:
+    new_tests = _parse_code(tests_message, state["tests"])
+    new_code = _parse_code(code_message, state["code"])
+
+    update = {"messages": state["messages"] + [tests_message, code_message], "phase": "fix_error", "tests": new_tests,
+              "code": new_code, "history_stats": stats}
+    if speculation is not None:
+        update["speculation"] = speculation
+    return update
+
+
+def _speculation_stats(state: AgentState, winner: Optional[int]) -> dict:
+    stats = dict(state.get("speculation") or {"rounds": 0, "passed": 0, "won_by_alternative": 0})
+    stats["rounds"] += 1
+    if winner is not None:
+        stats["passed"] += 1
+        if winner != 0:
+            stats["won_by_alternative"] += 1
+    return stats
+
+
+def _first_answer(attempts: list, candidate: Callable[[tuple], BaseMessage]) -> BaseMessage:
+    """
+    Result of a round without a passing candidate: the first candidate (in sample order) that got an answer. Only if
+    every candidate failed, the error of candidate 0 is raised.
+    :param attempts: finished futures or tasks of the candidates, in sample order
+    :param candidate: gets the answer out of the result of an attempt
+    """
+    for attempt in attempts:
+        if attempt.exception() is None:
+            return candidate(attempt.result())
+    return attempts[0].result()
+
+
+def _speculate(state: AgentState, messages: list[BaseMessage], tests_message: BaseMessage) -> tuple[BaseMessage, dict]:
+    """
+    Asks for speculative_k fixes at once and runs each one in the sandbox as soon as it arrives,
+    the first passing one wins. Candidate 0 is the usual deterministic answer, the others are sampled.
+    Without a passing candidate the result is candidate 0. A candidate that fails (e.g. a rate-limited call) only
+    counts as not passing.
+    """
+    tests = _parse_code(tests_message, state["tests"])
+    decided = threading.Event()
+
+    def _attempt(sample: int) -> tuple[BaseMessage, bool]:
+        # a candidate still running once the round is decided does not start its sandbox run, a running one is killed
+        with sandbox.cancel_on(decided):
+            if sample == 0:
+                candidate = call_llm(messages, state.get("stream_llm", False))
+            else:
+                candidate = call_llm_sampled(messages, state["speculative_temperature"], sample,
+                                             state.get("stream_llm", False))
+            if decided.is_set():
+                return candidate, False
+            result = run_code_in_sandbox.invoke({"code": _parse_code(candidate, state["code"]), "tests": tests})
+            return candidate, result["success"]
+
+    # model calls and sandbox runs wait on the network and on child processes, threads are enough.
+    # The threads inherit the run's context, so they use the same model as the node
+    pool = ContextThreadPoolExecutor(max_workers=state["speculative_k"])
+    attempts = [pool.submit(_attempt, sample) for sample in range(state["speculative_k"])]
+    try:
+        for attempt in as_completed(attempts):
+            if attempt.exception() is None and attempt.result()[1]:
+                return attempt.result()[0], _speculation_stats(state, attempts.index(attempt))
+        return _first_answer(attempts, lambda result: result[0]), _speculation_stats(state, None)
+    finally:
+        # the losing attempts are not waited for, but they stop before or during their sandbox run
+        decided.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def _aspeculate(state: AgentState, messages: list[BaseMessage],
+                      tests_message: BaseMessage) -> tuple[BaseMessage, dict]:
+    tests = _parse_code(tests_message, state["tests"])
+
+    async def _attempt(sample: int) -> tuple[int, BaseMessage, bool]:
+        if sample == 0:
+            candidate = await acall_llm(messages, state.get("stream_llm", False))
+        else:
+            candidate = await acall_llm_sampled(messages, state["speculative_temperature"], sample,
+                                                state.get("stream_llm", False))
+        result = await arun_code_in_sandbox(_parse_code(candidate, state["code"]), tests)
+        return sample, candidate, result["success"]
+
+    attempts = [asyncio.ensure_future(_attempt(sample)) for sample in range(state["speculative_k"])]
+    try:
+        for attempt in asyncio.as_completed(attempts):
+            try:
+                sample, candidate, passed = await attempt
+            except Exception:
+                continue
+            if passed:
+                return candidate, _speculation_stats(state, sample)
+        return _first_answer(attempts, lambda result: result[1]), _speculation_stats(state, None)
+    finally:
+        for attempt in attempts:
+            if attempt.done() and not attempt.cancelled():
+                # a loser that failed before the round was decided, its error is not reported
+                attempt.exception()
+            attempt.cancel()
+
+
+def fix_code(state: AgentState) -> dict:
+    tests_prompt, tests_stats = _compact(state, _fix_tests_prompt(state), "fix_code/tests")
+    tests_message = call_llm(tests_prompt, state.get("stream_llm", False))
+    code_prompt, code_stats = _compact(state, _fix_code_prompt(state, tests_message), "fix_code/code")
+    if state.get("speculative_k", 1) > 1:
+        code_message, speculation = _speculate(state, code_prompt, tests_message)
+        return _fix_code_update(state, tests_message, code_message, [tests_stats, code_stats], speculation)
+    code_message = call_llm(code_prompt, state.get("stream_llm", False))
+    return _fix_code_update(state, tests_message, code_message, [tests_stats, code_stats])
+
 
-    return {"messages": state["messages"] + [tests_message, code_message], "phase": "fix_error", "tests": new_tests,
-            "code": new_code}
+async def afix_code(state: AgentState) -> dict:
+    tests_prompt, tests_stats = await _acompact(state, _fix_tests_prompt(state), "fix_code/tests")
+    tests_message = await acall_llm(tests_prompt, state.get("stream_llm", False))
+    code_prompt, code_stats = await _acompact(state, _fix_code_prompt(state, tests_message), "fix_code/code")
+    if state.get("speculative_k", 1) > 1:
+        code_message, speculation = await _aspeculate(state, code_prompt, tests_message)
+        return _fix_code_update(state, tests_message, code_message, [tests_stats, code_stats], speculation)
+    code_message = await acall_llm(code_prompt, state.get("stream_llm", False))
+    return _fix_code_update(state, tests_message, code_message, [tests_stats, code_stats])
+
+
+def _postprocess_stats(state: AgentState, llm_fallback: bool) -> dict:
+    stats = dict(state.get("postprocess") or {"runs": 0, "llm_fallbacks": 0})
+    stats["runs"] += 1
+    if llm_fallback:
+        stats["llm_fallbacks"] += 1
+    return stats
+
+
+def _postprocess_code_update(state: AgentState, out: BaseMessage, stats: dict) -> dict:
+    return {"code": _parse_code(out, state["code"]), "history_stats": [stats],
+            "postprocess": _postprocess_stats(state, llm_fallback=True)}
 
 
 def postprocess_code(state: AgentState) -> dict:
-    messages = [POSTPROCESS_CODE_SYSTEM_PROMPT] + state["messages"]
-    out = call_llm(messages)
-    try:
-        new_code = parse_json_content(out.content)
-    except (JSONDecodeError, KeyError, AttributeError, TypeError, ValueError):
-        new_code = state["code"]
-    return {"code": new_code}
+    # tests left in the code are removed by the AST, the LLM is only asked when the code cannot be parsed
+    stripped = strip_tests(state["code"])
+    if stripped is not None:
+        return {"code": stripped, "postprocess": _postprocess_stats(state, llm_fallback=False)}
+    prompt, stats = _compact(state, [POSTPROCESS_CODE_SYSTEM_PROMPT] + state["messages"], "postprocess_code")
+    return _postprocess_code_update(state, call_llm(prompt, state.get("stream_llm", False)), stats)
+
+
+async def apostprocess_code(state: AgentState) -> dict:
+    stripped = strip_tests(state["code"])
+    if stripped is not None:
+        return {"code": stripped, "postprocess": _postprocess_stats(state, llm_fallback=False)}
+    prompt, stats = await _acompact(state, [POSTPROCESS_CODE_SYSTEM_PROMPT] + state["messages"], "postprocess_code")
+    return _postprocess_code_update(state, await acall_llm(prompt, state.get("stream_llm", False)), stats)
 
 
 def add_iter(state: AgentState):
@@ -0,0 +1,349 @@
+import ast
+import json
+import math
+from string import Template
+from typing import Optional
+
+from agent import tracing
+from agent.model import PerformanceResult
+from agent.sandbox import execute, aexecute
+from agent.test_harness import CHECK_FUNCTION
+
+PROFILE_MARKER = "__PERFORMANCE_PROFILE__"
+# the file name of the profiling run, tracebacks of a crashing profile refer to it
+FILENAME = "profiled_code.py"
+# the most test inputs timed, the first ones are taken
+MAX_INPUTS = 20
+# the input with the longest sequences is repeated to at least this length, then doubled SCALE_STEPS - 1 times
+MIN_SCALED_LENGTH = 64
+SCALE_STEPS = 5
+# CPU seconds a call (or a batch of fast calls) may take before it is stopped
+CALL_BUDGET = 1.0
+# fast calls are repeated until a batch takes this many CPU seconds, so they are measurable
+MIN_SAMPLE = 0.005
+# per-call CPU seconds below which a slowdown is noise, not worth a fix
+MIN_FLAGGED_SECONDS = 0.001
+# calls faster than this are left out of the growth fit
+MIN_FIT_SECONDS = 1e-5
+# an exponent is only worse than the baseline's by more than this
+GROWTH_TOLERANCE = 0.5
+# peak RSS increase (KiB) below which memory is not compared
+MIN_FLAGGED_RSS_KB = 16 * 1024
+
+# Appended to the code for a profiling run. RSS is taken first, one call per input, before the copies of the inputs
+# that timing needs inflate it. Then every input that finished is timed and the scaled input is timed at growing sizes.
+_PROFILER = Template('''
+
+def _performance_run(_name, _inputs, _scaled, _factors, _call_budget, _min_sample):
+    import copy as _copy
+    import json as _json
+    import resource as _resource
+    import signal as _signal
+    import sys as _sys
+
+    _function = globals()[_name]
+
+    class _Budget(BaseException):
+        # not an Exception, so that the code's own `except Exception` does not swallow it
+        pass
+
+    def _on_budget(_signum, _frame):
+        raise _Budget()
+
+    def _cpu():
+        _usage = _resource.getrusage(_resource.RUSAGE_SELF)
+        return _usage.ru_utime + _usage.ru_stime
+
+    def _rss_kb():
+        _rss = _resource.getrusage(_resource.RUSAGE_SELF).ru_maxrss
+        return _rss // 1024 if _sys.platform == "darwin" else _rss
+
+    def _call(_args, _kwargs):
+        try:
+            _function(*_args, **_kwargs)
+            return False
+        except Exception:
+            return True
+
+    def _measure(_args, _kwargs):
+        _number = 1
+        while True:
+            _calls = [_copy.deepcopy((_args, _kwargs)) for _ in range(_number)]
+            _raised = False
+            _signal.setitimer(_signal.ITIMER_PROF, _call_budget)
+            _start = _cpu()
+            try:
+                for _call_args, _call_kwargs in _calls:
+                    _raised = _call(_call_args, _call_kwargs) or _raised
+            except _Budget:
+                return {"seconds": None, "raised": _raised}
+            finally:
+                _signal.setitimer(_signal.ITIMER_PROF, 0)
+            _elapsed = _cpu() - _start
+            if _elapsed >= _min_sample or _number >= 1000:
+                return {"seconds": _elapsed / _number, "raised": _raised}
+            _number *= 10
+
+    def _scale(_value, _factor):
+        return _value * _factor if isinstance(_value, (list, tuple, str, bytes)) else _value
+
+    _signal.signal(_signal.SIGPROF, _on_budget)
+    _rss_start = _rss_kb()
+    _finished = []
+    for _args, _kwargs in _inputs:
+        _signal.setitimer(_signal.ITIMER_PROF, _call_budget)
+        try:
+            _call(*_copy.deepcopy((_args, _kwargs)))
+            _finished.append(True)
+        except _Budget:
+            _finished.append(False)
+        finally:
+            _signal.setitimer(_signal.ITIMER_PROF, 0)
+    _peak_rss_kb = _rss_kb() - _rss_start
+
+    # an input that ran out of its budget once is not timed again
+    _timed = [_measure(_args, _kwargs) if _done else {"seconds": None, "raised": False}
+              for (_args, _kwargs), _done in zip(_inputs, _finished)]
+    _scaled_seconds = []
+    if _scaled is not None:
+        for _factor in _factors:
+            _args = [_scale(_value, _factor) for _value in _scaled[0]]
+            _kwargs = {_key: _scale(_value, _factor) for _key, _value in _scaled[1].items()}
+            _seconds = _measure(_args, _kwargs)["seconds"]
+            _scaled_seconds.append(_seconds)
+            if _seconds is None:
+                # a bigger input would not finish either
+                break
+
+    print("\\n" + $marker + " " + _json.dumps({"inputs": _timed, "scaled_seconds": _scaled_seconds,
+                                              "peak_rss_kb": _peak_rss_kb}))
+
+
+_performance_run($name, $inputs, $scaled, $factors, $call_budget, $min_sample)
+''')
+
+
+def _literal(node: ast.expr) -> bool:
+    try:
+        ast.literal_eval(node)
+        return True
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        return False
+
+
+def _tested_names(code: str, tests: str) -> tuple[Optional[str], set[str]]:
+    """
+    :return: the function the tests check and the names it is called by in them (check()'s parameter too)
+    """
+    tree = ast.parse(tests)
+    code_functions = {node.name for node in ast.parse(code).body
+                      if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))}
+    targets = [node.args[0].id for node in ast.walk(tree)
+               if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == CHECK_FUNCTION
+               and len(node.args) == 1 and isinstance(node.args[0], ast.Name) and node.args[0].id in code_functions]
+    if targets:
+        parameters = {node.args.args[0].arg for node in tree.body
+                      if isinstance(node, ast.FunctionDef) and node.name == CHECK_FUNCTION and node.args.args}
+        return targets[0], parameters | {targets[0]}
+    # tests that call the function directly
+    called = [node.func.id for node in ast.walk(tree)
+              if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in code_functions]
+    if not called:
+        return None, set()
+    name = max(set(called), key=called.count)
+    return name, {name}
+
+
+def test_inputs(code: str, tests: str) -> Optional[tuple[str, list[tuple[str, str]]]]:
+    """
+    The tested function and the arguments it is called with in the tests, as sources of (args tuple, kwargs dict).
+    Only calls whose arguments are all literals are taken.
+    :return: None if the code or the tests cannot be parsed or no such call was found
+    """
+    try:
+        name, callers = _tested_names(code, tests)
+    except (SyntaxError, ValueError):
+        return None
+    if name is None:
+        return None
+
+    inputs = []
+    for node in ast.walk(ast.parse(tests)):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in callers):
+            continue
+        if any(isinstance(arg, ast.Starred) for arg in node.args) or any(kw.arg is None for kw in node.keywords):
+            continue
+        if not all(_literal(arg) for arg in node.args) or not all(_literal(kw.value) for kw in node.keywords):
+            continue
+        args = "(" + "".join(ast.unparse(arg) + ", " for arg in node.args) + ")"
+        kwargs = "{" + ", ".join(f"{kw.arg!r}: {ast.unparse(kw.value)}" for kw in node.keywords) + "}"
+        inputs.append((args, kwargs))
+    return (name, inputs[:MAX_INPUTS]) if inputs else None
+
+
+def _scalable_length(args: str, kwargs: str) -> int:
+    values = list(ast.literal_eval(args)) + list(ast.literal_eval(kwargs).values())
+    return sum(len(value) for value in values if isinstance(value, (list, tuple, str, bytes)))
+
+
+def build_profile(code: str, tests: str) -> Optional[tuple[str, list[int]]]:
+    """
+    The code followed by a profiler of the function the tests call, see _PROFILER.
+    :return: the source and the lengths of the scaled inputs, None if the tests have no literal calls to time
+    """
+    found = test_inputs(code, tests)
+    if found is None:
+        return None
+    name, inputs = found
+
+    scaled, factors, lengths = None, [], []
+    length, args, kwargs = max((_scalable_length(args, kwargs), args, kwargs) for args, kwargs in inputs)
+    if length > 0:
+        scaled = f"({args}, {kwargs})"
+        base = math.ceil(MIN_SCALED_LENGTH / length)
+        factors = [base * 2 ** step for step in range(SCALE_STEPS)]
+        lengths = [length * factor for factor in factors]
+
+    profiler = _PROFILER.substitute(
+        marker=repr(PROFILE_MARKER),
+        name=repr(name),
+        inputs="[" + ", ".join(f"({args}, {kwargs})" for args, kwargs in inputs) + "]",
+        scaled=scaled if scaled is not None else "None",
+        factors=repr(factors),
+        call_budget=repr(CALL_BUDGET),
+        min_sample=repr(MIN_SAMPLE),
+    )
+    return code + "\n" + profiler, lengths
+
+
+def parse_profile(stdout: str, lengths: list[int]) -> Optional[dict]:
+    for line in reversed(stdout.splitlines()):
+        if line.startswith(PROFILE_MARKER + " "):
+            try:
+                profile = json.loads(line[len(PROFILE_MARKER) + 1:])
+            except ValueError:
+                return None
+            profile["lengths"] = lengths[:len(profile["scaled_seconds"])]
+            return profile
+    return None
+
+
+def measure(code: str, tests: Optional[str], timeout: float) -> Optional[dict]:
+    """
+    Profiles the function the tests call in a sandbox run: CPU seconds per test input, on growing copies of the
+    longest input, and the peak RSS increase.
+    :return: None if there is nothing to time or the profiling run did not finish
+    """
+    built = build_profile(code, tests) if tests else None
+    if built is None:
+        return None
+    source, lengths = built
+    with tracing.call("sandbox"):
+        result = execute(source, FILENAME, timeout)
+    return parse_profile(result["stdout"], lengths) if not result["timed_out"] else None
+
+
+async def ameasure(code: str, tests: Optional[str], timeout: float) -> Optional[dict]:
+    built = build_profile(code, tests) if tests else None
+    if built is None:
+        return None
+    source, lengths = built
+    with tracing.call("sandbox"):
+        result = await aexecute(source, FILENAME, timeout)
+    return parse_profile(result["stdout"], lengths) if not result["timed_out"] else None
+
+
+def growth_exponent(lengths: list[int], seconds: list[Optional[float]]) -> Optional[float]:
+    """
+    Slope of log(seconds) over log(length): about 1 for linear code, 2 for quadratic, growing with the length for
+    exponential code. An input that ran out of CPU_BUDGET counts as infinitely slow.
+    :return: None if fewer than two sizes took measurable time
+    """
+    if seconds and seconds[-1] is None:
+        return math.inf
+    points = [(math.log(length), math.log(value)) for length, value in zip(lengths, seconds)
+              if value is not None and value >= MIN_FIT_SECONDS]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+
+
+def _total_seconds(profile: dict, valid: Optional[list[bool]] = None) -> Optional[float]:
+    # None if a call ran out of its budget
+    values = [entry["seconds"] for index, entry in enumerate(profile["inputs"]) if valid is None or valid[index]]
+    return None if any(value is None for value in values) else sum(values)
+
+
+def compare(profile: dict, baseline: Optional[dict], factor: float, max_exponent: float) -> PerformanceResult:
+    """
+    Checks the profile of the fixed code against the one of the original code:
+    - CPU time per call on the test inputs and on the largest scaled input both finished, at most `factor` times
+      the original's (calls faster than MIN_FLAGGED_SECONDS are never flagged),
+    - peak RSS increase at most `factor` times the original's (or MIN_FLAGGED_RSS_KB),
+    - growth exponent at most max_exponent, unless the original grows as fast.
+    Without a baseline only the growth is checked.
+    """
+    if baseline is not None and len(baseline["inputs"]) != len(profile["inputs"]):
+        baseline = None
+    # inputs the original code crashed on tell nothing about its speed
+    valid = [not entry["raised"] for entry in baseline["inputs"]] if baseline is not None else None
+
+    exponent = growth_exponent(profile["lengths"], profile["scaled_seconds"])
+    baseline_exponent = (growth_exponent(baseline["lengths"], baseline["scaled_seconds"])
+                         if baseline is not None else None)
+    cpu_seconds = _total_seconds(profile)
+    baseline_cpu_seconds = _total_seconds(baseline, valid) if baseline is not None else None
+
+    reasons = []
+    if cpu_seconds is None and (baseline is None or _total_seconds(baseline) is not None):
+        reasons.append(f"a call with the test inputs took more than {CALL_BUDGET}s of CPU time")
+    elif baseline is not None and cpu_seconds is not None and baseline_cpu_seconds is not None and any(valid):
+        fixed_cpu_seconds = _total_seconds(profile, valid)
+        calls = max(1, sum(valid))
+        if (fixed_cpu_seconds > factor * baseline_cpu_seconds
+                and fixed_cpu_seconds / calls >= MIN_FLAGGED_SECONDS):
+            reasons.append(f"the test inputs take {fixed_cpu_seconds:.4f}s of CPU time, the original code "
+                           f"{baseline_cpu_seconds:.4f}s (allowed: {factor}x)")
+
+    if baseline is not None:
+        both = min(len(profile["scaled_seconds"]), len(baseline["scaled_seconds"]))
+        if both:
+            largest, baseline_largest = profile["scaled_seconds"][both - 1], baseline["scaled_seconds"][both - 1]
+            if (largest is not None and baseline_largest is not None and largest > factor * baseline_largest
+                    and largest >= MIN_FLAGGED_SECONDS):
+                reasons.append(f"an input of length {profile['lengths'][both - 1]} takes {largest:.4f}s of CPU time, "
+                               f"the original code {baseline_largest:.4f}s (allowed: {factor}x)")
+        if profile["peak_rss_kb"] > factor * max(baseline["peak_rss_kb"], MIN_FLAGGED_RSS_KB):
+            reasons.append(f"the test inputs raise the peak RSS by {profile['peak_rss_kb']} KiB, the original code "
+                           f"by {baseline['peak_rss_kb']} KiB (allowed: {factor}x)")
+
+    if (exponent is not None and exponent > max_exponent
+            and (baseline_exponent is None or exponent > baseline_exponent + GROWTH_TOLERANCE)):
+        if math.isinf(exponent):
+            reasons.append(f"a call on an input of length {profile['lengths'][-1]} took more than {CALL_BUDGET}s "
+                           f"of CPU time, the time grows too fast with the input length")
+        else:
+            reasons.append(f"the time grows like length^{exponent:.2f} (allowed: ^{max_exponent}"
+                           + (f", the original code: ^{baseline_exponent:.2f}" if baseline_exponent is not None
+                              else "") + ")")
+
+    def _rounded(value: Optional[float]) -> Optional[float]:
+        return round(value, 6) if value is not None and not math.isinf(value) else None
+
+    return PerformanceResult(
+        passed=not reasons,
+        reasons=reasons,
+        cpu_seconds=_rounded(cpu_seconds),
+        baseline_cpu_seconds=_rounded(baseline_cpu_seconds),
+        peak_rss_kb=profile["peak_rss_kb"],
+        baseline_peak_rss_kb=baseline["peak_rss_kb"] if baseline is not None else None,
+        lengths=profile["lengths"],
+        scaled_seconds=[_rounded(value) for value in profile["scaled_seconds"]],
+        baseline_scaled_seconds=([_rounded(value) for value in baseline["scaled_seconds"]]
+                                 if baseline is not None else None),
+        growth_exponent=_rounded(exponent) if exponent is None or not math.isinf(exponent) else None,
+        baseline_growth_exponent=_rounded(baseline_exponent),
+    )
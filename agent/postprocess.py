@@ -0,0 +1,102 @@
+import ast
+from typing import Optional
+
+from agent.test_harness import CHECK_FUNCTION
+
+TEST_MODULES = {"unittest", "pytest", "doctest"}
+
+
+def _is_test_function(node: ast.stmt) -> bool:
+    return (isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+            and (node.name == CHECK_FUNCTION or node.name.startswith("test_")))
+
+
+def _is_test_class(node: ast.stmt) -> bool:
+    # unittest.TestCase subclasses
+    return isinstance(node, ast.ClassDef) and any(
+        (isinstance(base, ast.Attribute) and base.attr == "TestCase")
+        or (isinstance(base, ast.Name) and base.id == "TestCase")
+        for base in node.bases
+    )
+
+
+def _is_main_block(node: ast.stmt) -> bool:
+    # if __name__ == "__main__":
+    test = node.test if isinstance(node, ast.If) else None
+    return (isinstance(test, ast.Compare) and isinstance(test.left, ast.Name) and test.left.id == "__name__"
+            and len(test.comparators) == 1 and isinstance(test.comparators[0], ast.Constant)
+            and test.comparators[0].value == "__main__")
+
+
+def _is_test_import(node: ast.stmt) -> bool:
+    if isinstance(node, ast.Import):
+        return all(alias.name.split(".")[0] in TEST_MODULES for alias in node.names)
+    if isinstance(node, ast.ImportFrom):
+        return (node.module or "").split(".")[0] in TEST_MODULES
+    return False
+
+
+def _call_name(node: ast.stmt) -> Optional[str]:
+    """
+    "f" for a `f(...)` statement and "m.f" for `m.f(...)`, None for other statements.
+    """
+    if not isinstance(node, ast.Expr) or not isinstance(node.value, ast.Call):
+        return None
+    func = node.value.func
+    if isinstance(func, ast.Name):
+        return func.id
+    if isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name):
+        return f"{func.value.id}.{func.attr}"
+    return None
+
+
+def _is_test_call(node: ast.stmt, test_functions: set[str]) -> bool:
+    name = _call_name(node)
+    return name is not None and (name in test_functions or name.split(".")[0] in TEST_MODULES)
+
+
+def strip_tests(code: str) -> Optional[str]:
+    """
+    Removes the tests fix_code may have left in the code: check() and test_* functions, TestCase classes,
+    top-level asserts, calls of these functions and of unittest/pytest/doctest, their imports and
+    `if __name__ == "__main__":` blocks. Only whole top-level statements are removed, the remaining lines are kept
+    as they are.
+    :return: the code without tests (unchanged if it has none), None if it cannot be parsed or nothing would be left
+    """
+    try:
+        module = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return None
+
+    test_functions = {node.name for node in module.body if _is_test_function(node) or _is_test_class(node)}
+    removed = [
+        node for node in module.body
+        if (_is_test_function(node) or _is_test_class(node) or isinstance(node, ast.Assert) or _is_main_block(node)
+            or _is_test_import(node) or _is_test_call(node, test_functions))
+    ]
+    if len(removed) == len(module.body):
+        return None
+    if not removed:
+        return code
+
+    drop = set()
+    for node in removed:
+        # decorators start above the def
+        start = min([node.lineno] + [decorator.lineno for decorator in getattr(node, "decorator_list", [])])
+        drop.update(range(start - 1, node.end_lineno))
+    if any(index in drop for node in module.body if node not in removed
+           for index in range(node.lineno - 1, node.end_lineno)):
+        # a test shares a line with code (`x = f(); assert x`), lines cannot be cut apart
+        return None
+
+    lines = code.splitlines(keepends=True)
+    kept = [line for index, line in enumerate(lines) if index not in drop]
+
+    # the removed statements leave blank lines behind, at most two are kept in a row
+    result = []
+    blank_run = 0
+    for line in kept:
+        blank_run = blank_run + 1 if not line.strip() else 0
+        if blank_run <= 2:
+            result.append(line)
+    return "".join(result).strip("\n") + ("\n" if code.endswith("\n") else "")
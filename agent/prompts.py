@@ -28,6 +28,17 @@ FIX_ERROR_SYSTEM_PROMPT = SystemMessage(
     )
 )
 
+ONE_SHOT_FIX_SYSTEM_PROMPT = SystemMessage(
+    content=(
+        "You are a Python developer fixing a bug in one go. "
+        "You will be given the buggy code and the docstring it must follow. "
+        "Your task is to return the fixed code. "
+        "Answer format: "
+        '```json{"content":"<ONLY full fixed code. You must not include tests here.>"}``` '
+        "Always return the complete code, even if the fix is minimal."
+    )
+)
+
 CREATE_TESTS_SYSTEM_PROMPT = SystemMessage(
     content=(
         "You are a Python QA engineer. Generate 20 unit tests and cover as more cases as possible. "
@@ -74,3 +85,12 @@ POSTPROCESS_CODE_SYSTEM_PROMPT = SystemMessage(
         '```json{"content":"<ONLY full updated code. Do not include anything else here>"}``` '
     )
 )
+
+SUMMARIZE_HISTORY_PROMPT = SystemMessage(
+    content=(
+        "You are summarizing the earlier iterations of a Python code fixing session. "
+        "You will be given the messages of these iterations. "
+        "Briefly list which fixes were tried, which errors and failing tests they led to, and what is known about "
+        "the bug. Do not include full code."
+    )
+)
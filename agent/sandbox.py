@@ -0,0 +1,370 @@
+import asyncio
+import atexit
+import functools
+import json
+import os
+import queue
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Iterator, Optional
+
+from agent.cache import ResultCache
+from agent.model import ExecResult
+from agent.sandbox_output import BoundedOutput, HEAD_BYTES, TAIL_BYTES
+
+PYTHON = "python"
+SERVER_PATH = Path(__file__).with_name("sandbox_server.py")
+# runs the file and reports an uncaught exception as JSON too, see agent/sandbox_runner.py
+RUNNER_PATH = Path(__file__).with_name("sandbox_runner.py")
+BACKENDS = ("subprocess", "fork_server")
+CHUNK_BYTES = 65536
+# seconds the outputs are still read after the process exited
+READER_JOIN_TIMEOUT = 1.0
+# seconds between two checks of the cancel event of a blocking run, see cancel_on
+CANCEL_POLL = 0.05
+
+# set once the runs of this context are no longer needed, see cancel_on
+_cancel: ContextVar[Optional[threading.Event]] = ContextVar("sandbox_cancel", default=None)
+
+
+class SandboxCancelled(Exception):
+    """
+    A blocking run was stopped because the event of its cancel_on block was set.
+    """
+
+
+@contextmanager
+def cancel_on(event: threading.Event) -> Iterator[None]:
+    """
+    Blocking runs started in the block (e.g. by a losing speculative candidate) raise SandboxCancelled once the event
+    is set: a subprocess is killed, a fork-server job is not started. A fork-server job that already runs ends on its
+    own. Async runs are stopped by cancelling their task instead.
+    """
+    token = _cancel.set(event)
+    try:
+        yield
+    finally:
+        _cancel.reset(token)
+
+
+def _check_cancelled() -> None:
+    event = _cancel.get()
+    if event is not None and event.is_set():
+        raise SandboxCancelled()
+
+
+def _wait(process: subprocess.Popen, timeout: float) -> int:
+    # like process.wait(timeout), but the cancel event of the context is checked while waiting
+    event = _cancel.get()
+    if event is None:
+        return process.wait(timeout)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return process.wait(min(CANCEL_POLL, max(0.0, deadline - time.monotonic())))
+        except subprocess.TimeoutExpired:
+            if time.monotonic() >= deadline:
+                raise
+            if event.is_set():
+                raise SandboxCancelled()
+
+
+def _read_stream(stream, output: BoundedOutput) -> None:
+    for chunk in iter(lambda: stream.read1(CHUNK_BYTES), b""):
+        output.feed(chunk)
+
+
+def _exec_result(stdout: BoundedOutput, stderr: BoundedOutput, return_code: int, timed_out: bool) -> ExecResult:
+    return ExecResult(stdout=stdout.text(), stderr=stderr.text(), return_code=return_code, timed_out=timed_out,
+                      stdout_bytes=stdout.total, stderr_bytes=stderr.total)
+
+
+def run_subprocess(source: str, filename: str, timeout: float) -> ExecResult:
+    """
+    Runs the source like `python filename` in a new temporary directory, through the sandbox runner. Pays for a new
+    interpreter on every call. The file is run by its name from inside the directory, so tracebacks (and the prompts
+    and LLM cache keys made from them) do not contain the random directory. The outputs are read while the process
+    runs, only their head and tail are kept.
+    """
+    head_bytes, tail_bytes = _output_limits
+    with tempfile.TemporaryDirectory() as tempdir:
+        code_path = os.path.join(tempdir, filename)
+        with open(code_path, "w") as code_file:
+            code_file.write(source)
+
+        stdout, stderr = BoundedOutput(head_bytes, tail_bytes), BoundedOutput(head_bytes, tail_bytes)
+        process = subprocess.Popen([PYTHON, str(RUNNER_PATH), filename], cwd=tempdir, stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        readers = [(threading.Thread(target=_read_stream, args=(stream, output), daemon=True), stream)
+                   for stream, output in ((process.stdout, stdout), (process.stderr, stderr))]
+        for reader, _ in readers:
+            reader.start()
+        try:
+            return_code, timed_out = _wait(process, timeout), False
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            return_code, timed_out = -1, True
+        except SandboxCancelled:
+            # the readers get EOF once the process is gone and end on their own
+            process.kill()
+            process.wait()
+            raise
+        join_deadline = time.monotonic() + READER_JOIN_TIMEOUT
+        for reader, stream in readers:
+            reader.join(max(0.0, join_deadline - time.monotonic()))
+            # a background process of the code may keep the pipe open, its reader is left to finish on its own
+            if not reader.is_alive():
+                stream.close()
+
+        return _exec_result(stdout, stderr, return_code, timed_out)
+
+
+async def _aread_stream(stream: asyncio.StreamReader, output: BoundedOutput) -> None:
+    while chunk := await stream.read(CHUNK_BYTES):
+        output.feed(chunk)
+
+
+async def _akill(process: asyncio.subprocess.Process) -> None:
+    if process.returncode is None:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+    await process.wait()
+
+
+async def arun_subprocess(source: str, filename: str, timeout: float) -> ExecResult:
+    """
+    Async version of run_subprocess, the interpreter is an asyncio subprocess.
+    """
+    head_bytes, tail_bytes = _output_limits
+    with tempfile.TemporaryDirectory() as tempdir:
+        code_path = os.path.join(tempdir, filename)
+        with open(code_path, "w") as code_file:
+            code_file.write(source)
+
+        stdout, stderr = BoundedOutput(head_bytes, tail_bytes), BoundedOutput(head_bytes, tail_bytes)
+        process = await asyncio.create_subprocess_exec(
+            PYTHON, str(RUNNER_PATH), filename, cwd=tempdir, stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        readers = asyncio.gather(_aread_stream(process.stdout, stdout), _aread_stream(process.stderr, stderr))
+        try:
+            try:
+                return_code = await asyncio.wait_for(process.wait(), timeout)
+                timed_out = False
+            except asyncio.TimeoutError:
+                await _akill(process)
+                return_code, timed_out = -1, True
+            try:
+                await asyncio.wait_for(readers, READER_JOIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+        except BaseException:
+            # the awaiting task was cancelled (e.g. a losing speculative candidate): the interpreter must not keep
+            # running until its timeout, and the readers are collected before the directory is removed
+            await _akill(process)
+            readers.cancel()
+            await asyncio.gather(readers, return_exceptions=True)
+            raise
+        return _exec_result(stdout, stderr, return_code, timed_out)
+
+
+class ForkServer:
+    """
+    A warm interpreter (agent/sandbox_server.py) that forks a fresh child for every job.
+    One job at a time, use ForkServerPool to run jobs concurrently.
+    """
+
+    def __init__(self):
+        self._process: Optional[subprocess.Popen] = None
+
+    def _start(self) -> subprocess.Popen:
+        return subprocess.Popen(
+            [PYTHON, str(SERVER_PATH)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            bufsize=1,
+        )
+
+    def run(self, source: str, filename: str, timeout: float) -> ExecResult:
+        if self._process is None or self._process.poll() is not None:
+            self._process = self._start()
+
+        head_bytes, tail_bytes = _output_limits
+        job = {"source": source, "filename": filename, "timeout": timeout, "head_bytes": head_bytes,
+               "tail_bytes": tail_bytes}
+        try:
+            self._process.stdin.write(json.dumps(job, ensure_ascii=False) + "\n")
+            self._process.stdin.flush()
+            line = self._process.stdout.readline()
+        except (BrokenPipeError, OSError):
+            line = ""
+
+        if not line:
+            # the server died, the job is rerun the slow way and the server is restarted on the next call
+            self.close()
+            return run_subprocess(source, filename, timeout)
+
+        return ExecResult(**json.loads(line))
+
+    def close(self) -> None:
+        if self._process is None:
+            return
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.wait()
+        self._process = None
+
+
+class ForkServerPool:
+    """
+    A fixed number of fork-servers shared between threads. Servers are started lazily on first use.
+    """
+
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self._servers: queue.Queue = queue.Queue()
+        for _ in range(self.size):
+            self._servers.put(ForkServer())
+        # threads of arun, one per server: a job holds its thread until it ends (up to its timeout), even if the
+        # awaiting task was cancelled, so it must not take the threads of the default executor
+        self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="fork-server")
+
+    def run(self, source: str, filename: str, timeout: float) -> ExecResult:
+        server = self._servers.get()
+        try:
+            # the run may have waited for a free server long enough to be no longer needed
+            _check_cancelled()
+            return server.run(source, filename, timeout)
+        finally:
+            self._servers.put(server)
+
+    async def arun(self, source: str, filename: str, timeout: float) -> ExecResult:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self.run, source, filename, timeout)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        for _ in range(self.size):
+            self._servers.get().close()
+
+
+_backend = "subprocess"
+_pool: Optional[ForkServerPool] = None
+_cache: Optional[ResultCache] = ResultCache()
+_output_limits = (HEAD_BYTES, TAIL_BYTES)
+_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def interpreter_version() -> str:
+    """
+    Version of the interpreter that runs the sandboxed code (not necessarily the one running the agent).
+    """
+    try:
+        return subprocess.run(
+            [PYTHON, "-c", "import sys; print(sys.version)"], capture_output=True, text=True, timeout=30
+        ).stdout.strip()
+    except (OSError, subprocess.TimeoutExpired):
+        return ""
+
+
+def configure(backend: str = "subprocess", workers: int = 1) -> None:
+    """
+    Selects the sandbox backend used by execute().
+    :param backend: "subprocess" (new interpreter per call) or "fork_server" (pool of warm interpreters)
+    :param workers: number of fork-servers, i.e. how many jobs can run at the same time
+    """
+    global _backend, _pool
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown sandbox backend: {backend}. Available: {', '.join(BACKENDS)}")
+    if backend == "fork_server" and not hasattr(os, "fork"):
+        backend = "subprocess"
+
+    with _lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+        _backend = backend
+        if backend == "fork_server":
+            _pool = ForkServerPool(workers)
+
+
+def configure_output(head_bytes: int = HEAD_BYTES, tail_bytes: int = TAIL_BYTES) -> None:
+    """
+    Bounds the stdout and stderr kept of every sandbox run, whatever the code prints.
+    :param head_bytes: bytes kept from the start of each stream
+    :param tail_bytes: bytes kept from its end, a truncation marker with the total size is put between the two
+    """
+    global _output_limits
+    _output_limits = (max(0, head_bytes), max(0, tail_bytes))
+
+
+def output_limits() -> tuple[int, int]:
+    return _output_limits
+
+
+def configure_cache(enabled: bool = True, max_entries: int = 1024, directory: Optional[str] = None,
+                    max_mb: float = 256) -> None:
+    """
+    Sets up the cache of sandbox results used by agent.tools.run_code_in_sandbox.
+    :param enabled: disables caching completely when False
+    :param max_entries: size of the in-memory LRU tier
+    :param directory: directory of the on-disk tier, shared between runs. No disk tier if None
+    :param max_mb: size of the on-disk tier after which the least recently used results are evicted
+    """
+    global _cache
+    _cache = ResultCache(max_entries, directory, int(max_mb * 2 ** 20)) if enabled else None
+
+
+def configure_from_config(cfg: dict, min_workers: int = 1) -> None:
+    configure(cfg.get("sandbox_backend", "subprocess"), max(int(cfg.get("sandbox_workers", 1)), min_workers))
+    configure_output(int(cfg.get("sandbox_output_head_bytes", HEAD_BYTES)),
+                     int(cfg.get("sandbox_output_tail_bytes", TAIL_BYTES)))
+    configure_cache(
+        bool(cfg.get("sandbox_cache", True)),
+        int(cfg.get("sandbox_cache_size", 1024)),
+        cfg.get("sandbox_cache_dir"),
+        float(cfg.get("sandbox_cache_max_mb", 256)),
+    )
+
+
+def get_cache() -> Optional[ResultCache]:
+    return _cache
+
+
+def cache_stats() -> dict:
+    """
+    Hit/miss counters of the sandbox cache. Every hit is a sandbox run that did not happen.
+    """
+    return _cache.stats() if _cache is not None else {}
+
+
+def execute(source: str, filename: str, timeout: float) -> ExecResult:
+    _check_cancelled()
+    pool = _pool
+    if _backend == "fork_server" and pool is not None:
+        return pool.run(source, filename, timeout)
+    return run_subprocess(source, filename, timeout)
+
+
+async def aexecute(source: str, filename: str, timeout: float) -> ExecResult:
+    pool = _pool
+    if _backend == "fork_server" and pool is not None:
+        return await pool.arun(source, filename, timeout)
+    return await arun_subprocess(source, filename, timeout)
+
+
+@atexit.register
+def _close_pool() -> None:
+    if _pool is not None:
+        _pool.close()
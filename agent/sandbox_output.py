@@ -0,0 +1,57 @@
+"""
+Bounded capture of the sandboxed process's stdout and stderr. Shared by both sandbox backends, the fork-server
+imports it too, so only the standard library may be imported here.
+"""
+
+# bytes kept from the start and from the end of every stream, see agent.sandbox.configure_output
+HEAD_BYTES = 8192
+TAIL_BYTES = 8192
+TRUNCATION_MARKER = "\n[... {omitted} bytes truncated, {total} bytes in total ...]\n"
+
+
+class BoundedOutput:
+    """
+    A stream read in chunks, of which only the first head_bytes and the last tail_bytes are kept: an endless print
+    loop costs as much memory (and prompt) as a short one. The total is still counted.
+    """
+
+    def __init__(self, head_bytes: int = HEAD_BYTES, tail_bytes: int = TAIL_BYTES):
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.total = 0
+        self._head = bytearray()
+        self._tail = bytearray()
+
+    @property
+    def truncated(self) -> bool:
+        return self.total > len(self._head) + len(self._tail)
+
+    def feed(self, data: bytes) -> None:
+        self.total += len(data)
+        if len(self._head) < self.head_bytes:
+            room = self.head_bytes - len(self._head)
+            self._head += data[:room]
+            data = data[room:]
+        if not data or self.tail_bytes <= 0:
+            return
+        self._tail += data
+        # trimmed in batches, not on every chunk
+        if len(self._tail) > 2 * self.tail_bytes:
+            del self._tail[:len(self._tail) - self.tail_bytes]
+
+    def text(self) -> str:
+        """
+        The kept bytes decoded, with universal newlines like a text-mode pipe. The head and the tail are joined by
+        TRUNCATION_MARKER if bytes were dropped between them.
+        """
+        if len(self._tail) > self.tail_bytes:
+            del self._tail[:len(self._tail) - self.tail_bytes]
+        head = _decode(bytes(self._head))
+        if not self.truncated:
+            return head + _decode(bytes(self._tail))
+        omitted = self.total - len(self._head) - len(self._tail)
+        return head + TRUNCATION_MARKER.format(omitted=omitted, total=self.total) + _decode(bytes(self._tail))
+
+
+def _decode(data: bytes) -> str:
+    return data.decode("utf-8", errors="replace").replace("\r\n", "\n").replace("\r", "\n")
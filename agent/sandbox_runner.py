@@ -0,0 +1,263 @@
+"""
+Runs a sandboxed file in a fresh __main__ namespace, like `python buggy_code.py` would, and reports an uncaught
+exception both as the usual traceback and as one JSON line (see EXCEPTION_MARKER) that the agent reads instead of
+parsing the traceback text. Used by both sandbox backends: the "subprocess" backend starts
+`python sandbox_runner.py buggy_code.py`, the fork-server children call run_main.
+Only the standard library may be imported here.
+"""
+import ast
+import builtins
+import json
+import linecache
+import os
+import sys
+import traceback
+import types
+from typing import Optional
+
+EXCEPTION_MARKER = "__SANDBOX_EXCEPTION__"
+# longer reprs of the assert operands are cut, the prompt only needs to see where they differ
+MAX_REPR = 300
+# name of _capture in the namespace of the sandboxed file, its rewritten asserts call it (see rewrite_asserts)
+CAPTURE_NAME = "__sandbox_capture__"
+# like Python's own traceback, a frame sequence repeated by recursion is shown this many times, then counted
+REPEATS_SHOWN = 3
+MAX_CYCLE = 8
+
+_OPERATORS = {
+    ast.Eq: "==", ast.NotEq: "!=", ast.Lt: "<", ast.LtE: "<=", ast.Gt: ">", ast.GtE: ">=",
+    ast.Is: "is", ast.IsNot: "is not", ast.In: "in", ast.NotIn: "not in",
+}
+
+
+# the last values of the assert operands by (line, column, operand index) of the assert
+_operands: dict = {}
+
+
+def _repr(value) -> str:
+    text = repr(value)
+    return text if len(text) <= MAX_REPR else text[:MAX_REPR] + "..."
+
+
+def _capture(line: int, column: int, index: int, value):
+    _operands[(line, column, index)] = value
+    return value
+
+
+def _capture_call(node: ast.Assert, index: int, operand: ast.expr) -> ast.expr:
+    call = ast.Call(func=ast.Name(id=CAPTURE_NAME, ctx=ast.Load()),
+                    args=[ast.Constant(node.lineno), ast.Constant(node.col_offset), ast.Constant(index), operand],
+                    keywords=[])
+    return ast.copy_location(call, operand)
+
+
+def _single_comparison(test: ast.expr) -> bool:
+    return isinstance(test, ast.Compare) and len(test.ops) == 1 and type(test.ops[0]) in _OPERATORS
+
+
+class _AssertRewriter(ast.NodeTransformer):
+    """
+    Wraps the operands of every assert in a _capture call, so the values it failed with are known without evaluating
+    anything again (like pytest's assert rewriting). Line and column numbers of the statements do not change.
+    """
+
+    def visit_Assert(self, node: ast.Assert) -> ast.Assert:
+        test = node.test
+        if _single_comparison(test):
+            test.left = _capture_call(node, 0, test.left)
+            test.comparators[0] = _capture_call(node, 1, test.comparators[0])
+        else:
+            node.test = _capture_call(node, 0, test)
+        return node
+
+
+def rewrite_asserts(tree: ast.Module) -> ast.Module:
+    return ast.fix_missing_locations(_AssertRewriter().visit(tree))
+
+
+def _operand(node: ast.Assert, index: int) -> Optional[str]:
+    key = (node.lineno, node.col_offset, index)
+    if key not in _operands:
+        return None
+    try:
+        return _repr(_operands[key])
+    except Exception:
+        return None
+
+
+def _failed_assertion(filename: str, line: int) -> Optional[dict]:
+    """
+    The failing assert statement with the values its operands had (see rewrite_asserts).
+    """
+    try:
+        tree = ast.parse("".join(linecache.getlines(filename)))
+    except (SyntaxError, ValueError):
+        return None
+    asserts = [node for node in ast.walk(tree)
+               if isinstance(node, ast.Assert) and node.lineno <= line <= node.end_lineno]
+    if not asserts:
+        return None
+    node = max(asserts, key=lambda node: node.lineno)
+    operator = _OPERATORS[type(node.test.ops[0])] if _single_comparison(node.test) else None
+    return {"source": ast.unparse(node.test), "operator": operator, "left": _operand(node, 0),
+            "right": _operand(node, 1) if operator is not None else None}
+
+
+def collapse_repeats(items: list, keep: int = REPEATS_SHOWN, max_cycle: int = MAX_CYCLE) -> list:
+    """
+    The items with every run of a repeating sequence (up to max_cycle items long, e.g. the frames of a mutual
+    recursion) cut to its first `keep` repetitions. The cut repetitions are replaced by one (cycle length, times)
+    tuple, tuples are never items themselves.
+    """
+    result = []
+    index = 0
+    while index < len(items):
+        best = None
+        for cycle in range(1, max_cycle + 1):
+            pattern = items[index:index + cycle]
+            if len(pattern) < cycle:
+                break
+            times = 1
+            while items[index + times * cycle:index + (times + 1) * cycle] == pattern:
+                times += 1
+            if times > keep and (best is None or times * cycle > best[0] * best[1]):
+                best = (cycle, times)
+        if best is None:
+            result.append(items[index])
+            index += 1
+            continue
+        cycle, times = best
+        result.extend(items[index:index + keep * cycle])
+        result.append((cycle, times - keep))
+        index += times * cycle
+    return result
+
+
+def repeats_note(cycle: int, times: int) -> str:
+    return f"[the previous {cycle} frame{'s' if cycle > 1 else ''} repeated {times} more times]"
+
+
+def collapse_traceback(text: str) -> str:
+    """
+    Tracebacks of the text with the frames of a recursion shown a few times, then counted. Python itself only does it
+    for a function calling itself, not for functions calling each other.
+    """
+    blocks = []
+    for line in text.splitlines(keepends=True):
+        if line.startswith("    ") and blocks and blocks[-1].startswith('  File "'):
+            # the source line and the carets of the frame
+            blocks[-1] += line
+        else:
+            blocks.append(line)
+    # only frames are collapsed, other lines are made unique by their position
+    items = [block if block.startswith('  File "') else [index, block] for index, block in enumerate(blocks)]
+
+    collapsed = []
+    for item in collapse_repeats(items):
+        if isinstance(item, tuple):
+            collapsed.append(f"  {repeats_note(*item)}\n")
+        else:
+            collapsed.append(item if isinstance(item, str) else item[1])
+    return "".join(collapsed)
+
+
+def describe_exception(exc: BaseException, filename: str) -> dict:
+    """
+    The exception as a dict: its type and message, the frames of the sandboxed file (innermost last) with their
+    source lines and, for an AssertionError, the failing assert with its operands. Recursion is collapsed, see
+    collapse_repeats.
+    """
+    name = os.path.basename(filename)
+    frames = []
+    innermost = None
+    tb = exc.__traceback__
+    while tb is not None:
+        code_filename = tb.tb_frame.f_code.co_filename
+        if os.path.basename(code_filename) == name:
+            frames.append({"line": tb.tb_lineno, "function": tb.tb_frame.f_code.co_name,
+                           "source": linecache.getline(code_filename, tb.tb_lineno).strip()})
+            innermost = tb
+        tb = tb.tb_next
+    if isinstance(exc, SyntaxError) and exc.filename and os.path.basename(exc.filename) == name:
+        frames.append({"line": exc.lineno, "function": None, "source": (exc.text or "").strip()})
+
+    frames = [{"line": None, "function": None, "source": repeats_note(*item)} if isinstance(item, tuple) else item
+              for item in collapse_repeats(frames)]
+
+    assertion = None
+    if isinstance(exc, AssertionError) and innermost is not None:
+        assertion = _failed_assertion(innermost.tb_frame.f_code.co_filename, innermost.tb_lineno)
+    # the file and the line of a SyntaxError are in its frame already
+    message = exc.msg if isinstance(exc, SyntaxError) else str(exc)
+    return {"type": type(exc).__name__, "message": message, "frames": frames, "assertion": assertion}
+
+
+def excepthook(exc_type, exc_value, exc_tb) -> None:
+    """
+    sys.excepthook of the sandbox: the usual traceback (recursion collapsed), then the EXCEPTION_MARKER line.
+    """
+    sys.stderr.write(collapse_traceback("".join(traceback.format_exception(exc_type, exc_value, exc_tb))))
+    try:
+        info = describe_exception(exc_value, sys.argv[0])
+        sys.stderr.write(EXCEPTION_MARKER + " " + json.dumps(info, ensure_ascii=False) + "\n")
+    except Exception:
+        # the report is a shortcut, the traceback above is still there
+        pass
+
+
+def split_exception(stderr: str) -> tuple[str, Optional[dict]]:
+    """
+    :return: stderr without the EXCEPTION_MARKER line and the exception it reports (None without one)
+    """
+    position = stderr.rfind(EXCEPTION_MARKER + " ")
+    if position == -1 or (position > 0 and stderr[position - 1] != "\n"):
+        return stderr, None
+    end = stderr.find("\n", position)
+    end = len(stderr) if end == -1 else end + 1
+    try:
+        info = json.loads(stderr[position + len(EXCEPTION_MARKER) + 1:end])
+    except ValueError:
+        return stderr, None
+    return stderr[:position] + stderr[end:], info
+
+
+def _exit_code(exc: SystemExit) -> int:
+    if exc.code is None:
+        return 0
+    if isinstance(exc.code, int):
+        return exc.code
+    print(exc.code, file=sys.stderr)
+    return 1
+
+
+def run_main(path: str) -> int:
+    """
+    Runs the file as __main__ with the sandbox's excepthook installed.
+    :return: the exit code `python path` would have
+    """
+    sys.argv = [path]
+    sys.path[0] = os.path.dirname(os.path.abspath(path))
+    sys.excepthook = excepthook
+    main_module = types.ModuleType("__main__")
+    main_module.__file__ = path
+    main_module.__builtins__ = builtins
+    setattr(main_module, CAPTURE_NAME, _capture)
+    sys.modules["__main__"] = main_module
+
+    try:
+        with open(path, "r", encoding="utf-8") as source_file:
+            source = source_file.read()
+        exec(compile(rewrite_asserts(ast.parse(source, path)), path, "exec"), main_module.__dict__)
+    except SystemExit as e:
+        return _exit_code(e)
+    except BaseException:
+        exc_type, exc_value, exc_tb = sys.exc_info()
+        # skip this frame, so the traceback looks like the one of a plain `python buggy_code.py`
+        exc_value.__traceback__ = exc_tb.tb_next
+        sys.excepthook(exc_type, exc_value, exc_tb.tb_next)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run_main(sys.argv[1]))
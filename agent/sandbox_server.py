@@ -0,0 +1,169 @@
+"""
+Fork-server used by the "fork_server" sandbox backend (see agent/sandbox.py).
+
+It is started once and kept warm: it reads one JSON job per line from stdin, forks a fresh child for every job and
+answers with one JSON line on stdout. The child runs the job source in a fresh __main__ namespace inside its own
+temporary directory, exactly like `python buggy_code.py` would (see sandbox_runner.run_main), so the interpreter
+startup is paid only once.
+Only the standard library may be imported here.
+"""
+import atexit
+import json
+import os
+import random
+import selectors
+import signal
+import sys
+import tempfile
+import time
+
+from sandbox_output import BoundedOutput, HEAD_BYTES, TAIL_BYTES
+from sandbox_runner import run_main
+
+# Imported once in the server, so children get them for free. These are the modules generated tests commonly use.
+PRELOADED_MODULES = ("collections", "functools", "hashlib", "heapq", "itertools", "math", "re", "string", "typing")
+
+for _module in PRELOADED_MODULES:
+    __import__(_module)
+
+CHUNK_BYTES = 65536
+# seconds the pipes are still read after the child exited, a background process of the code may keep them open
+DRAIN_SECONDS = 1.0
+
+
+def _run_child(path: str, workdir: str, stdout_fd: int, stderr_fd: int) -> None:
+    os.setpgid(0, 0)
+    os.chdir(workdir)
+
+    stdin_fd = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(stdin_fd, 0)
+    os.dup2(stdout_fd, 1)
+    os.dup2(stderr_fd, 2)
+    os.close(stdout_fd)
+    os.close(stderr_fd)
+
+    # a fresh interpreter seeds from os.urandom, forked children would otherwise share the parent's state
+    random.seed()
+
+    code = 0
+    try:
+        code = run_main(path)
+    finally:
+        try:
+            atexit._run_exitfuncs()
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code & 0xFF)
+
+
+def _drain(key: selectors.SelectorKey, selector: selectors.BaseSelector, until: float) -> None:
+    """
+    Reads the pipe until it is empty, closed or the time is up, at least one chunk.
+    """
+    while True:
+        try:
+            chunk = os.read(key.fd, CHUNK_BYTES)
+        except BlockingIOError:
+            return
+        if not chunk:
+            selector.unregister(key.fd)
+            return
+        key.data.feed(chunk)
+        if time.monotonic() >= until:
+            return
+
+
+def _collect(pid: int, outputs: dict[int, BoundedOutput], timeout: float) -> tuple[int, bool]:
+    """
+    Reads the child's pipes into their outputs while waiting for it to exit or to time out.
+    :return: the return code and whether the child was killed on timeout
+    """
+    deadline = time.monotonic() + timeout
+    selector = selectors.DefaultSelector()
+    for fd, output in outputs.items():
+        os.set_blocking(fd, False)
+        selector.register(fd, selectors.EVENT_READ, output)
+    delay = 0.0005
+    try:
+        while True:
+            if selector.get_map():
+                # one chunk per ready pipe, an endless print loop must not keep the deadline from being checked
+                for key, _ in selector.select(delay):
+                    _drain(key, selector, until=0)
+            else:
+                time.sleep(delay)
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if done:
+                return_code, timed_out = os.waitstatus_to_exitcode(status), False
+                break
+            if time.monotonic() >= deadline:
+                try:
+                    os.killpg(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                os.waitpid(pid, 0)
+                return_code, timed_out = -1, True
+                break
+            delay = min(delay * 2, 0.01)
+        # what was written right before the exit is still in the pipes
+        until = time.monotonic() + DRAIN_SECONDS
+        for key in list(selector.get_map().values()):
+            _drain(key, selector, until)
+        return return_code, timed_out
+    finally:
+        selector.close()
+
+
+def run_job(job: dict) -> dict:
+    head_bytes = int(job.get("head_bytes", HEAD_BYTES))
+    tail_bytes = int(job.get("tail_bytes", TAIL_BYTES))
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, job["filename"])
+        with open(path, "w", encoding="utf-8") as code_file:
+            code_file.write(job["source"])
+        stdout_read, stdout_write = os.pipe()
+        stderr_read, stderr_write = os.pipe()
+
+        pid = os.fork()
+        if pid == 0:
+            os.close(stdout_read)
+            os.close(stderr_read)
+            # run by its name from the workdir, like the subprocess backend: no random directory in tracebacks
+            _run_child(job["filename"], workdir, stdout_write, stderr_write)
+
+        os.close(stdout_write)
+        os.close(stderr_write)
+        stdout, stderr = BoundedOutput(head_bytes, tail_bytes), BoundedOutput(head_bytes, tail_bytes)
+        try:
+            return_code, timed_out = _collect(pid, {stdout_read: stdout, stderr_read: stderr}, float(job["timeout"]))
+        finally:
+            os.close(stdout_read)
+            os.close(stderr_read)
+        return {
+            "stdout": stdout.text(),
+            "stderr": stderr.text(),
+            "return_code": return_code,
+            "timed_out": timed_out,
+            "stdout_bytes": stdout.total,
+            "stderr_bytes": stderr.total,
+        }
+
+
+def serve() -> None:
+    requests = os.fdopen(os.dup(0), "r", encoding="utf-8")
+    responses = os.fdopen(os.dup(1), "w", encoding="utf-8")
+    # nothing but responses may reach the protocol pipe
+    os.dup2(os.open(os.devnull, os.O_RDONLY), 0)
+    os.dup2(2, 1)
+
+    for line in requests:
+        if not line.strip():
+            continue
+        result = run_job(json.loads(line))
+        responses.write(json.dumps(result, ensure_ascii=False) + "\n")
+        responses.flush()
+
+
+if __name__ == "__main__":
+    serve()
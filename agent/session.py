@@ -0,0 +1,122 @@
+import threading
+from typing import Optional
+
+from langchain_core.language_models import BaseChatModel
+
+from utils.utils import parse_config
+from agent.graph import compile_graph
+from agent.main import AGENT_OPTIONS, agent_options, _initial_state
+from agent.model import AgentState
+from agent.nodes import create_model
+
+# settings of a single run that can be overridden per fix() call, on top of AGENT_OPTIONS
+RUN_SETTINGS = {
+    "max_iter": (int, 5),
+    "recursion_limit": (int, 1000),
+    "run_inspections": (bool, False),
+}
+
+
+class AgentSession:
+    """
+    Everything a run needs that is expensive to set up: the compiled graph, a chat model with pooled HTTP clients
+    and the settings. Create one per process (or per model) and call fix() for every task, runs may be concurrent.
+    The sandbox, the LLM cache, the test cache and the inspections backend are process-wide, they are still
+    configured with the configure_from_config of their modules.
+    """
+
+    def __init__(self, config: Optional[dict] = None, model: Optional[BaseChatModel] = None):
+        """
+        :param config: parsed config (see config.yaml). config.yaml from the working directory if None
+        :param model: chat model to use instead of the one named by model_name in the config
+        """
+        self.config = dict(config if config is not None else parse_config("config.yaml"))
+        self.model_name = self.config["model_name"]
+        self._model = model
+        # connections and timeout of the API clients, the same for every model of the session
+        self._http = (int(self.config.get("http_max_connections", 32)), float(self.config.get("http_timeout", 600)))
+        # models created by the session, by name: model_name and the cascade_model
+        self._models: dict[str, BaseChatModel] = {}
+        self._models_lock = threading.Lock()
+        self.settings = {name: option_type(self.config.get(name, default))
+                         for name, (option_type, default) in RUN_SETTINGS.items()}
+        self.options = agent_options(self.config)
+        self._graph = compile_graph()
+        self._async_graph = compile_graph(use_async=True)
+
+    @property
+    def model(self) -> BaseChatModel:
+        return self.get_model(self.model_name)
+
+    def get_model(self, model_name: str) -> BaseChatModel:
+        """
+        The chat model with the name, with pooled HTTP clients. Created on the first call, i.e. the first LLM cache
+        miss: a session replaying from the LLM cache never needs an API key. A model passed in to the session is used
+        for every name (both tiers of the cascade).
+        """
+        if self._model is not None:
+            return self._model
+        with self._models_lock:
+            if model_name not in self._models:
+                self._models[model_name] = create_model(model_name, *self._http)
+            return self._models[model_name]
+
+    def _run(self, code: str, docstring: str, overrides: dict) -> tuple[AgentState, dict]:
+        unknown = set(overrides) - set(RUN_SETTINGS) - set(AGENT_OPTIONS)
+        if unknown:
+            raise TypeError(f"Unknown agent settings: {', '.join(sorted(unknown))}")
+        settings = {**self.settings, **{name: value for name, value in overrides.items() if name in RUN_SETTINGS}}
+        options = {**self.options, **{name: value for name, value in overrides.items() if name in AGENT_OPTIONS}}
+
+        state = _initial_state(code, docstring, settings["max_iter"], settings["run_inspections"], **options)
+        run_config = {
+            "recursion_limit": settings["recursion_limit"],
+            "configurable": {"model_name": self.model_name, "model_factory": self.get_model},
+        }
+        return state, run_config
+
+    def fix_state(self, code: str, docstring: str, **overrides) -> AgentState:
+        """
+        Runs the agent and returns its final state.
+        :param overrides: settings of this run only, e.g. max_iter=3 or speculative_k=2
+        """
+        state, run_config = self._run(code, docstring, overrides)
+        return self._graph.invoke(state, run_config)
+
+    def fix(self, code: str, docstring: str, **overrides) -> str:
+        """
+        Runs the agent and returns the fixed code.
+        """
+        return self.fix_state(code, docstring, **overrides).get("code")
+
+    async def afix_state(self, code: str, docstring: str, **overrides) -> AgentState:
+        """
+        Same as fix_state, on the async graph.
+        """
+        state, run_config = self._run(code, docstring, overrides)
+        return await self._async_graph.ainvoke(state, run_config)
+
+    async def afix(self, code: str, docstring: str, **overrides) -> str:
+        return (await self.afix_state(code, docstring, **overrides)).get("code")
+
+    def close(self) -> None:
+        """
+        Closes the HTTP connections of the models the session created. A model passed in is left to its owner.
+        """
+        with self._models_lock:
+            models, self._models = list(self._models.values()), {}
+        for model in models:
+            model.http_client.close()
+
+    async def aclose(self) -> None:
+        with self._models_lock:
+            models, self._models = list(self._models.values()), {}
+        for model in models:
+            model.http_client.close()
+            await model.http_async_client.aclose()
+
+    def __enter__(self) -> "AgentSession":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
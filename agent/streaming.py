@@ -0,0 +1,92 @@
+import json
+from typing import Optional
+
+FENCE = "```json"
+
+
+class JsonBlockScanner:
+    """
+    Finds the end of the ```json block of an answer that arrives in chunks. The JSON object after the fence is followed
+    character by character (strings and escapes included), so its end is known as soon as its closing brace arrives,
+    before the closing fence and whatever the model writes after it.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.content: Optional[str] = None
+        self._start: Optional[int] = None
+        self._position = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._end: Optional[int] = None
+        self._gave_up = False
+
+    @property
+    def complete(self) -> bool:
+        return self._end is not None
+
+    def feed(self, chunk: str) -> bool:
+        """
+        :return: whether the block is complete and its "content" is parsed, the rest of the answer is not needed then
+        """
+        self.text += chunk
+        if self.complete or self._gave_up:
+            return self.complete
+        if self._start is None and not self._find_start():
+            return False
+
+        for index in range(self._position, len(self.text)):
+            char = self.text[index]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._finish(index + 1)
+                    return self.complete
+        self._position = len(self.text)
+        return False
+
+    def answer(self) -> str:
+        """
+        The answer up to the end of the block, closed with a fence so that utils.parse_json_content reads it.
+        The whole text if the block is not complete.
+        """
+        return self.text[:self._end] + "```" if self.complete else self.text
+
+    def _find_start(self) -> bool:
+        fence = self.text.find(FENCE)
+        if fence == -1:
+            return False
+        rest = self.text[fence + len(FENCE):]
+        if not rest.strip():
+            return False
+        if not rest.lstrip().startswith("{"):
+            # not the format of the prompts, the answer is read to its end
+            self._gave_up = True
+            return False
+        self._start = len(self.text) - len(rest.lstrip())
+        self._position = self._start
+        return True
+
+    def _finish(self, end: int) -> None:
+        try:
+            content = json.loads(self.text[self._start:end])["content"]
+        except (ValueError, KeyError, TypeError):
+            self._gave_up = True
+            return
+        if not isinstance(content, str):
+            self._gave_up = True
+            return
+        self.content = content
+        self._end = end
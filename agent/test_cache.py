@@ -0,0 +1,83 @@
+import ast
+import copy
+from typing import Optional
+
+from agent.cache import ResultCache, make_key
+
+_cache: Optional[ResultCache] = ResultCache(256)
+
+
+def configure(enabled: bool = True, max_entries: int = 256, directory: Optional[str] = None,
+              max_mb: float = 64) -> None:
+    """
+    Sets up the cache of generated tests used by the agent nodes.
+    :param enabled: disables caching completely when False
+    :param max_entries: size of the in-memory LRU tier
+    :param directory: directory of the on-disk tier, shared between runs. No disk tier if None
+    :param max_mb: size of the on-disk tier after which the least recently used tests are evicted
+    """
+    global _cache
+    _cache = ResultCache(max_entries, directory, int(max_mb * 2 ** 20)) if enabled else None
+
+
+def configure_from_config(cfg: dict) -> None:
+    configure(
+        bool(cfg.get("test_cache", True)),
+        int(cfg.get("test_cache_size", 256)),
+        cfg.get("test_cache_dir"),
+        float(cfg.get("test_cache_max_mb", 64)),
+    )
+
+
+def cache_stats() -> dict:
+    """
+    Hit/miss counters of the test cache. Every hit is a create_tests call that did not happen.
+    """
+    return _cache.stats() if _cache is not None else {}
+
+
+def signatures(code: str) -> Optional[str]:
+    """
+    Top-level function signatures of the code without their bodies, in a normalized formatting:
+    buggy variants of the same function share them.
+    :return: None if the code cannot be parsed or has no functions
+    """
+    try:
+        module = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return None
+    stubs = []
+    for node in module.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            stub = copy.copy(node)
+            stub.body = [ast.Pass()]
+            stubs.append(ast.unparse(stub))
+    return "\n".join(stubs) or None
+
+
+def tests_key(code: str, docstring: Optional[str]) -> Optional[str]:
+    """
+    Key of the tests of a function: its signature and its docstring with whitespace collapsed.
+    Without a docstring the signature says too little about what to test, such code is not cached.
+    """
+    normalized_docstring = " ".join((docstring or "").split())
+    function_signatures = signatures(code)
+    if not normalized_docstring or function_signatures is None:
+        return None
+    return make_key("tests", function_signatures, normalized_docstring)
+
+
+def lookup(key: Optional[str]) -> Optional[str]:
+    if _cache is None or key is None:
+        return None
+    value = _cache.get(key)
+    return value["tests"] if value is not None else None
+
+
+def store(key: Optional[str], tests: str) -> None:
+    """
+    Remembers tests that a fixed version of the code passed.
+    :param key: tests_key of the code as it was given to the agent, before any fix
+    """
+    if _cache is not None and key is not None:
+        _cache.put(key, {"tests": tests})
@@ -0,0 +1,209 @@
+import ast
+import json
+import textwrap
+from string import Template
+from typing import Optional
+
+from agent.model import TestCaseResult
+
+CHECK_FUNCTION = "check"
+RESULTS_MARKER = "__TEST_HARNESS_RESULTS__"
+
+# Appended to the sandboxed file instead of the `check(...)` call. Runs every statement of check() on its own,
+# so one failing assert does not hide the others. Setup statements (everything that is not an assert) are run once,
+# in source order, before the first test that comes after them.
+_RUNNER = Template('''
+def _harness_run(_units, _order, _param, _candidate, _fail_fast):
+    import json as _json
+    import sys as _sys
+    import traceback as _traceback
+
+    _namespace = dict(globals())
+    _namespace[_param] = _candidate
+    _setups = [_unit for _unit in _units if _unit["kind"] == "setup"]
+    _results = {}
+
+    def _exec(_unit):
+        # `if True:` keeps the original indentation, so the lines and carets of tracebacks match the file
+        _source = "\\n" * (_unit["line"] - 2) + "if True:\\n" + _unit["raw"]
+        try:
+            exec(compile(_source, __file__, "exec"), _namespace)
+            return None
+        except Exception as _e:
+            _e.__traceback__ = _e.__traceback__.tb_next
+            _traceback.print_exception(_e, file=_sys.stderr)
+            return f"{type(_e).__name__}: {_e}" if str(_e) else type(_e).__name__
+
+    _failed = False
+    _setup_failed = False
+    for _index in _order:
+        while _setups and _setups[0]["index"] < _index:
+            _setup = _setups.pop(0)
+            _error = _exec(_setup)
+            _results[_setup["index"]] = {"passed": _error is None, "error": _error}
+            if _error is not None:
+                _setup_failed = True
+                break
+        if _setup_failed:
+            # the following tests depend on the broken setup, running them would only repeat its error
+            _failed = True
+            break
+        _error = _exec(_units[_index])
+        _results[_index] = {"passed": _error is None, "error": _error}
+        if _error is not None:
+            _failed = True
+            if _fail_fast:
+                break
+
+    print("\\n" + $marker + " " + _json.dumps(_results))
+    if _failed:
+        _sys.exit(1)
+
+
+_harness_run($units, $order, $param, $target, $fail_fast)
+''')
+
+
+def _statement_source(lines: list[str], node: ast.stmt) -> str:
+    return "\n".join(lines[node.lineno - 1:node.end_lineno])
+
+
+def _is_check_call(node: ast.stmt) -> bool:
+    return (
+        isinstance(node, ast.Expr)
+        and isinstance(node.value, ast.Call)
+        and isinstance(node.value.func, ast.Name)
+        and node.value.func.id == CHECK_FUNCTION
+        and len(node.value.args) == 1
+    )
+
+
+def _contains_assert(node: ast.stmt) -> bool:
+    return any(isinstance(child, ast.Assert) for child in ast.walk(node))
+
+
+def split_check(tests: str) -> Optional[dict]:
+    """
+    Splits the check() function of the tests into separately runnable statements.
+    :param tests: tests in the CREATE_TESTS_SYSTEM_PROMPT format: `def check(candidate): ...` followed by `check(f)`
+    :return: None if the tests do not have this shape, otherwise a plan with "prelude" (the tests without the check
+    call, line numbers kept), "units" (statements of check()), "param" (check() parameter) and "target" (its argument).
+    """
+    try:
+        module = ast.parse(tests)
+    except SyntaxError:
+        return None
+
+    check_def = None
+    check_calls = []
+    for node in module.body:
+        if isinstance(node, ast.FunctionDef) and node.name == CHECK_FUNCTION:
+            check_def = node
+        elif _is_check_call(node):
+            check_calls.append(node)
+
+    if check_def is None or len(check_calls) != 1 or len(check_def.args.args) != 1 or check_def.decorator_list:
+        return None
+
+    lines = tests.splitlines()
+    units = []
+    for node in check_def.body:
+        # statements sharing a line cannot be cut apart by lines
+        if any(other is not node and other.lineno <= node.end_lineno and other.end_lineno >= node.lineno
+               for other in check_def.body):
+            return None
+        units.append({
+            "index": len(units),
+            "kind": "test" if _contains_assert(node) else "setup",
+            "line": node.lineno,
+            "source": textwrap.dedent(_statement_source(lines, node)),
+            "raw": _statement_source(lines, node),
+        })
+
+    if not any(unit["kind"] == "test" for unit in units):
+        return None
+
+    call = check_calls[0]
+    prelude_lines = list(lines)
+    for line_number in range(call.lineno, call.end_lineno + 1):
+        prelude_lines[line_number - 1] = ""
+
+    return {
+        "prelude": "\n".join(prelude_lines),
+        "units": units,
+        "param": check_def.args.args[0].arg,
+        "target": ast.get_source_segment(tests, call.value.args[0]),
+    }
+
+
+def build_harness(code: str, tests: str, priority: Optional[list[str]] = None,
+                  fail_fast: bool = False) -> Optional[tuple[str, list[dict]]]:
+    """
+    Builds a sandbox source that runs every assertion of check() on its own and reports each result.
+    :param code: code under test
+    :param tests: tests with a check() function
+    :param priority: sources of tests to run first (e.g. the ones that failed in the previous run)
+    :param fail_fast: stop on the first failing test
+    :return: (source, units), or None if the tests cannot be split
+    """
+    plan = split_check(tests)
+    if plan is None:
+        return None
+
+    units = plan["units"]
+    # keeps line numbers of the units in sync with the combined file
+    line_offset = len((code + "\n\n").splitlines())
+    shifted = [{"index": unit["index"], "kind": unit["kind"], "line": unit["line"] + line_offset, "raw": unit["raw"]}
+               for unit in units]
+
+    tests_order = [unit["index"] for unit in units if unit["kind"] == "test"]
+    priority = priority or []
+    first = [index for source in priority for index in tests_order if units[index]["source"] == source]
+    order = list(dict.fromkeys(first + tests_order))
+
+    runner = _RUNNER.substitute(
+        marker=repr(RESULTS_MARKER),
+        units=repr(shifted),
+        order=repr(order),
+        param=repr(plan["param"]),
+        target=plan["target"],
+        fail_fast=repr(fail_fast),
+    )
+    return code + "\n\n" + plan["prelude"] + "\n" + runner, units
+
+
+def parse_harness_output(stdout: str, units: list[dict]) -> tuple[str, Optional[list[TestCaseResult]]]:
+    """
+    Separates the harness report from the stdout of the run.
+    :return: stdout without the report, and one result per unit (passed is None if the unit was not run),
+    or None if the run ended before the report was printed.
+    """
+    head, marker, tail = stdout.rpartition(RESULTS_MARKER)
+    if not marker:
+        return stdout, None
+    try:
+        raw_results = json.loads(tail.strip())
+    except ValueError:
+        return stdout, None
+
+    results = []
+    for unit in units:
+        raw = raw_results.get(str(unit["index"]), {})
+        results.append(TestCaseResult(
+            source=unit["source"],
+            line=unit["line"],
+            passed=raw.get("passed"),
+            error=raw.get("error"),
+        ))
+    # the report is printed on a line of its own
+    return head[:-1] if head.endswith("\n") else head, results
+
+
+def failed_tests(results: list[TestCaseResult], previous: Optional[list[str]] = None) -> list[str]:
+    """
+    Sources of the tests that failed, plus previously failing tests that were not run this time (fail-fast).
+    """
+    failed = [result["source"] for result in results if result["passed"] is False]
+    not_run = {result["source"] for result in results if result["passed"] is None}
+    failed += [source for source in previous or [] if source in not_run and source not in failed]
+    return failed
@@ -1,76 +1,133 @@
 import json
-import os
 import re
 import subprocess
-import tempfile
-from json import JSONDecodeError
-from pathlib import Path
+from typing import Optional
 
 from langchain_core.tools import tool
 
-from agent.model import RunResult, StackTrace
+from agent import inspections, tracing
+from agent.model import RunResult, StackTrace, ExecResult, ExceptionInfo
+from agent.cache import make_key
+from agent.sandbox import execute, aexecute, get_cache, interpreter_version, output_limits
+from agent.sandbox_runner import split_exception, collapse_traceback
+from agent.test_harness import build_harness, parse_harness_output
 
 FILENAME = "buggy_code.py"
 TESTSNAME = "tests.py"
-ROOT = Path.cwd()
-AGENT_DIR = Path(".agent")
-RESOURCES_DIR = Path("resources")
-PATH_TO_INSPECTIONS_SCRIPT = Path("scripts", "inspect.sh")
-DESCRIPTIONS_FILENAME = ".descriptions.json"
 
 
 @tool
-def run_code_in_sandbox(code: str, tests: str = None, timeout_time: int = 60) -> RunResult:
+def run_code_in_sandbox(code: str, tests: Optional[str] = None, timeout_time: int = 60, split_tests: bool = False,
+                        priority: Optional[list[str]] = None, fail_fast: bool = False) -> RunResult:
     """
-    A tool to run code in an isolated sandbox. For now, it is a simple temporary directory.
+    A tool to run code in an isolated sandbox. For now, it is a simple temporary directory, the process is either
+    a new interpreter or a child forked from a warm one (see agent.sandbox.configure).
+    Results are cached by code, tests, interpreter version and timeout (see agent.sandbox.configure_cache).
     Further, can potentially be changed to a docker container
     :param tests: Python tests for the code
     :param code: Python code to run
     :param timeout_time: Timeout for running attempt in seconds. Set to 60 by default.
+    :param split_tests: run every assertion of the tests' check() on its own and report each of them in test_results
+    :param priority: with split_tests, sources of the assertions to run first
+    :param fail_fast: with split_tests, stop on the first failing assertion
     :return: A dictionary with success or not (boolean), stdout (str), stderr (str).
     """
 
+    with tracing.call("sandbox"):
+        cache = get_cache()
+        key = _cache_key(code, tests, timeout_time, split_tests, priority, fail_fast)
+        if key is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                tracing.annotate(cached=True)
+                return RunResult(**cached)
+
+        source, units = _build_source(code, tests, split_tests, priority, fail_fast)
+        run_result = _to_run_result(execute(source, FILENAME, timeout_time), tests, units)
+        _store(key, run_result)
+        return run_result
+
+
+async def arun_code_in_sandbox(code: str, tests: Optional[str] = None, timeout_time: int = 60, split_tests: bool = False,
+                               priority: Optional[list[str]] = None, fail_fast: bool = False) -> RunResult:
+    """
+    Async version of run_code_in_sandbox, the process is awaited instead of blocking a thread.
+    """
+    with tracing.call("sandbox"):
+        cache = get_cache()
+        key = _cache_key(code, tests, timeout_time, split_tests, priority, fail_fast)
+        if key is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                tracing.annotate(cached=True)
+                return RunResult(**cached)
+
+        source, units = _build_source(code, tests, split_tests, priority, fail_fast)
+        run_result = _to_run_result(await aexecute(source, FILENAME, timeout_time), tests, units)
+        _store(key, run_result)
+        return run_result
+
+
+def _cache_key(code: str, tests: Optional[str], timeout_time: int, split_tests: bool, priority: Optional[list[str]],
+               fail_fast: bool) -> Optional[str]:
+    if get_cache() is None:
+        return None
+    mode = json.dumps([split_tests, priority, fail_fast]) if split_tests else None
+    # the limits change what is kept of the outputs
+    return make_key(code, tests, interpreter_version(), str(timeout_time), mode, json.dumps(output_limits()))
+
+
+def _store(key: Optional[str], run_result: RunResult) -> None:
+    cache = get_cache()
+    # a timeout says more about the machine load than about the code, so it is not cached
+    if key is not None and cache is not None and run_result["return_code"] != -1:
+        cache.put(key, run_result)
+
+
+def _build_source(code: str, tests: Optional[str], split_tests: bool, priority: Optional[list[str]],
+                  fail_fast: bool) -> tuple[str, Optional[list[dict]]]:
     # TODO(add docker support)
-    with tempfile.TemporaryDirectory() as tempdir:
-        code_path = os.path.join(tempdir, FILENAME)
-
-        if not tests:
-            with open(code_path, "w") as code_file:
-                code_file.write(code)
-        else:
-            with open(code_path, "w") as tests_file:
-                tests_file.write(code + "\n\n" + tests)
-
-        commands = ["python", code_path]
-
-        try:
-            process = subprocess.run(
-                commands, cwd=tempdir, capture_output=True, text=True, timeout=timeout_time
-            )
-            stdout = process.stdout
-            if tests:
-                tests_passed = (process.returncode == 0)
-                success = tests_passed
-                stdout = _simplify_stdout(process.stdout)
-            else:
-                tests_passed = (process.returncode == 0)
-                success = (process.returncode == 0)
-            return RunResult(
-                success=success,
-                stdout=stdout,
-                stderr=process.stderr,
-                return_code=process.returncode,
-                tests_passed=tests_passed,
-            )
-
-        except subprocess.TimeoutExpired as e:
-            return RunResult(
-                success=False,
-                stdout="" or str(e.stdout),
-                stderr=str(subprocess.TimeoutExpired),
-                return_code=-1,
-                tests_passed=False,
-            )
+    harness = build_harness(code, tests, priority, fail_fast) if tests and split_tests else None
+    if harness is not None:
+        return harness
+    return (code if not tests else code + "\n\n" + tests), None
+
+
+def _to_run_result(result: ExecResult, tests: Optional[str], units: Optional[list[dict]]) -> RunResult:
+    if result["timed_out"]:
+        return RunResult(
+            success=False,
+            stdout=result["stdout"],
+            stderr=str(subprocess.TimeoutExpired),
+            return_code=-1,
+            tests_passed=False,
+            stdout_bytes=result["stdout_bytes"],
+            stderr_bytes=result["stderr_bytes"],
+        )
+
+    stdout = result["stdout"]
+    stderr, exception = split_exception(result["stderr"])
+    stderr = collapse_traceback(stderr)
+    test_results = None
+    if units is not None:
+        stdout, test_results = parse_harness_output(stdout, units)
+    tests_passed = (result["return_code"] == 0)
+    success = (result["return_code"] == 0)
+    if tests:
+        stdout = _simplify_stdout(stdout)
+    run_result = RunResult(
+        success=success,
+        stdout=stdout,
+        stderr=stderr,
+        return_code=result["return_code"],
+        tests_passed=tests_passed,
+        exception=exception,
+        stdout_bytes=result["stdout_bytes"],
+        stderr_bytes=result["stderr_bytes"],
+    )
+    if test_results is not None:
+        run_result["test_results"] = test_results
+    return run_result
 
 
 @tool
@@ -104,6 +161,22 @@ def parse_stack_trace(trace: str) -> StackTrace:
     return {"exact_error": exact_error, "file_fragments": _file_fragments}
 
 
+def exception_summary(exception: ExceptionInfo) -> str:
+    """
+    One line about the exception, like the exact_error of parse_stack_trace, with the operands of a failed assert.
+    """
+    summary = f"{exception['type']}: {exception['message']}" if exception["message"] else exception["type"]
+    assertion = exception.get("assertion")
+    if assertion is None:
+        return summary
+    if assertion["operator"] is not None and assertion["left"] is not None:
+        return (f"{summary} (assert {assertion['source']}: {assertion['left']} {assertion['operator']} "
+                f"{assertion['right']} is False)")
+    if assertion["left"] is not None:
+        return f"{summary} (assert {assertion['source']}: the value is {assertion['left']})"
+    return f"{summary} (assert {assertion['source']})"
+
+
 @tool
 def create_python_file_and_lookup_inspections(code: str) -> dict:
     """
@@ -112,37 +185,8 @@ def create_python_file_and_lookup_inspections(code: str) -> dict:
     :param code: code to be analyzed
     :return: a dict with all inspections.
     """
-    AGENT_DIR.mkdir(parents=True, exist_ok=True)
-
-    with open(AGENT_DIR / FILENAME, "w") as file_path:
-        file_path.write(code)
-
-    inspections_xml_path = str(ROOT / RESOURCES_DIR / "profiles_settings.xml")
-    result_path = str(ROOT / AGENT_DIR / "inspections")
-    search_directory = str(ROOT / AGENT_DIR)
-
-    for file in Path(result_path).iterdir():
-        if file.is_file() or file.is_symlink():
-            file.unlink()
-
-    commands = [str(PATH_TO_INSPECTIONS_SCRIPT), str(ROOT), inspections_xml_path, result_path, "-v2",
-                "-d", search_directory,
-                "-format", "json"]
-    proc = subprocess.run(commands, cwd=str(ROOT))
-
-    if proc.returncode != 0:
-        return {}
-
-    output = {}
-
-    for file in Path(result_path).iterdir():
-        if file.name != DESCRIPTIONS_FILENAME:
-            try:
-                with open(file, "r", encoding="utf-8") as json_file:
-                    output[file.name] = json.load(json_file)
-            except (JSONDecodeError, KeyError, AttributeError, TypeError, ValueError):
-                continue
-    return output
+    # the backend (in-process analysis or PyCharm) is chosen by agent.inspections.configure
+    return inspections.inspect(code)
 
 
 def _simplify_stdout(stdout: str) -> list[str]:
@@ -0,0 +1,182 @@
+import functools
+import inspect
+import math
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator, Optional
+
+# calls (LLM requests, sandbox runs) made by the node that is running in this context
+_node_calls: ContextVar[Optional[list]] = ContextVar("node_calls", default=None)
+# the call that is running in this context, so the layers below it (LLM cache, HTTP client) can annotate it
+_current_call: ContextVar[Optional[dict]] = ContextVar("current_call", default=None)
+
+
+@contextmanager
+def call(kind: str) -> Iterator[dict]:
+    """
+    Times an LLM request or a sandbox run and records it in the span of the running node.
+    Outside a traced node it only yields a dict that nobody reads.
+    :param kind: "llm" or "sandbox"
+    """
+    record = {"kind": kind, "seconds": 0.0}
+    token = _current_call.set(record)
+    t0 = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = round(time.perf_counter() - t0, 4)
+        _current_call.reset(token)
+        calls = _node_calls.get()
+        if calls is not None:
+            calls.append(record)
+
+
+def annotate(**fields: Any) -> None:
+    """
+    Adds fields to the running call, e.g. cached=True. No-op outside a call.
+    """
+    record = _current_call.get()
+    if record is not None:
+        record.update(fields)
+
+
+def count_request() -> None:
+    """
+    Counts an HTTP request of the running LLM call: more than one request means the client retried.
+    """
+    record = _current_call.get()
+    if record is not None:
+        record["requests"] = record.get("requests", 0) + 1
+
+
+def record_usage(record: dict, message: Any) -> None:
+    """
+    Copies the token usage of a model response into an LLM call record.
+    """
+    usage = getattr(message, "usage_metadata", None) or {}
+    record["prompt_tokens"] = usage.get("input_tokens", 0)
+    record["completion_tokens"] = usage.get("output_tokens", 0)
+
+
+def _spent_tokens(calls: list[dict]) -> dict:
+    # responses replayed from the LLM cache cost nothing
+    spent = [record for record in calls if record["kind"] == "llm" and not record.get("cached")]
+    return {
+        "prompt_tokens": sum(record.get("prompt_tokens", 0) for record in spent),
+        "completion_tokens": sum(record.get("completion_tokens", 0) for record in spent),
+    }
+
+
+def _span(name: str, state: dict, calls: list, seconds: float) -> dict:
+    # copied: calls the node left running (losing speculative candidates) may still finish and append later
+    calls = list(calls)
+    llm_calls = [record for record in calls if record["kind"] == "llm"]
+    return {
+        "node": name,
+        "iter": state.get("iter"),
+        "seconds": round(seconds, 4),
+        **_spent_tokens(llm_calls),
+        "retries": sum(max(record.get("requests", 1) - 1, 0) for record in llm_calls),
+        "calls": calls,
+    }
+
+
+def traced(name: str, node: Callable) -> Callable:
+    """
+    Wraps a graph node (sync or async) so that its update also carries a span in "trace": wall time, iteration,
+    tokens, client retries and every LLM and sandbox call the node made.
+    """
+    if inspect.iscoroutinefunction(node):
+        @functools.wraps(node)
+        async def _traced_async(state: dict) -> dict:
+            calls = []
+            token = _node_calls.set(calls)
+            t0 = time.perf_counter()
+            try:
+                update = await node(state)
+            finally:
+                _node_calls.reset(token)
+            return {**update, "trace": [_span(name, state, calls, time.perf_counter() - t0)]}
+
+        return _traced_async
+
+    @functools.wraps(node)
+    def _traced(state: dict) -> dict:
+        calls = []
+        token = _node_calls.set(calls)
+        t0 = time.perf_counter()
+        try:
+            update = node(state)
+        finally:
+            _node_calls.reset(token)
+        return {**update, "trace": [_span(name, state, calls, time.perf_counter() - t0)]}
+
+    return _traced
+
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    Nearest-rank percentile, q in [0, 100].
+    """
+    ordered = sorted(values)
+    rank = max(math.ceil(q / 100 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+
+def trace_tokens(trace: list[dict]) -> dict:
+    """
+    Tokens spent by a run. Responses replayed from the LLM cache are not counted.
+    """
+    return _spent_tokens([record for span in trace for record in span["calls"]])
+
+
+def time_to_sandbox(trace: list[dict]) -> list[float]:
+    """
+    Seconds from the end of one sandbox run (or the start of the run) to the start of the next one, per sandbox run
+    of run_code: how long every iteration took to produce the code it tests.
+    """
+    seconds = []
+    elapsed = 0.0
+    for span in trace:
+        if span["node"] != "run_code":
+            elapsed += span["seconds"]
+            continue
+        sandbox_calls = [record for record in span["calls"] if record["kind"] == "sandbox"]
+        # the part of run_code before its sandbox call, the sandbox run itself is not waited for
+        sandbox_seconds = sum(record["seconds"] for record in sandbox_calls)
+        seconds.append(round(elapsed + max(span["seconds"] - sandbox_seconds, 0.0), 4))
+        elapsed = 0.0
+    return seconds
+
+
+def summarize_traces(traces: list[list[dict]]) -> dict:
+    """
+    Latency distribution (count, p50, p95, total seconds) per node, per kind of call and of the time to the sandbox
+    (see time_to_sandbox) over many runs.
+    """
+    node_seconds: dict[str, list[float]] = {}
+    call_seconds: dict[str, list[float]] = {}
+    for trace in traces:
+        for span in trace:
+            node_seconds.setdefault(span["node"], []).append(span["seconds"])
+            for record in span["calls"]:
+                kind = record["kind"] + (" (cached)" if record.get("cached") else "")
+                call_seconds.setdefault(kind, []).append(record["seconds"])
+
+    def _distribution(seconds: list[float]) -> dict:
+        return {
+            "count": len(seconds),
+            "p50_seconds": round(percentile(seconds, 50), 4),
+            "p95_seconds": round(percentile(seconds, 95), 4),
+            "total_seconds": round(sum(seconds), 4),
+        }
+
+    summary = {
+        "nodes": {name: _distribution(seconds) for name, seconds in node_seconds.items()},
+        "calls": {kind: _distribution(seconds) for kind, seconds in call_seconds.items()},
+    }
+    sandbox_waits = [seconds for trace in traces for seconds in time_to_sandbox(trace)]
+    if sandbox_waits:
+        summary["time_to_sandbox"] = _distribution(sandbox_waits)
+    return summary
@@ -0,0 +1,147 @@
+import ast
+import builtins
+import functools
+import symtable
+import sys
+from typing import Optional
+
+from agent.model import StaticError
+from agent.sandbox import interpreter_version
+from agent.test_harness import CHECK_FUNCTION
+
+# names a module has without defining them
+MODULE_NAMES = {"__name__", "__file__", "__doc__", "__builtins__", "__spec__", "__loader__", "__package__",
+                "__annotations__", "__cached__"}
+KNOWN_NAMES = set(dir(builtins)) | MODULE_NAMES
+# only the messages and line numbers of errors are reported, not the file name
+SOURCE_NAME = "<code>"
+
+
+@functools.lru_cache(maxsize=None)
+def same_interpreter() -> bool:
+    """
+    Whether the sandbox runs the agent's Python version. Otherwise the code is not checked here: what is a syntax
+    error for one version may be valid for the other.
+    """
+    return interpreter_version().split(" ")[0].rsplit(".", 1)[0] == f"{sys.version_info[0]}.{sys.version_info[1]}"
+
+
+def _syntax_error(e: SyntaxError, source: str) -> StaticError:
+    return StaticError(kind=type(e).__name__, source=source, line=e.lineno, name=None, message=str(e.msg))
+
+
+def _module_names(table: symtable.SymbolTable) -> set[str]:
+    """
+    Names bound at module level: assigned, imported, defined, or declared global and assigned in a nested scope.
+    """
+    names = {symbol.get_name() for symbol in table.get_symbols() if symbol.is_assigned() or symbol.is_imported()}
+    tables = list(table.get_children())
+    while tables:
+        child = tables.pop()
+        names.update(symbol.get_name() for symbol in child.get_symbols()
+                     if symbol.is_declared_global() and symbol.is_assigned())
+        tables.extend(child.get_children())
+    return names
+
+
+def _global_references(table: symtable.SymbolTable) -> set[str]:
+    """
+    Names looked up in the module namespace by the module or any scope nested in it.
+    """
+    names = {symbol.get_name() for symbol in table.get_symbols() if symbol.is_referenced()}
+    tables = list(table.get_children())
+    while tables:
+        child = tables.pop()
+        names.update(symbol.get_name() for symbol in child.get_symbols()
+                     if symbol.is_referenced() and symbol.is_global())
+        tables.extend(child.get_children())
+    return names
+
+
+def _first_load(tree: ast.Module, name: str) -> Optional[int]:
+    lines = [node.lineno for node in ast.walk(tree)
+             if isinstance(node, ast.Name) and node.id == name and isinstance(node.ctx, ast.Load)]
+    return min(lines) if lines else None
+
+
+def _check_targets(tree: ast.Module) -> set[str]:
+    # check(candidate) calls of the humanevalpack tests
+    return {node.args[0].id for node in ast.walk(tree)
+            if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == CHECK_FUNCTION
+            and len(node.args) == 1 and isinstance(node.args[0], ast.Name)}
+
+
+def undefined_names(source: str) -> dict[str, int]:
+    """
+    Names the source reads but never defines, imports or gets from builtins, with the line each is first read on.
+    Empty for source that does not parse or binds names dynamically (star imports, globals(), exec).
+    """
+    try:
+        tree = ast.parse(source)
+        table = symtable.symtable(source, SOURCE_NAME, "exec")
+    except (SyntaxError, ValueError):
+        return {}
+    if any(isinstance(node, ast.ImportFrom) and any(alias.name == "*" for alias in node.names)
+           for node in ast.walk(tree)):
+        return {}
+    references = _global_references(table)
+    if references & {"globals", "exec", "eval", "vars", "locals", "__import__"}:
+        return {}
+
+    names = {}
+    for name in references - _module_names(table) - KNOWN_NAMES:
+        line = _first_load(tree, name)
+        # a name that is only deleted is never read
+        if line is not None:
+            names[name] = line
+    return names
+
+
+def validate_code(code: str, tests: Optional[str] = None) -> Optional[StaticError]:
+    """
+    Finds the errors that would make the sandbox run fail before any test runs, without starting it: syntax errors
+    of the code or the tests, a function the tests' check() call refers to but the code does not define, and names
+    that are used but never defined or imported. Only the first error is reported.
+    Code that binds names dynamically (star imports, globals(), exec) is only compiled.
+    :return: None if nothing was found
+    """
+    # the sandbox runs the code and the tests as one file, see agent.tools._build_source
+    sources = [("code", code)] + ([("tests", tests)] if tests else [])
+    for source, text in sources:
+        try:
+            compile(text, SOURCE_NAME, "exec", dont_inherit=True)
+        except SyntaxError as e:
+            return _syntax_error(e, source)
+        except ValueError as e:
+            # null bytes
+            return StaticError(kind="SyntaxError", source=source, line=None, name=None, message=str(e))
+
+    program = code if not tests else code + "\n\n" + tests
+    undefined = undefined_names(program)
+    if not undefined:
+        return None
+
+    # the line offset of the tests in the file the sandbox runs
+    tests_start = code.count("\n") + 3
+    targets = _check_targets(ast.parse(program))
+    errors = []
+    for name, line in undefined.items():
+        source, line = ("tests", line - tests_start + 1) if tests and line >= tests_start else ("code", line)
+        if name in targets:
+            errors.append(StaticError(kind="MissingFunction", source=source, line=line, name=name,
+                                      message=f"the tests call {CHECK_FUNCTION}({name}) but the code does not "
+                                              f"define {name}"))
+        else:
+            errors.append(StaticError(kind="NameError", source=source, line=line, name=name,
+                                      message=f"name '{name}' is not defined"))
+    # a missing function is the root cause of everything else, then the first error in the file
+    return min(errors, key=lambda error: (error["kind"] != "MissingFunction", error["source"] != "code",
+                                          error["line"]))
+
+
+def format_error(error: StaticError) -> str:
+    """
+    The error as a short traceback-like text for the prompts and run_result["stderr"].
+    """
+    location = f'{error["source"]}, line {error["line"]}' if error["line"] is not None else error["source"]
+    return f"{error['kind']} ({location}): {error['message']}"
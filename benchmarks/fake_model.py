@@ -0,0 +1,134 @@
+import json
+import re
+import threading
+import time
+from typing import Any, Iterator, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+from agent.prompts import ANALYZE_CODE_SYSTEM_PROMPT, ANALYZE_ERROR_SYSTEM_PROMPT, CREATE_TESTS_SYSTEM_PROMPT, \
+    FIX_ERROR_SYSTEM_PROMPT, ONE_SHOT_FIX_SYSTEM_PROMPT, POSTPROCESS_CODE_SYSTEM_PROMPT, SUMMARIZE_HISTORY_PROMPT, \
+    UPDATE_TESTS_CODE_PROMPT
+
+JSON_BLOCK = re.compile(r"```json\s*(.*?)\s*```", re.DOTALL)
+# characters per streamed chunk
+CHUNK_SIZE = 16
+
+
+def json_block(content: str) -> str:
+    """
+    An answer in the format the prompts ask for, readable by utils.parse_json_content.
+    """
+    return "```json" + json.dumps({"content": content}) + "```"
+
+
+def _last_json_content(messages: list[BaseMessage]) -> Optional[str]:
+    for message in reversed(messages):
+        if isinstance(message, AIMessage) and isinstance(message.content, str):
+            for match in reversed(JSON_BLOCK.findall(message.content)):
+                try:
+                    return json.loads(match)["content"]
+                except (ValueError, KeyError, TypeError):
+                    continue
+    return None
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Offline stand-in for the OpenAI model: answers every agent prompt (recognized by its system prompt) with canned
+    text or `json` blocks, so the whole graph runs without an API key and always takes the same path.
+    The task is found by its buggy code in the conversation. Its first `wrong_fixes` fixes (a one-shot fix of the
+    cascade included) return the buggy code unchanged, so a run takes wrong_fixes + 1 iterations.
+    """
+
+    tasks: list[dict]
+    wrong_fixes: int = 0
+    latency_ms: float = 0.0
+
+    _fixes: dict = PrivateAttr(default_factory=dict)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @classmethod
+    def from_examples(cls, examples: list[dict], **kwargs) -> "ScriptedChatModel":
+        """
+        :param examples: humanevalpack records, the fix is their canonical solution and the tests their test
+        """
+        tasks = [{
+            "code": f"{example['declaration']}\n{example['buggy_solution']}",
+            "fixed": f"{example['declaration']}\n{example['canonical_solution']}",
+            "tests": example["test"],
+        } for example in examples]
+        return cls(tasks=tasks, **kwargs)
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        # the scripted answers never call tools
+        return self
+
+    def _task(self, messages: list[BaseMessage]) -> dict:
+        conversation = "\n".join(str(message.content) for message in messages)
+        for task in self.tasks:
+            if task["code"] in conversation:
+                return task
+        raise ValueError("The conversation is not about any of the scripted tasks")
+
+    def _fix(self, task: dict) -> str:
+        with self._lock:
+            attempt = self._fixes.get(task["code"], 0)
+            self._fixes[task["code"]] = attempt + 1
+        return task["code"] if attempt < self.wrong_fixes else task["fixed"]
+
+    def _answer(self, messages: list[BaseMessage]) -> str:
+        system_prompt = messages[0].content
+        if system_prompt == CREATE_TESTS_SYSTEM_PROMPT.content:
+            return json_block(self._task(messages)["tests"])
+        if system_prompt == UPDATE_TESTS_CODE_PROMPT.content:
+            return json_block(self._task(messages)["tests"])
+        if system_prompt in (FIX_ERROR_SYSTEM_PROMPT.content, ONE_SHOT_FIX_SYSTEM_PROMPT.content):
+            return json_block(self._fix(self._task(messages)))
+        if system_prompt == POSTPROCESS_CODE_SYSTEM_PROMPT.content:
+            # the code is already clean, the last fix is returned as is
+            return json_block(_last_json_content(messages) or self._task(messages)["code"])
+        if system_prompt == ANALYZE_CODE_SYSTEM_PROMPT.content:
+            return "The function does not follow its docstring."
+        if system_prompt == ANALYZE_ERROR_SYSTEM_PROMPT.content:
+            return "An assertion of the tests fails, the returned value is wrong."
+        if system_prompt == SUMMARIZE_HISTORY_PROMPT.content:
+            return "Earlier fixes did not pass the tests."
+        return "OK"
+
+    @staticmethod
+    def _usage(messages: list[BaseMessage], content: str) -> dict:
+        # about 4 characters per token, close enough for the token counters of the traces
+        prompt_tokens = sum(len(str(message.content)) for message in messages) // 4
+        completion_tokens = len(content) // 4
+        return {
+            "input_tokens": prompt_tokens,
+            "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    def _generate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None, run_manager=None,
+                  **kwargs) -> ChatResult:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        content = self._answer(messages)
+        message = AIMessage(content=content, usage_metadata=self._usage(messages, content))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: list[BaseMessage], stop: Optional[list[str]] = None, run_manager=None,
+                **kwargs) -> Iterator[ChatGenerationChunk]:
+        # the latency is spread over the chunks, like the tokens of a real completion. The usage comes last
+        content = self._answer(messages)
+        chunks = [content[start:start + CHUNK_SIZE] for start in range(0, len(content), CHUNK_SIZE)]
+        for text in chunks:
+            if self.latency_ms:
+                time.sleep(self.latency_ms / 1000 / len(chunks))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=text))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(messages, content)))
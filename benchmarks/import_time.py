@@ -0,0 +1,82 @@
+import argparse
+import json
+import subprocess
+import sys
+from typing import Optional
+
+# Entry points and worker-side modules with their import budgets. "forbidden" modules must not be imported at all:
+# they are loaded lazily, on first use, and importing one of them eagerly is what a regression usually looks like.
+BUDGETS = {
+    "agent.sandbox": {"budget_ms": 500, "forbidden": ["langgraph.graph", "langchain_openai", "datasets"]},
+    "agent.main": {"budget_ms": 800, "forbidden": ["langgraph.graph", "langchain_openai", "datasets"]},
+    "agent.nodes": {"budget_ms": 1500, "forbidden": ["langchain_openai", "openai", "datasets"]},
+    "eval.main": {"budget_ms": 2000, "forbidden": ["langgraph.graph", "langchain_openai", "datasets"]},
+    "single_prompt_eval.main": {"budget_ms": 2000, "forbidden": ["openai", "datasets"]},
+}
+
+
+def measure(module: str) -> tuple[Optional[float], set[str]]:
+    """
+    Imports the module in a fresh interpreter with `-X importtime`.
+    :return: cumulative import time of the module in ms (None if the import failed),
+    and every module imported along with it
+    """
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True,
+                             text=True)
+    if process.returncode != 0:
+        return None, set()
+    cumulative_us = 0
+    imported = set()
+    # lines look like "import time:  self [us] | cumulative | imported package", nesting is shown by indentation
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        imported.add(name.strip())
+        if name.strip() == module and not name[1:].startswith(" "):
+            cumulative_us = int(cumulative)
+    return cumulative_us / 1000, imported
+
+
+def check(module: str, runs: int = 3, scale: float = 1.0) -> dict:
+    """
+    Measures the module against its entry in BUDGETS.
+    :param runs: imports of the module, the fastest counts
+    :param scale: multiplier of the time budget
+    """
+    budget = BUDGETS[module]
+    timings = []
+    imported = set()
+    for _ in range(runs):
+        elapsed_ms, imported = measure(module)
+        timings.append(elapsed_ms)
+    budget_ms = budget["budget_ms"] * scale
+    eager = sorted(name for name in budget["forbidden"] if name in imported)
+    # a module that cannot even be imported (e.g. it does work at import time) fails the budget
+    import_ms = None if None in timings else round(min(timings), 1)
+    return {
+        "module": module,
+        "import_ms": import_ms,
+        "budget_ms": budget_ms,
+        "eagerly_imported": eager,
+        "ok": import_ms is not None and import_ms <= budget_ms and not eager,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Import time of the entry points, fails if a budget is exceeded.")
+    parser.add_argument("--runs", type=int, default=3, help="Imports per module, the fastest counts (default: 3)")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="Multiplier of the time budgets, for slower machines (default: 1.0)")
+    args = parser.parse_args()
+
+    results = [check(module, args.runs, args.scale) for module in BUDGETS]
+    print(json.dumps({"results": results}, indent=2))
+    if not all(result["ok"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Optional
+
+from agent import llm_cache, sandbox, test_cache
+from agent.session import AgentSession
+from agent.tools import run_code_in_sandbox, parse_stack_trace, FILENAME
+from agent.tracing import percentile
+from benchmarks.fake_model import ScriptedChatModel
+from eval.main import iter_records
+
+FIXTURE_PATH = Path(__file__).parent / "fixtures" / "humanevalpack_python.jsonl"
+# measured values that --compare reports (the rest are parameters of the measurement)
+METRIC_SUFFIXES = ("_ms", "_per_second", "seconds", "llm_calls")
+
+
+def load_fixture(path: Path = FIXTURE_PATH) -> list[dict]:
+    with open(path, "r", encoding="utf-8") as fixture_file:
+        return [json.loads(line) for line in fixture_file if line.strip()]
+
+
+def _distribution(seconds: list[float]) -> dict:
+    return {
+        "mean_ms": round(statistics.mean(seconds) * 1000, 2),
+        "p50_ms": round(percentile(seconds, 50) * 1000, 2),
+        "p95_ms": round(percentile(seconds, 95) * 1000, 2),
+    }
+
+
+def _timed(function: Callable[[], object]) -> float:
+    t0 = time.perf_counter()
+    function()
+    return time.perf_counter() - t0
+
+
+def bench_sandbox(examples: list[dict], calls: int, workers: int) -> list[dict]:
+    """
+    run_code_in_sandbox throughput per backend, the sandbox cache is off so every call runs.
+    """
+    jobs = [{"code": f"{example['declaration']}\n{example['canonical_solution']}", "tests": example["test"]}
+            for example in examples]
+    results = []
+    for backend in sandbox.BACKENDS:
+        sandbox.configure(backend, workers)
+        # starts the fork-servers
+        for job in jobs[:workers]:
+            run_code_in_sandbox.invoke(job)
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            latencies = list(pool.map(lambda i: _timed(lambda: run_code_in_sandbox.invoke(jobs[i % len(jobs)])),
+                                      range(calls)))
+        elapsed = time.perf_counter() - t0
+        results.append({"backend": backend, "calls": calls, "workers": workers,
+                        "calls_per_second": round(calls / elapsed, 2), **_distribution(latencies)})
+    sandbox.configure("subprocess")
+    return results
+
+
+def bench_agent(examples: list[dict], iterations: list[int], repeats: int) -> list[dict]:
+    """
+    Latency of a full agent run on the scripted model, by the number of fix iterations it takes.
+    """
+    example = examples[0]
+    code = f"{example['declaration']}\n{example['buggy_solution']}"
+    results = []
+    for iteration_count in iterations:
+        latencies = []
+        llm_calls = 0
+        for _ in range(repeats):
+            # a new model per run, its count of wrong fixes starts over
+            model = ScriptedChatModel.from_examples([example], wrong_fixes=iteration_count - 1)
+            # the run after the last fix needs one more iteration to be allowed
+            session = AgentSession({"model_name": "scripted", "max_iter": iteration_count + 1,
+                                    "recursion_limit": 200}, model=model)
+            t0 = time.perf_counter()
+            state = session.fix_state(code, example["docstring"])
+            latencies.append(time.perf_counter() - t0)
+            assert state["run_result"]["success"], state["run_result"]
+            llm_calls = sum(1 for span in state["trace"] for call in span["calls"] if call["kind"] == "llm")
+        results.append({"iterations": iteration_count, "repeats": repeats, "llm_calls": llm_calls,
+                        **_distribution(latencies)})
+    return results
+
+
+def _recursion_trace(frames: int) -> str:
+    lines = ["Traceback (most recent call last):",
+             f'  File "/tmp/sandbox/{FILENAME}", line 12, in <module>', "    check(f)"]
+    for _ in range(frames):
+        lines += [f'  File "/tmp/sandbox/{FILENAME}", line 3, in f', "    return f(n - 1) + 1",
+                  "           ^^^^^^^^"]
+    lines.append("RecursionError: maximum recursion depth exceeded")
+    return "\n".join(lines)
+
+
+def bench_stack_trace(frame_counts: list[int], repeats: int) -> list[dict]:
+    """
+    parse_stack_trace on recursion tracebacks of growing depth.
+    """
+    results = []
+    for frames in frame_counts:
+        trace = _recursion_trace(frames)
+        latencies = [_timed(lambda: parse_stack_trace.invoke({"trace": trace})) for _ in range(repeats)]
+        results.append({"frames": frames, "trace_bytes": len(trace), "repeats": repeats, **_distribution(latencies)})
+    return results
+
+
+def bench_eval_loop(examples: list[dict], workers: int) -> dict:
+    """
+    Examples per second through eval.main.iter_records (agent run and final sandbox check) on the scripted model.
+    """
+    model = ScriptedChatModel.from_examples(examples, wrong_fixes=1)
+    session = AgentSession({"model_name": "scripted", "max_iter": 3, "recursion_limit": 200}, model=model)
+    t0 = time.perf_counter()
+    records = list(iter_records(examples, list(range(len(examples))), session, workers=workers))
+    elapsed = time.perf_counter() - t0
+    return {
+        "examples": len(records),
+        "workers": workers,
+        "passed": sum(1 for record in records if record["status"] == "PASS"),
+        "examples_per_second": round(len(records) / elapsed, 2),
+        "seconds": round(elapsed, 3),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              timeout=10).stdout.strip() or None
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+
+def compare(current: dict, previous: dict, path: str = "") -> dict:
+    """
+    current/previous for every measured number present in both results (e.g. "agent.0.p50_ms": 0.93).
+    """
+    ratios = {}
+    if isinstance(current, dict) and isinstance(previous, dict):
+        items = [(key, current[key], previous[key]) for key in current if key in previous]
+    elif isinstance(current, list) and isinstance(previous, list):
+        items = list(zip(range(len(current)), current, previous))
+    else:
+        items = []
+    for key, new, old in items:
+        name = f"{path}.{key}" if path else str(key)
+        if isinstance(new, (int, float)) and isinstance(old, (int, float)) and not isinstance(new, bool):
+            if old and name.endswith(METRIC_SUFFIXES):
+                ratios[name] = round(new / old, 3)
+        else:
+            ratios.update(compare(new, old, name))
+    return ratios
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the sandbox, the agent graph and the eval loop "
+                                                 "on a scripted chat model (no API key needed).")
+    parser.add_argument("--calls", type=int, default=40, help="Sandbox calls per backend (default: 40)")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent sandbox calls and eval workers (default: 4)")
+    parser.add_argument("--iterations", type=int, nargs="+", default=[1, 2, 3],
+                        help="Fix iterations of the agent runs (default: 1 2 3)")
+    parser.add_argument("--repeats", type=int, default=5, help="Runs per measurement (default: 5)")
+    parser.add_argument("--output", type=str, default=None, help="Write the results to this JSON file")
+    parser.add_argument("--compare", type=str, default=None,
+                        help="Results JSON of an earlier commit, ratios current/previous are added")
+    args = parser.parse_args()
+
+    # every call should do the real work
+    sandbox.configure_cache(enabled=False)
+    llm_cache.configure("off")
+    test_cache.configure(enabled=False)
+
+    examples = load_fixture()
+    results = {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "args": vars(args),
+        },
+        "sandbox": bench_sandbox(examples, args.calls, args.workers),
+        "agent": bench_agent(examples, args.iterations, args.repeats),
+        "stack_trace": bench_stack_trace([100, 1000, 10000], args.repeats),
+        "eval_loop": bench_eval_loop(examples, args.workers),
+    }
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as previous_file:
+            previous = json.load(previous_file)
+        results["compare"] = {"commit": previous.get("meta", {}).get("commit"),
+                              "ratios": compare({key: value for key, value in results.items() if key != "meta"},
+                                                previous)}
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            output_file.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
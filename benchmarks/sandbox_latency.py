@@ -0,0 +1,65 @@
+import argparse
+import json
+import statistics
+import time
+
+from agent import sandbox
+
+CODE = '''
+def below_zero(operations):
+    balance = 0
+    for op in operations:
+        balance += op
+        if balance < 0:
+            return True
+    return False
+'''
+
+TESTS = '''
+def check(candidate):
+    assert candidate([]) == False
+    assert candidate([1, 2, -3, 1, 2, -3]) == False
+    assert candidate([1, 2, -4, 5, 6]) == True
+    assert candidate([1, -1, 2, -2, 5, -5, 4, -4]) == False
+    assert candidate([1, -1, 2, -2, 5, -5, 4, -5]) == True
+
+check(below_zero)
+'''
+
+
+def measure(backend: str, calls: int) -> dict:
+    sandbox.configure(backend, 1)
+    source = CODE + "\n\n" + TESTS
+    # the first call starts the fork-server, it is not what we want to measure
+    sandbox.execute(source, "buggy_code.py", 60)
+
+    latencies = []
+    for _ in range(calls):
+        t0 = time.perf_counter()
+        result = sandbox.execute(source, "buggy_code.py", 60)
+        latencies.append(time.perf_counter() - t0)
+        assert result["return_code"] == 0, result
+
+    latencies.sort()
+    return {
+        "backend": backend,
+        "calls": calls,
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Per-call latency of the sandbox backends.")
+    parser.add_argument("--calls", type=int, default=50, help="Calls per backend (default: 50)")
+    args = parser.parse_args()
+
+    results = [measure(backend, args.calls) for backend in sandbox.BACKENDS]
+    sandbox.configure("subprocess")
+    speedup = round(results[0]["mean_ms"] / results[1]["mean_ms"], 2)
+    print(json.dumps({"results": results, "speedup": speedup}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
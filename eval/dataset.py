@@ -0,0 +1,203 @@
+import argparse
+import json
+import mmap
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+# Arrow IPC files are memory-mapped without any decoding, the recommended snapshot format
+ARROW_SUFFIXES = (".arrow", ".feather")
+PARQUET_SUFFIXES = (".parquet",)
+JSONL_SUFFIXES = (".jsonl",)
+
+
+class _Snapshot:
+    """
+    Closes the snapshot at the end of a `with` block.
+    """
+
+    def close(self) -> None:
+        raise NotImplementedError
+
+    def __enter__(self) -> "_Snapshot":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class ArrowSnapshot(_Snapshot):
+    """
+    Rows of an Arrow table, converted to dicts one at a time on access. Backed by a memory map for .arrow files,
+    so opening is instant and only the rows that are read are paged in.
+    """
+
+    def __init__(self, table: Any):
+        self._table = table
+
+    def __len__(self) -> int:
+        return self._table.num_rows
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        return self._table.slice(index, 1).to_pylist()[0]
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for batch in self._table.to_batches():
+            yield from batch.to_pylist()
+
+    def task_ids(self) -> list:
+        return self._table.column("task_id").to_pylist()
+
+    def to_table(self) -> Any:
+        return self._table
+
+    def close(self) -> None:
+        # the memory map is released with the last reference to the table
+        self._table = None
+
+
+class JsonlSnapshot(_Snapshot):
+    """
+    Records of a JSONL file. The file is memory-mapped and only the line offsets are indexed up front,
+    a record is parsed when it is accessed.
+    """
+
+    def __init__(self, path: Path):
+        self._file = open(path, "rb")
+        # an empty file cannot be mapped
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if path.stat().st_size else b""
+        self._offsets = []
+        start = 0
+        while start < len(self._data):
+            end = self._data.find(b"\n", start)
+            end = len(self._data) if end == -1 else end
+            if self._data[start:end].strip():
+                self._offsets.append((start, end))
+            start = end + 1
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        start, end = self._offsets[index]
+        return json.loads(self._data[start:end])
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def task_ids(self) -> list:
+        return [record.get("task_id") for record in self]
+
+    def to_table(self) -> Any:
+        import pyarrow as pa
+        return pa.Table.from_pylist(list(self))
+
+    def close(self) -> None:
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._data = b""
+        self._offsets = []
+        self._file.close()
+
+
+def open_snapshot(path: str) -> Any:
+    """
+    Opens a local dataset snapshot written by `python -m eval.dataset export` (or any file of the same records).
+    Supports .arrow/.feather (Arrow IPC, memory-mapped), .parquet and .jsonl. Needs neither the HF hub nor
+    the datasets library. The snapshot keeps its file open until close() or the end of a `with` block.
+    """
+    snapshot_path = Path(path)
+    suffix = snapshot_path.suffix.lower()
+    if suffix in JSONL_SUFFIXES:
+        return JsonlSnapshot(snapshot_path)
+
+    import pyarrow as pa
+    if suffix in ARROW_SUFFIXES:
+        source = pa.memory_map(str(snapshot_path), "r")
+        try:
+            return ArrowSnapshot(pa.ipc.open_file(source).read_all())
+        except pa.ArrowInvalid:
+            # the Arrow stream format (e.g. datasets' own cache files)
+            source.seek(0)
+            return ArrowSnapshot(pa.ipc.open_stream(source).read_all())
+    if suffix in PARQUET_SUFFIXES:
+        import pyarrow.parquet as pq
+        return ArrowSnapshot(pq.read_table(str(snapshot_path), memory_map=True))
+    raise ValueError(f"Unknown snapshot format: {snapshot_path.suffix}. "
+                     f"Supported: {', '.join(ARROW_SUFFIXES + PARQUET_SUFFIXES + JSONL_SUFFIXES)}")
+
+
+def write_snapshot(table: Any, path: str) -> None:
+    """
+    Writes an Arrow table as a snapshot, the format is chosen by the suffix of the path.
+    """
+    snapshot_path = Path(path)
+    snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+    suffix = snapshot_path.suffix.lower()
+    if suffix in JSONL_SUFFIXES:
+        with open(snapshot_path, "w", encoding="utf-8") as snapshot_file:
+            for record in table.to_pylist():
+                snapshot_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return
+
+    import pyarrow as pa
+    if suffix in ARROW_SUFFIXES:
+        with pa.OSFile(str(snapshot_path), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        return
+    if suffix in PARQUET_SUFFIXES:
+        import pyarrow.parquet as pq
+        pq.write_table(table, str(snapshot_path))
+        return
+    raise ValueError(f"Unknown snapshot format: {snapshot_path.suffix}. "
+                     f"Supported: {', '.join(ARROW_SUFFIXES + PARQUET_SUFFIXES + JSONL_SUFFIXES)}")
+
+
+def task_ids(dataset: Any) -> list:
+    """
+    task_id of every example, for a snapshot or a HF dataset.
+    """
+    if hasattr(dataset, "task_ids"):
+        return dataset.task_ids()
+    return list(dataset["task_id"])
+
+
+def select_indices(dataset: Any, limit: int, selected_task_ids: Optional[list[str]] = None) -> list[int]:
+    """
+    Indices of the examples to evaluate: the given task ids in their order, or the first `limit` examples.
+    """
+    if not selected_task_ids:
+        return list(range(min(len(dataset), limit)))
+    positions = {task_id: index for index, task_id in enumerate(task_ids(dataset))}
+    missing = [task_id for task_id in selected_task_ids if task_id not in positions]
+    if missing:
+        raise ValueError(f"Unknown task ids: {', '.join(missing)}")
+    return [positions[task_id] for task_id in selected_task_ids][:limit]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local dataset snapshots for eval.main --dataset-path.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export = subparsers.add_parser("export", help="Save a HF dataset split (or convert a snapshot) to a local file")
+    export.add_argument("--output", type=str, required=True,
+                        help="Snapshot to write: .arrow (recommended), .parquet or .jsonl")
+    export.add_argument("--dataset", type=str, default="bigcode/humanevalpack",
+                        help="HF-dataset (default: bigcode/humanevalpack)")
+    export.add_argument("--name", type=str, default="python", help='Argument "name" in dataset (default: python)')
+    export.add_argument("--split", type=str, default="test", help='Dataset split (default: "test")')
+    export.add_argument("--from-path", type=str, default=None,
+                        help="Convert this local snapshot instead of downloading the HF dataset")
+    args = parser.parse_args()
+
+    if args.from_path:
+        with open_snapshot(args.from_path) as snapshot:
+            table = snapshot.to_table()
+    else:
+        from datasets import load_dataset
+        table = load_dataset(args.dataset, name=args.name, split=args.split).data.table
+    write_snapshot(table, args.output)
+    print(f"{table.num_rows} examples written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,17 +3,23 @@ import json
 import logging
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterator, Optional, TYPE_CHECKING
 
-from datasets import load_dataset
 from tqdm import tqdm
 
-from agent.main import run_agent
+from agent import inspections, llm_cache, sandbox, test_cache
+from agent.tracing import summarize_traces, time_to_sandbox, trace_tokens
 from agent.tools import run_code_in_sandbox
+from eval.dataset import open_snapshot, select_indices
+from eval.store import ResultsStore
 from utils.utils import parse_config
 
+if TYPE_CHECKING:
+    from agent.session import AgentSession
+
 
 def now_stamp() -> str:
     return datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -33,10 +39,53 @@ def normalize_code(s: Optional[str]) -> str:
     return (s or "").strip()
 
 
+def check_output(output_code: str, tests: str, canonical: str, agent_error: Optional[str] = None,
+                 timeout: int = 60, tests_only: bool = False) -> Dict[str, Any]:
+    """
+    Runs the agent's output against the dataset tests in the sandbox and decides the status of the example:
+    PASS if the tests pass or the output is the canonical solution, ERROR if the agent or the sandbox failed
+    and it did not pass, FAIL otherwise.
+    :param tests_only: only passing tests count, not an output equal to the canonical solution
+    :return: the fields of an eval record it decides
+    """
+    sandbox_error = None
+    t0 = time.perf_counter()
+    try:
+        test_result = run_code_in_sandbox.invoke(
+            {"code": output_code, "tests": tests, "timeout_time": timeout}
+        )
+    except Exception as e:
+        sandbox_error = f"{type(e).__name__}: {e}"
+        test_result = {"success": False, "error": sandbox_error}
+    exec_seconds = round(time.perf_counter() - t0, 4)
+
+    passed_tests = bool(test_result.get("success", False))
+    same_as_canonical = normalize_code(output_code) == normalize_code(canonical)
+
+    status = "PASS" if (passed_tests or (same_as_canonical and not tests_only)) else "FAIL"
+    if agent_error or sandbox_error:
+        if status != "PASS":
+            status = "ERROR"
+    return {
+        "status": status,
+        "passed_tests": passed_tests,
+        "same_as_canonical": same_as_canonical,
+        "exec_seconds": exec_seconds,
+        "sandbox_error": sandbox_error,
+        "test_result": {
+            "success": test_result.get("success", False),
+            "stdout": test_result.get("stdout"),
+            "stderr": test_result.get("stderr"),
+            "traceback": test_result.get("traceback"),
+            "error": test_result.get("error"),
+        },
+    }
+
+
 def run_single_example(
     example: Dict[str, Any],
     idx: int,
-    agent_cfg: Dict[str, Any],
+    session: "AgentSession",
 ) -> Dict[str, Any]:
     example_id = get_example_id(example, idx)
 
@@ -49,15 +98,24 @@ def run_single_example(
 
     t0 = time.perf_counter()
     agent_error = None
+    speculation = None
+    postprocess = None
+    tests_source = None
+    performance = None
+    escalated = None
+    history_stats = None
+    trace = None
 
     try:
-        output_code = run_agent(
-            buggy_code=code_input,
-            docstring=docstring,
-            max_iter=int(agent_cfg.get("max_iter", 5)),
-            recursion_limit=int(agent_cfg.get("recursion_limit", 1000)),
-        )
-        output_code = str(output_code)
+        final_state = session.fix_state(code_input, docstring)
+        output_code = str(final_state.get("code"))
+        speculation = final_state.get("speculation")
+        postprocess = final_state.get("postprocess")
+        tests_source = final_state.get("tests_source")
+        performance = (final_state.get("run_result") or {}).get("performance")
+        escalated = final_state.get("escalated")
+        history_stats = final_state.get("history_stats")
+        trace = final_state.get("trace")
     except Exception as e:
         agent_error = f"{type(e).__name__}: {e}"
         output_code = ""
@@ -65,61 +123,161 @@ def run_single_example(
     t1 = time.perf_counter()
     gen_seconds = round(t1 - t0, 4)
 
-    sandbox_error = None
-    t2 = time.perf_counter()
-    try:
-        test_result = run_code_in_sandbox.invoke(
-            {"code": output_code, "tests": tests}
-        )
-    except Exception as e:
-        sandbox_error = f"{type(e).__name__}: {e}"
-        test_result = {"success": False, "error": sandbox_error}
-    t3 = time.perf_counter()
-    exec_seconds = round(t3 - t2, 4)
-
-    passed_tests = bool(test_result.get("success", False))
-    same_as_canonical = normalize_code(output_code) == normalize_code(canonical)
-
-    status = "PASS" if (passed_tests or same_as_canonical) else "FAIL"
-    if agent_error or sandbox_error:
-        if status != "PASS":
-            status = "ERROR"
-
+    checked = check_output(output_code, tests, canonical, agent_error)
     record: Dict[str, Any] = {
         "idx": idx,
         "example_id": example_id,
-        "status": status,
-        "passed_tests": passed_tests,
-        "same_as_canonical": same_as_canonical,
+        "status": checked["status"],
+        "passed_tests": checked["passed_tests"],
+        "same_as_canonical": checked["same_as_canonical"],
         "gen_seconds": gen_seconds,
-        "exec_seconds": exec_seconds,
+        "exec_seconds": checked["exec_seconds"],
         "agent_error": agent_error,
-        "sandbox_error": sandbox_error,
-        "test_result": {
-            "success": test_result.get("success", False),
-            "stdout": test_result.get("stdout"),
-            "stderr": test_result.get("stderr"),
-            "traceback": test_result.get("traceback"),
-            "error": test_result.get("error"),
-        },
+        "sandbox_error": checked["sandbox_error"],
+        "speculation": speculation,
+        "postprocess": postprocess,
+        "tests_source": tests_source,
+        "performance": performance,
+        "escalated": escalated,
+        "history_stats": history_stats,
+        "tokens": trace_tokens(trace) if trace is not None else None,
+        "time_to_sandbox": time_to_sandbox(trace) if trace is not None else None,
+        "trace": trace,
+        "test_result": checked["test_result"],
         "output_code": output_code,
     }
     return record
 
 
-def summarize(records: list) -> Dict[str, Any]:
+def load_completed_records(path: Path) -> Dict[str, Dict[str, Any]]:
+    """
+    Reads a previous eval JSONL and indexes its finished records by example_id.
+    ERROR records are left out, so they are retried. Broken lines (e.g. a record cut off by a crash) are skipped.
+    """
+    completed: Dict[str, Dict[str, Any]] = {}
+    with open(path, "r", encoding="utf-8") as eval_file:
+        for line in eval_file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if not isinstance(record, dict) or "example_id" not in record:
+                continue
+            if record.get("status") == "ERROR":
+                completed.pop(record["example_id"], None)
+                continue
+            completed[record["example_id"]] = record
+    return completed
+
+
+def iter_records(
+    dataset: Any,
+    indices: list,
+    session: "AgentSession",
+    workers: int = 1,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yields evaluation records as soon as each example finishes.
+    With workers > 1 examples are run concurrently in a thread pool (agent runs are dominated by LLM round-trips),
+    so records come in completion order, not in index order. All of them share the session's graph and connections.
+    """
+    if workers <= 1:
+        for i in indices:
+            yield run_single_example(example=dataset[i], idx=i, session=session)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(run_single_example, example=dataset[i], idx=i, session=session)
+            for i in indices
+        ]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def _summarize_tokens(records: list, passed: int, prices: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    prompt_tokens = sum(record["tokens"]["prompt_tokens"] for record in records if record.get("tokens"))
+    completion_tokens = sum(record["tokens"]["completion_tokens"] for record in records if record.get("tokens"))
+    tokens: Dict[str, Any] = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        # everything that was spent, failed tasks included, divided by the tasks that got solved
+        "per_solved_task": round((prompt_tokens + completion_tokens) / passed, 1) if passed else None,
+    }
+    prompt_price = (prices or {}).get("price_per_1m_prompt_tokens")
+    completion_price = (prices or {}).get("price_per_1m_completion_tokens")
+    if prompt_price is not None and completion_price is not None:
+        cost = (prompt_tokens * float(prompt_price) + completion_tokens * float(completion_price)) / 1_000_000
+        tokens["cost_usd"] = round(cost, 4)
+        tokens["cost_per_solved_task_usd"] = round(cost / passed, 4) if passed else None
+    return tokens
+
+
+def summarize(records: list, prices: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    :param prices: config with price_per_1m_prompt_tokens and price_per_1m_completion_tokens, to add the cost in USD
+    """
     total = len(records)
     passed = sum(1 for record in records if record["status"] == "PASS")
     errored = sum(1 for record in records if record["status"] == "ERROR")
     failed = total - passed - errored
     pass_rate = round(passed / total, 4) if total > 0 else 0.0
-    return {
+    summary = {
         "total": total,
         "passed": passed,
         "failed": failed,
         "errored": errored,
         "pass_rate": pass_rate,
     }
+    speculations = [record["speculation"] for record in records if record.get("speculation")]
+    if speculations:
+        summary["speculation"] = {
+            key: sum(speculation[key] for speculation in speculations)
+            for key in ("rounds", "passed", "won_by_alternative")
+        }
+    postprocesses = [record["postprocess"] for record in records if record.get("postprocess")]
+    if postprocesses:
+        runs = sum(postprocess["runs"] for postprocess in postprocesses)
+        llm_fallbacks = sum(postprocess["llm_fallbacks"] for postprocess in postprocesses)
+        summary["postprocess"] = {
+            "runs": runs,
+            "llm_fallbacks": llm_fallbacks,
+            "llm_fallback_rate": round(llm_fallbacks / runs, 4) if runs else 0.0,
+        }
+
+    tests_sources = [record["tests_source"] for record in records if "tests_source" in record]
+    if tests_sources:
+        # "none": the tests could not be generated within max_test_attempts
+        summary["tests_source"] = {source: sum(1 for value in tests_sources if (value or "none") == source)
+                                   for source in ("cache", "llm", "none")}
+
+    performances = [record["performance"] for record in records if record.get("performance")]
+    if performances:
+        # too_slow: the last fix passed the tests but not the performance check, max_iter ran out
+        summary["performance"] = {
+            "checked": len(performances),
+            "too_slow": sum(1 for performance in performances if not performance["passed"]),
+        }
+
+    escalations = [record["escalated"] for record in records if record.get("escalated") is not None]
+    if escalations:
+        # runs of the cascade whose one-shot fix failed and went on to the full graph
+        escalated = sum(escalations)
+        summary["cascade"] = {
+            "runs": len(escalations),
+            "escalated": escalated,
+            "escalation_rate": round(escalated / len(escalations), 4),
+        }
+
+    traces = [record["trace"] for record in records if record.get("trace")]
+    if traces:
+        summary["latency"] = summarize_traces(traces)
+        summary["tokens"] = _summarize_tokens(records, passed, prices)
+    return summary
 
 
 def main() -> None:
@@ -150,6 +308,19 @@ def main() -> None:
         default="test",
         help='Dataset split (default: "test")',
     )
+    parser.add_argument(
+        "--dataset-path",
+        type=str,
+        default=None,
+        help="Local snapshot (.arrow, .parquet or .jsonl, see eval.dataset export) used instead of the HF dataset",
+    )
+    parser.add_argument(
+        "--task-ids",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Evaluate only these task_ids (in the given order)",
+    )
     parser.add_argument(
         "--results_dir",
         type=str,
@@ -162,6 +333,24 @@ def main() -> None:
         default=164,
         help='Limit number of examples (default: 164)',
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of examples evaluated concurrently (default: 1)",
+    )
+    parser.add_argument(
+        "--resume",
+        type=str,
+        default=None,
+        help="Previous eval_*.jsonl: its PASS/FAIL examples are reused, only missing and ERROR ones are run",
+    )
+    parser.add_argument(
+        "--results-db",
+        type=str,
+        default=None,
+        help="Also write the run into this SQLite results database (queried with python -m eval.store)",
+    )
     # we do not parse dir python3 -m eval.main
     args = parser.parse_args(sys.argv[4:])
 
@@ -182,32 +371,72 @@ def main() -> None:
     if not isinstance(cfg, dict):
         logging.warning("Config was parsed incorrectly. It was set as an empty dict.")
         cfg = {}
+    sandbox.configure_from_config(cfg, min_workers=args.workers)
+    llm_cache.configure_from_config(cfg)
+    test_cache.configure_from_config(cfg)
+    inspections.configure_from_config(cfg)
+    # the agent is a heavy import, it is only loaded once an eval actually runs
+    from agent.session import AgentSession
+
+    # the graph and the HTTP connections are set up once and shared by all examples
+    session = AgentSession({**cfg, "http_max_connections": max(int(cfg.get("http_max_connections", 32)), args.workers)})
+
+    if args.dataset_path:
+        logging.info("Opening dataset snapshot: %s", args.dataset_path)
+        dataset = open_snapshot(args.dataset_path)
+    else:
+        # so is the HF datasets library, a local snapshot does not need it
+        from datasets import load_dataset
+
+        logging.info("Loading dataset: %s (name=%s, split=%s)", args.dataset, args.name, args.split)
+        dataset = load_dataset(args.dataset, name=args.name, split=args.split)
 
-    logging.info("Loading dataset: %s (name=%s, split=%s)", args.dataset, args.name, args.split)
-    dataset = load_dataset(args.dataset, name=args.name, split=args.split)
-
-    indices = list(range(len(dataset)))
+    try:
+        indices = select_indices(dataset, args.limit, args.task_ids)
+    except ValueError as e:
+        parser.error(str(e))
 
-    total_items = len(indices)
+    total_items = len(dataset)
     records = []
     passed_count = 0
 
-    progress_iter = tqdm(indices, desc="Evaluating", ncols=100)
+    if args.resume:
+        completed = load_completed_records(Path(args.resume))
+        pending = []
+        for i in indices:
+            example_id = get_example_id(dataset[i], i)
+            if example_id in completed:
+                records.append(completed[example_id])
+            else:
+                pending.append(i)
+        logging.info("Resuming from %s: %d done, %d to run", args.resume, len(records), len(pending))
+        passed_count = sum(1 for record in records if record["status"] == "PASS")
+    else:
+        pending = indices
+
+    store = None
+    if args.results_db:
+        store = ResultsStore(args.results_db)
+        store.start_run(jsonl_path.stem, stamp, cfg, args.dataset_path or f"{args.dataset}/{args.name}/{args.split}")
+        for rec in records:
+            store.add_record(jsonl_path.stem, rec)
+
+    progress_iter = tqdm(total=len(indices), initial=len(records), desc="Evaluating", ncols=100)
 
     with open(jsonl_path, "w", encoding="utf-8") as eval_file:
-        for i in progress_iter:
-            if i >= args.limit:
-                break
-            example = dataset[i]
-            rec = run_single_example(
-                example=example,
-                idx=i,
-                agent_cfg=cfg,
-            )
+        # reused records go first, so the new file is a complete run on its own and can be resumed from again
+        for rec in records:
+            eval_file.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        eval_file.flush()
+
+        for rec in iter_records(dataset, pending, session, workers=args.workers):
             records.append(rec)
+            progress_iter.update(1)
 
             eval_file.write(json.dumps(rec, ensure_ascii=False) + "\n")
             eval_file.flush()
+            if store is not None:
+                store.add_record(jsonl_path.stem, rec)
 
             if rec["status"] == "PASS":
                 passed_count += 1
@@ -220,9 +449,22 @@ def main() -> None:
                 msg = f"FAIL {passed_count}/{len(records)} | idx={rec['idx']} id={rec['example_id']}"
                 logging.info(msg)
 
-    summary = summarize(records)
+    progress_iter.close()
+    session.close()
+    if args.dataset_path:
+        dataset.close()
+    records.sort(key=lambda record: record["idx"])
+
+    summary = summarize(records, cfg)
+    summary["sandbox_cache"] = sandbox.cache_stats()
+    summary["llm_cache"] = llm_cache.get_cached_llm().stats()
+    summary["test_cache"] = test_cache.cache_stats()
+    summary["inspections_cache"] = inspections.cache_stats()
     with open(summary_path, "w", encoding="utf-8") as fsum:
         json.dump(summary, fsum, ensure_ascii=False, indent=2)
+    if store is not None:
+        store.finish_run(jsonl_path.stem, summary)
+        store.close()
 
     print(json.dumps(summary, ensure_ascii=False))
 
@@ -0,0 +1,180 @@
+import argparse
+import json
+import logging
+import os
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Dict, Iterator
+
+from tqdm import tqdm
+
+from agent import sandbox
+from eval.dataset import open_snapshot
+from eval.main import check_output, ensure_dir, get_example_id, now_stamp, summarize
+from utils.utils import parse_config
+
+# jobs submitted ahead of the finished ones, per worker: the records are streamed, not loaded all at once
+IN_FLIGHT_PER_WORKER = 2
+
+
+def _init_worker(cfg: Dict[str, Any], cache: bool) -> None:
+    # every worker process runs one check at a time, it needs one fork-server at most
+    sandbox.configure_from_config({**cfg, "sandbox_workers": 1})
+    if not cache:
+        sandbox.configure_cache(enabled=False)
+
+
+def _check(job: Dict[str, Any]) -> Dict[str, Any]:
+    return check_output(job["output_code"], job["tests"], job["canonical"], job["agent_error"],
+                        timeout=job["timeout"], tests_only=job["tests_only"])
+
+
+def index_examples(dataset: Any) -> Dict[str, Dict[str, str]]:
+    """
+    The tests and the canonical solution of every example of the dataset, by example_id.
+    """
+    examples = {}
+    for idx in range(len(dataset)):
+        example = dataset[idx]
+        examples[get_example_id(example, idx)] = {
+            "tests": example.get("test", ""),
+            "canonical": example.get("canonical_solution", ""),
+        }
+    return examples
+
+
+def read_records(path: Path) -> Iterator[Dict[str, Any]]:
+    """
+    Streams the records of an eval JSONL. Broken lines are skipped, like eval.main --resume does.
+    """
+    with open(path, "r", encoding="utf-8") as eval_file:
+        for line in eval_file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(record, dict) and "example_id" in record:
+                yield record
+
+
+def rescore_records(records: Iterator[Dict[str, Any]], examples: Dict[str, Dict[str, str]], workers: int,
+                    cfg: Dict[str, Any], timeout: int = 60, tests_only: bool = False,
+                    cache: bool = True) -> Iterator[Dict[str, Any]]:
+    """
+    Checks the output_code of every record again against the tests of its example, in a pool of worker processes.
+    No LLM is called. Yields the records with the fields decided by eval.main.check_output replaced (and the old
+    status in "previous_status"), in completion order. Records of examples the dataset does not have are left out.
+    :param timeout: seconds a single check may run in the sandbox
+    :param tests_only: only passing tests count, not an output equal to the canonical solution
+    :param cache: reuse sandbox results (sandbox_cache in the config)
+    """
+    pending: Dict[Future, Dict[str, Any]] = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(cfg, cache)) as pool:
+        try:
+            for record in records:
+                example = examples.get(record["example_id"])
+                if example is None:
+                    logging.warning("Unknown example %s, skipped", record["example_id"])
+                    continue
+                job = {
+                    "output_code": record.get("output_code") or "",
+                    "tests": example["tests"],
+                    "canonical": example["canonical"],
+                    "agent_error": record.get("agent_error"),
+                    "timeout": timeout,
+                    "tests_only": tests_only,
+                }
+                pending[pool.submit(_check, job)] = record
+                if len(pending) >= workers * IN_FLIGHT_PER_WORKER:
+                    yield from _finished(pending, wait(pending, return_when=FIRST_COMPLETED).done)
+            while pending:
+                yield from _finished(pending, wait(pending, return_when=FIRST_COMPLETED).done)
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _finished(pending: Dict[Future, Dict[str, Any]], done: set) -> Iterator[Dict[str, Any]]:
+    for future in done:
+        record = pending.pop(future)
+        yield {**record, **future.result(), "previous_status": record.get("status")}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Checks the outputs of an existing eval_*.jsonl again against the dataset tests, without the agent."
+    )
+    parser.add_argument("path", type=str, help="eval_*.jsonl to re-score")
+    parser.add_argument("--config", type=str, default="config.yaml", help="Path to config (default: config.yaml)")
+    parser.add_argument("--dataset", type=str, default="bigcode/humanevalpack",
+                        help="HF-dataset (default: bigcode/humanevalpack)")
+    parser.add_argument("--name", type=str, default="python", help='Argument "name" in dataset (default: python)')
+    parser.add_argument("--split", type=str, default="test", help='Dataset split (default: "test")')
+    parser.add_argument("--dataset-path", type=str, default=None,
+                        help="Local snapshot (see eval.dataset export) used instead of the HF dataset")
+    parser.add_argument("--results_dir", type=str, default="results", help='Results directory (default: "results")')
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Worker processes checking outputs in parallel (default: number of CPUs)")
+    parser.add_argument("--timeout", type=int, default=60, help="Seconds per check in the sandbox (default: 60)")
+    parser.add_argument("--tests-only", action="store_true",
+                        help="PASS only if the tests pass, an output equal to the canonical solution is not enough")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Run every check, even if the sandbox cache has the result (e.g. after a sandbox change)")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] %(levelname)s: %(message)s",
+        datefmt="%H:%M:%S",
+    )
+
+    cfg = parse_config(args.config) if Path(args.config).exists() else {}
+    if not isinstance(cfg, dict):
+        cfg = {}
+
+    if args.dataset_path:
+        with open_snapshot(args.dataset_path) as dataset:
+            examples = index_examples(dataset)
+    else:
+        from datasets import load_dataset
+        examples = index_examples(load_dataset(args.dataset, name=args.name, split=args.split))
+
+    results_dir = Path(args.results_dir)
+    ensure_dir(results_dir)
+    stamp = now_stamp()
+    jsonl_path = results_dir / f"rescore_{stamp}.jsonl"
+    summary_path = results_dir / f"summary_rescore_{stamp}.json"
+
+    records = []
+    started = time.perf_counter()
+    progress_iter = tqdm(desc="Re-scoring", ncols=100)
+    with open(jsonl_path, "w", encoding="utf-8") as rescore_file:
+        for record in rescore_records(read_records(Path(args.path)), examples, max(args.workers, 1), cfg,
+                                      args.timeout, args.tests_only, not args.no_cache):
+            records.append(record)
+            progress_iter.update(1)
+            rescore_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+    progress_iter.close()
+    seconds = time.perf_counter() - started
+    records.sort(key=lambda record: record.get("idx", 0))
+
+    summary = summarize(records, cfg)
+    summary["rescore"] = {
+        "source": args.path,
+        "seconds": round(seconds, 2),
+        "checks_per_second": round(len(records) / seconds, 2) if seconds > 0 else None,
+        # "PASS->FAIL": outputs that no longer pass
+        "changed": dict(Counter(f"{record['previous_status']}->{record['status']}" for record in records
+                                if record["previous_status"] != record["status"])),
+    }
+    with open(summary_path, "w", encoding="utf-8") as summary_file:
+        json.dump(summary, summary_file, ensure_ascii=False, indent=2)
+
+    print(json.dumps(summary, ensure_ascii=False))
+    logging.info("Re-scoring finished. JSONL: %s | SUMMARY: %s", jsonl_path, summary_path)
+
+
+if __name__ == "__main__":
+    main()
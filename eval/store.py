@@ -0,0 +1,246 @@
+import argparse
+import hashlib
+import json
+import sqlite3
+import sys
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+from agent.tracing import percentile
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    started TEXT NOT NULL,
+    model TEXT,
+    config_hash TEXT,
+    config TEXT,
+    dataset TEXT,
+    summary TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_model ON runs (model);
+CREATE INDEX IF NOT EXISTS runs_config_hash ON runs (config_hash);
+
+CREATE TABLE IF NOT EXISTS results (
+    run_id TEXT NOT NULL REFERENCES runs (run_id),
+    example_id TEXT NOT NULL,
+    idx INTEGER,
+    status TEXT NOT NULL,
+    passed_tests INTEGER,
+    gen_seconds REAL,
+    exec_seconds REAL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    output_hash TEXT,
+    agent_error TEXT,
+    test_result TEXT,
+    PRIMARY KEY (run_id, example_id)
+);
+CREATE INDEX IF NOT EXISTS results_example_id ON results (example_id, status);
+"""
+
+
+def config_hash(cfg: Dict[str, Any]) -> str:
+    """
+    Short content hash of a config, runs with the same settings share it.
+    """
+    return hashlib.sha256(json.dumps(cfg, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+class ResultsStore:
+    """
+    Eval records of many runs in one SQLite file, indexed by run, model, config hash and example_id,
+    so runs can be compared without re-reading their JSONL files.
+    """
+
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(path)
+        self._connection.row_factory = sqlite3.Row
+        with self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+
+    def start_run(self, run_id: str, started: str, cfg: Dict[str, Any], dataset: Optional[str] = None) -> None:
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO runs (run_id, started, model, config_hash, config, dataset) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (run_id, started, cfg.get("model_name"), config_hash(cfg), json.dumps(cfg, default=str), dataset),
+            )
+
+    def add_record(self, run_id: str, record: Dict[str, Any]) -> None:
+        tokens = record.get("tokens") or {}
+        output_code = record.get("output_code") or ""
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO results (run_id, example_id, idx, status, passed_tests, gen_seconds, "
+                "exec_seconds, prompt_tokens, completion_tokens, output_hash, agent_error, test_result) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    run_id,
+                    record["example_id"],
+                    record.get("idx"),
+                    record["status"],
+                    int(bool(record.get("passed_tests"))),
+                    record.get("gen_seconds"),
+                    record.get("exec_seconds"),
+                    tokens.get("prompt_tokens"),
+                    tokens.get("completion_tokens"),
+                    hashlib.sha256(output_code.encode("utf-8")).hexdigest(),
+                    record.get("agent_error"),
+                    json.dumps(record.get("test_result"), ensure_ascii=False),
+                ),
+            )
+
+    def finish_run(self, run_id: str, summary: Dict[str, Any]) -> None:
+        with self._connection:
+            self._connection.execute("UPDATE runs SET summary = ? WHERE run_id = ?",
+                                     (json.dumps(summary, ensure_ascii=False), run_id))
+
+    def runs(self, model: Optional[str] = None, config: Optional[str] = None) -> list[dict]:
+        query = ("SELECT runs.run_id, started, model, config_hash, dataset, COUNT(results.example_id) AS total, "
+                 "SUM(results.status = 'PASS') AS passed FROM runs LEFT JOIN results USING (run_id)")
+        query, params = self._filter(query, model, config)
+        rows = self._connection.execute(query + " GROUP BY runs.run_id ORDER BY started", params)
+        return [dict(row) for row in rows]
+
+    def regressions(self, base_run: str, head_run: str) -> Dict[str, list]:
+        """
+        Examples that passed in base_run and do not in head_run, and the other way round.
+        """
+        query = ("SELECT base.example_id, base.status AS base_status, head.status AS head_status "
+                 "FROM results AS base JOIN results AS head ON head.example_id = base.example_id "
+                 "WHERE base.run_id = ? AND head.run_id = ? AND (base.status = 'PASS') != (head.status = 'PASS') "
+                 "ORDER BY base.idx")
+        rows = [dict(row) for row in self._connection.execute(query, (base_run, head_run))]
+        return {
+            "regressed": [row for row in rows if row["base_status"] == "PASS"],
+            "fixed": [row for row in rows if row["head_status"] == "PASS"],
+        }
+
+    def flakiness(self, model: Optional[str] = None, config: Optional[str] = None) -> list[dict]:
+        """
+        Examples that both passed and failed across the selected runs, the least stable first.
+        """
+        query = ("SELECT example_id, COUNT(*) AS runs, SUM(status = 'PASS') AS passed, "
+                 "COUNT(DISTINCT output_hash) AS distinct_outputs FROM results JOIN runs USING (run_id)")
+        query, params = self._filter(query, model, config)
+        query += " GROUP BY example_id HAVING passed > 0 AND passed < runs"
+        rows = [dict(row) for row in self._connection.execute(query, params)]
+        for row in rows:
+            row["pass_rate"] = round(row["passed"] / row["runs"], 4)
+        return sorted(rows, key=lambda row: abs(row["pass_rate"] - 0.5))
+
+    def latency(self, run_ids: Optional[list[str]] = None) -> list[dict]:
+        """
+        Distribution of generation and sandbox seconds per run.
+        """
+        runs = run_ids or [run["run_id"] for run in self.runs()]
+        distributions = []
+        for run_id in runs:
+            rows = self._connection.execute(
+                "SELECT gen_seconds, exec_seconds FROM results WHERE run_id = ? AND gen_seconds IS NOT NULL",
+                (run_id,)).fetchall()
+            if not rows:
+                continue
+            distribution = {"run_id": run_id, "examples": len(rows)}
+            for column in ("gen_seconds", "exec_seconds"):
+                values = [row[column] for row in rows if row[column] is not None]
+                if values:
+                    distribution[column] = {"p50": round(percentile(values, 50), 4),
+                                            "p95": round(percentile(values, 95), 4),
+                                            "max": round(max(values), 4)}
+            distributions.append(distribution)
+        return distributions
+
+    def close(self) -> None:
+        self._connection.close()
+
+    @staticmethod
+    def _filter(query: str, model: Optional[str], config: Optional[str]) -> tuple[str, list]:
+        conditions, params = [], []
+        if model is not None:
+            conditions.append("runs.model = ?")
+            params.append(model)
+        if config is not None:
+            conditions.append("runs.config_hash = ?")
+            params.append(config)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        return query, params
+
+
+def _read_jsonl(path: Path) -> Iterator[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as eval_file:
+        for line in eval_file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(record, dict) and "example_id" in record and "status" in record:
+                yield record
+
+
+def import_jsonl(store: ResultsStore, path: Path, cfg: Dict[str, Any]) -> str:
+    """
+    Adds an existing eval_TIMESTAMP.jsonl (and its summary_TIMESTAMP.json, if present) as a run.
+    :return: run id, the file name without suffix
+    """
+    run_id = path.stem
+    stamp = run_id[len("eval_"):] if run_id.startswith("eval_") else run_id
+    store.start_run(run_id, stamp, cfg)
+    for record in _read_jsonl(path):
+        store.add_record(run_id, record)
+    summary_path = path.with_name(f"summary_{stamp}.json")
+    if summary_path.exists():
+        with open(summary_path, "r", encoding="utf-8") as summary_file:
+            store.finish_run(run_id, json.load(summary_file))
+    return run_id
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Queries over the eval results database (eval.main --results-db).")
+    parser.add_argument("--db", type=str, default="results/results.sqlite",
+                        help="Results database (default: results/results.sqlite)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    runs = subparsers.add_parser("runs", help="List runs with their pass counts")
+    flaky = subparsers.add_parser("flaky", help="Examples that both passed and failed across runs")
+    for subparser in (runs, flaky):
+        subparser.add_argument("--model", type=str, default=None, help="Only runs of this model")
+        subparser.add_argument("--config-hash", type=str, default=None, help="Only runs with this config hash")
+
+    regressions = subparsers.add_parser("regressions", help="Examples that changed between two runs")
+    regressions.add_argument("base", type=str, help="Run id of the baseline")
+    regressions.add_argument("head", type=str, help="Run id to compare with the baseline")
+
+    latency = subparsers.add_parser("latency", help="Generation and sandbox latency per run")
+    latency.add_argument("run_ids", type=str, nargs="*", help="Runs to show (default: all)")
+
+    import_parser = subparsers.add_parser("import", help="Add existing eval_*.jsonl files as runs")
+    import_parser.add_argument("paths", type=str, nargs="+", help="eval_*.jsonl files")
+    import_parser.add_argument("--config", type=str, default=None,
+                               help="Config the runs were made with, for their model and config hash")
+    args = parser.parse_args()
+
+    store = ResultsStore(args.db)
+    if args.command == "runs":
+        output = store.runs(args.model, args.config_hash)
+    elif args.command == "flaky":
+        output = store.flakiness(args.model, args.config_hash)
+    elif args.command == "regressions":
+        output = store.regressions(args.base, args.head)
+    elif args.command == "latency":
+        output = store.latency(args.run_ids)
+    else:
+        from utils.utils import parse_config
+        cfg = parse_config(args.config) if args.config else {}
+        output = [import_jsonl(store, Path(path), cfg) for path in args.paths]
+    store.close()
+    json.dump(output, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -7,5 +7,9 @@
 export DEFAULT_PROJECT_PATH="$(pwd)"
 
 CONFIG_PATH="config.yaml"
-IDE_BIN_HOME=$(grep '^pycharm_bin_directory:' "$CONFIG_PATH" | sed 's/pycharm_bin_directory:[[:space:]]*//')
-exec "$IDE_BIN_HOME/../MacOS/pycharm" inspect "$@"
\ No newline at end of file
+IDE_BIN_HOME=$(grep '^pycharm_bin_directory:' "$CONFIG_PATH" | sed 's/pycharm_bin_directory:[[:space:]]*//; s/[[:space:]]*#.*$//')
+# macOS app bundle, otherwise the launcher of the Linux/Windows distributions
+if [ -x "$IDE_BIN_HOME/../MacOS/pycharm" ]; then
+  exec "$IDE_BIN_HOME/../MacOS/pycharm" inspect "$@"
+fi
+exec "$IDE_BIN_HOME/pycharm.sh" inspect "$@"
@@ -1,16 +1,31 @@
-from datasets import load_dataset
-from dotenv import load_dotenv
+import argparse
+import functools
+from typing import Optional
 
 from agent.tools import run_code_in_sandbox
-from openai import OpenAI
 
-load_dotenv()
-client = OpenAI()
 
+@functools.lru_cache(maxsize=None)
+def get_client():
+    # the OpenAI client and the env are loaded on the first request, not on import
+    from dotenv import load_dotenv
+    from openai import OpenAI
 
-def quick_eval_one():
+    load_dotenv()
+    return OpenAI()
+
+
+def quick_eval_one(dataset_path: Optional[str] = None):
+    """
+    :param dataset_path: local snapshot (see eval.dataset) to use instead of downloading bigcode/humanevalpack
+    """
     passed = 0
-    dataset = load_dataset("bigcode/humanevalpack", name="python", split="test")
+    if dataset_path:
+        from eval.dataset import open_snapshot
+        dataset = open_snapshot(dataset_path)
+    else:
+        from datasets import load_dataset
+        dataset = load_dataset("bigcode/humanevalpack", name="python", split="test")
     for example in dataset:
 
         buggy_code = example["declaration"] + "\n" + example["buggy_solution"]
@@ -27,6 +42,8 @@ def quick_eval_one():
         if result["success"]:
             passed += 1
         print(passed)
+    if dataset_path:
+        dataset.close()
 
 
 def run_with_gpt(buggy_code: str, docstring: str) -> str:
@@ -47,7 +64,7 @@ def run_with_gpt(buggy_code: str, docstring: str) -> str:
     Исправь код так, чтобы он полностью соответствовал описанию.
     Верни ТОЛЬКО готовый Python-код функции, без пояснений и текста. Возвращай всё и без обёртки ```python ```
     """
-    response = client.chat.completions.create(
+    response = get_client().chat.completions.create(
         model="gpt-4.1",
         messages=[
             {"role": "system", "content": "Ты — опытный Python разработчик. Исправляй баги в коде."},
@@ -61,4 +78,8 @@ def run_with_gpt(buggy_code: str, docstring: str) -> str:
     return code
 
 
-quick_eval_one()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Single LLM call baseline on humanevalpack.")
+    parser.add_argument("--dataset-path", type=str, default=None,
+                        help="Local snapshot (.arrow, .parquet or .jsonl) used instead of the HF dataset")
+    quick_eval_one(parser.parse_args().dataset_path)
@@ -0,0 +1,14 @@
+from agent.cache import ResultCache, make_key
+
+
+def test_overwritten_key_is_counted_once(tmp_path):
+    cache = ResultCache(directory=str(tmp_path))
+    key = make_key("code", "tests")
+    cache.put(key, {"stdout": "x" * 100})
+    cache.put(key, {"stdout": "y" * 100})
+
+    size = sum(path.stat().st_size for path in tmp_path.glob("*/*.json"))
+    assert cache.stats()["disk_bytes"] == size
+    # a new cache over the same directory counts the files that are there
+    assert ResultCache(directory=str(tmp_path)).stats()["disk_bytes"] == size
+
@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+from eval.dataset import open_snapshot, select_indices, write_snapshot
+
+RECORDS = [{"task_id": "Python/0", "test": "assert True"}, {"task_id": "Python/1", "test": "assert 1"}]
+
+
+@pytest.fixture
+def jsonl_snapshot(tmp_path):
+    path = tmp_path / "snapshot.jsonl"
+    # blank lines are skipped
+    path.write_text("\n".join(json.dumps(record) for record in RECORDS) + "\n\n", encoding="utf-8")
+    return path
+
+
+def test_jsonl_records_are_read_on_access(jsonl_snapshot):
+    with open_snapshot(str(jsonl_snapshot)) as snapshot:
+        assert len(snapshot) == 2
+        assert snapshot[1] == RECORDS[1]
+        assert list(snapshot) == RECORDS
+        assert select_indices(snapshot, 10, ["Python/1"]) == [1]
+
+
+def test_jsonl_snapshot_closes_its_file_and_map(jsonl_snapshot):
+    snapshot = open_snapshot(str(jsonl_snapshot))
+    data, file = snapshot._data, snapshot._file
+    snapshot.close()
+    assert data.closed
+    assert file.closed
+    assert len(snapshot) == 0
+    # closing twice is fine, like files
+    snapshot.close()
+
+
+def test_empty_jsonl_snapshot(tmp_path):
+    path = tmp_path / "empty.jsonl"
+    path.write_bytes(b"")
+    with open_snapshot(str(path)) as snapshot:
+        assert len(snapshot) == 0
+    assert snapshot._file.closed
+
+
+def test_arrow_snapshot_round_trip(tmp_path, jsonl_snapshot):
+    pytest.importorskip("pyarrow")
+    path = tmp_path / "snapshot.arrow"
+    with open_snapshot(str(jsonl_snapshot)) as snapshot:
+        write_snapshot(snapshot.to_table(), str(path))
+    with open_snapshot(str(path)) as snapshot:
+        assert list(snapshot) == RECORDS
+        assert snapshot.task_ids() == ["Python/0", "Python/1"]
@@ -0,0 +1,23 @@
+import asyncio
+
+from agent.graph import ASYNC_NODES, SYNC_NODES, compile_graph
+from agent.nodes import aone_shot_fix
+
+# nodes that call the LLM or the sandbox, the async graph must await them
+BLOCKING_NODES = ("one_shot_fix", "analyze_code", "create_tests", "validate_code", "run_code", "check_performance",
+                  "analyze_error", "fix_code", "postprocess_code")
+
+
+def test_async_nodes_are_coroutines():
+    assert set(ASYNC_NODES) == set(SYNC_NODES)
+    for name in BLOCKING_NODES:
+        assert asyncio.iscoroutinefunction(ASYNC_NODES[name]), name
+        assert not asyncio.iscoroutinefunction(SYNC_NODES[name]), name
+
+
+def test_async_graph_one_shot_fix_is_the_coroutine():
+    runnable = compile_graph(use_async=True).builder.nodes["one_shot_fix"].runnable
+    # the node is wrapped by agent.tracing.traced, functools.wraps keeps the wrapped node
+    assert runnable.func is None
+    assert asyncio.iscoroutinefunction(runnable.afunc)
+    assert runnable.afunc.__wrapped__ is aone_shot_fix
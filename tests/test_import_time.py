@@ -0,0 +1,11 @@
+import pytest
+
+from benchmarks.import_time import BUDGETS, check
+
+
+@pytest.mark.parametrize("module", BUDGETS)
+def test_import_time_budget(module):
+    result = check(module)
+    assert result["import_ms"] is not None, f"{module} cannot be imported"
+    assert result["eagerly_imported"] == [], f"{module} imports lazily loaded modules eagerly"
+    assert result["import_ms"] <= result["budget_ms"]
@@ -0,0 +1,74 @@
+from typing import Optional
+
+import pytest
+
+from agent import llm_cache, sandbox, test_cache
+from agent.llm_cache import LLMCache
+from agent.session import AgentSession
+from benchmarks.fake_model import ScriptedChatModel
+from benchmarks.offline import load_fixture
+
+
+@pytest.fixture
+def caches():
+    # every run really executes and generates its tests, only the LLM responses are cached
+    sandbox.configure_cache(enabled=False)
+    test_cache.configure(enabled=False)
+    yield
+    sandbox.configure()
+    sandbox.configure_cache()
+    test_cache.configure()
+    llm_cache.configure()
+
+
+CONFIG = {"model_name": "scripted", "max_iter": 3, "recursion_limit": 200}
+
+
+def _fix(example: dict, session: Optional[AgentSession] = None) -> dict:
+    if session is None:
+        # the first fix fails its tests, so later prompts contain a sandbox traceback
+        session = AgentSession(CONFIG, model=ScriptedChatModel.from_examples([example], wrong_fixes=1))
+    return session.fix_state(f"{example['declaration']}\n{example['buggy_solution']}", example["docstring"])
+
+
+@pytest.mark.parametrize("backend", sandbox.BACKENDS)
+def test_replay_of_a_failing_then_fixed_run(caches, tmp_path, backend):
+    example = load_fixture()[0]
+    sandbox.configure(backend)
+    path = str(tmp_path / "llm_cache.sqlite")
+
+    llm_cache.configure("record", path)
+    recorded = _fix(example)
+    assert recorded["iter"] == 2
+    assert llm_cache.get_cached_llm().stats()["misses"] > 0
+
+    llm_cache.configure("replay", path)
+    replayed = _fix(example)
+    assert llm_cache.get_cached_llm().stats()["misses"] == 0
+    assert replayed["code"] == recorded["code"]
+    assert replayed["run_result"]["success"]
+
+
+def test_replay_needs_no_api_key(caches, tmp_path, monkeypatch):
+    example = load_fixture()[0]
+    path = str(tmp_path / "llm_cache.sqlite")
+    llm_cache.configure("record", path)
+    recorded = _fix(example)
+
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    llm_cache.configure("replay", path)
+    # the session's own model would fail without a key, it is only created on a cache miss
+    session = AgentSession(CONFIG)
+    replayed = _fix(example, session)
+    assert replayed["code"] == recorded["code"]
+    assert session._models == {}
+    session.close()
+
+
+def test_incomplete_backend_fails_on_construction():
+    class GetOnly(LLMCache):
+        def get(self, key: str) -> Optional[dict]:
+            return None
+
+    with pytest.raises(TypeError):
+        GetOnly()
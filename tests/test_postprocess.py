@@ -0,0 +1,75 @@
+import pytest
+
+from agent.postprocess import strip_tests
+
+FIXED = '''import math  # used by area
+
+
+def area(r):
+    """Area of a circle."""
+    # pi times r squared
+    return math.pi * r**2   # keep this spacing
+'''
+
+WITH_TESTS = FIXED + '''
+
+def check(candidate):
+    assert candidate(1) == math.pi
+
+
+def test_area():
+    assert area(0) == 0
+
+
+assert area(2) > 12
+check(area)
+test_area()
+
+if __name__ == "__main__":
+    check(area)
+'''
+
+
+def test_tests_are_removed():
+    assert strip_tests(WITH_TESTS) == FIXED
+
+
+def test_code_without_tests_is_unchanged():
+    assert strip_tests(FIXED) == FIXED
+
+
+def test_unittest_classes_imports_and_calls_are_removed():
+    code = FIXED + '''
+import unittest
+
+
+class TestArea(unittest.TestCase):
+    def test_zero(self):
+        self.assertEqual(area(0), 0)
+
+
+unittest.main()
+'''
+    assert strip_tests(code) == FIXED
+
+
+def test_decorated_test_function_is_removed():
+    code = FIXED + "\n\n@pytest.mark.parametrize('r', [1])\ndef test_positive(r):\n    assert area(r) > 0\n"
+    assert strip_tests(code) == FIXED
+
+
+def test_asserts_inside_functions_are_kept():
+    code = "def f(x):\n    assert x > 0\n    return x\n"
+    assert strip_tests(code) == code
+
+
+@pytest.mark.parametrize("code", [
+    # cannot be parsed
+    "def f(x:\n    return x\n",
+    # only tests
+    "assert 1 == 1\n\ndef check(candidate):\n    assert candidate(1)\n",
+    # a test shares a line with code
+    "x = area(1); assert x > 0\n",
+])
+def test_fallback_cases_return_none(code):
+    assert strip_tests(code) is None
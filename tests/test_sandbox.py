@@ -0,0 +1,62 @@
+import asyncio
+import gc
+import os
+from pathlib import Path
+
+import pytest
+
+from agent import sandbox
+
+LOOP = "while True:\n    pass\n"
+
+
+def sandbox_children() -> int:
+    """
+    Live sandbox interpreters started by this process.
+    """
+    count = 0
+    for entry in Path("/proc").iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / "stat").read_text()
+            command = (entry / "cmdline").read_bytes()
+        except OSError:
+            continue
+        # the parent pid is the 4th field, after the command name in parentheses
+        parent = int(stat.rsplit(")", 1)[1].split()[1])
+        if parent == os.getpid() and sandbox.RUNNER_PATH.name.encode() in command:
+            count += 1
+    return count
+
+
+pytestmark = pytest.mark.skipif(not Path("/proc").is_dir(), reason="counts processes through /proc")
+
+
+def test_cancelled_run_kills_its_interpreter():
+    async def cancel_a_run():
+        task = asyncio.ensure_future(sandbox.arun_subprocess(LOOP, "buggy_code.py", 30))
+        await asyncio.sleep(0.5)
+        assert sandbox_children() == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    loop = asyncio.new_event_loop()
+    errors = []
+    loop.set_exception_handler(lambda _loop, context: errors.append(context))
+    try:
+        loop.run_until_complete(cancel_a_run())
+        # an unretrieved exception is reported when its future is collected
+        gc.collect()
+    finally:
+        loop.close()
+    assert sandbox_children() == 0
+    # no reader future was left with an unretrieved exception
+    assert errors == []
+
+
+def test_timed_out_run_is_killed():
+    result = asyncio.run(sandbox.arun_subprocess(LOOP, "buggy_code.py", 0.5))
+    assert result["timed_out"]
+    assert sandbox_children() == 0
@@ -0,0 +1,76 @@
+import pytest
+
+from agent import sandbox
+from agent.sandbox_output import BoundedOutput, TRUNCATION_MARKER
+
+
+def _feed(output: BoundedOutput, data: bytes, chunk_size: int) -> BoundedOutput:
+    for start in range(0, len(data), chunk_size):
+        output.feed(data[start:start + chunk_size])
+    return output
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 10, 1000])
+def test_head_and_tail_are_kept(chunk_size):
+    data = bytes(range(48, 58)) * 10
+    output = _feed(BoundedOutput(head_bytes=8, tail_bytes=5), data, chunk_size)
+    assert output.total == 100
+    assert output.truncated
+    assert output.text() == "01234567" + TRUNCATION_MARKER.format(omitted=87, total=100) + "56789"
+
+
+def test_short_output_is_kept_whole():
+    output = _feed(BoundedOutput(head_bytes=8, tail_bytes=5), b"0123456789ab", 2)
+    assert not output.truncated
+    assert output.total == 12
+    assert output.text() == "0123456789ab"
+
+
+def test_without_tail_only_the_head_is_kept():
+    output = _feed(BoundedOutput(head_bytes=4, tail_bytes=0), b"0123456789", 3)
+    assert output.text() == "0123" + TRUNCATION_MARKER.format(omitted=6, total=10)
+
+
+def test_text_has_universal_newlines_and_survives_cut_characters():
+    output = BoundedOutput(head_bytes=5, tail_bytes=100)
+    output.feed("a\r\nb\rc é".encode())
+    assert output.text() == "a\nb\nc é"
+    # the head ends inside the two bytes of "é"
+    cut = BoundedOutput(head_bytes=2, tail_bytes=0)
+    cut.feed("aé".encode())
+    assert cut.text().startswith("a�")
+
+
+@pytest.fixture(params=sandbox.BACKENDS)
+def backend(request):
+    sandbox.configure(request.param)
+    sandbox.configure_output(head_bytes=100, tail_bytes=50)
+    yield request.param
+    sandbox.configure_output()
+    sandbox.configure()
+
+
+def test_large_output_of_a_run(backend):
+    source = "import sys\nfor i in range(100000):\n    print(i)\nprint('the end', file=sys.stderr)\n"
+    result = sandbox.execute(source, "buggy_code.py", 30)
+    total = sum(len(f"{i}\n") for i in range(100000))
+    assert result["stdout_bytes"] == total
+    assert result["stdout"].startswith("0\n1\n2\n")
+    assert result["stdout"].endswith("99998\n99999\n")
+    assert TRUNCATION_MARKER.format(omitted=total - 150, total=total) in result["stdout"]
+    assert result["stderr"] == "the end\n"
+    assert result["return_code"] == 0
+
+
+def test_endless_output_still_times_out(backend):
+    result = sandbox.execute("while True:\n    print('x' * 1000)\n", "buggy_code.py", 1)
+    assert result["timed_out"]
+    assert result["stdout_bytes"] > 150
+    assert len(result["stdout"]) < 300
+
+
+def test_output_written_right_before_exit_is_kept(backend):
+    source = "import os, sys\nsys.stdout.write('last words')\nsys.stdout.flush()\nos._exit(3)\n"
+    result = sandbox.execute(source, "buggy_code.py", 10)
+    assert result["stdout"] == "last words"
+    assert result["return_code"] == 3
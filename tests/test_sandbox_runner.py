@@ -0,0 +1,53 @@
+import pytest
+
+from agent import sandbox
+from agent.model import ExecResult
+from agent.sandbox_runner import split_exception
+
+SIDE_EFFECT = """calls = []
+def f(x):
+    calls.append(x)
+    print("called", x)
+    return len(calls)
+assert f(1) == 2
+"""
+
+
+@pytest.fixture(params=sandbox.BACKENDS)
+def backend(request):
+    sandbox.configure(request.param)
+    yield request.param
+    sandbox.configure()
+
+
+def _report(source: str) -> tuple[ExecResult, dict]:
+    result = sandbox.execute(source, "buggy_code.py", 10)
+    stderr, exception = split_exception(result["stderr"])
+    assert "Traceback" in stderr
+    return result, exception
+
+
+def test_operands_are_the_values_the_assert_failed_with(backend):
+    result, exception = _report(SIDE_EFFECT)
+    # the call ran once, like it does without the sandbox
+    assert result["stdout"] == "called 1\n"
+    assert exception["assertion"] == {"source": "f(1) == 2", "operator": "==", "left": "1", "right": "2"}
+
+
+def test_failing_assert_inside_a_function(backend):
+    source = "def g(x):\n    assert x > 0, 'negative'\n    return x\n\ng(-3)\n"
+    _, exception = _report(source)
+    assert exception["message"] == "negative"
+    assert [frame["function"] for frame in exception["frames"]] == ["<module>", "g"]
+    assert exception["assertion"] == {"source": "x > 0", "operator": ">", "left": "-3", "right": "0"}
+
+
+def test_assert_that_is_not_a_comparison(backend):
+    _, exception = _report("items = [1]\nassert not items\n")
+    assert exception["assertion"] == {"source": "not items", "operator": None, "left": "False", "right": None}
+
+
+def test_assert_from_exec_has_no_operands(backend):
+    # the innermost frame of the file is the exec call, not an assert
+    _, exception = _report("exec('assert 1 == 2')\n")
+    assert exception["assertion"] is None
@@ -0,0 +1,98 @@
+import asyncio
+import time
+from pathlib import Path
+from typing import Optional
+
+import pytest
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from agent import sandbox
+from agent.prompts import FIX_ERROR_SYSTEM_PROMPT
+from agent.session import AgentSession
+from benchmarks.fake_model import ScriptedChatModel, json_block
+from benchmarks.offline import load_fixture
+from tests.test_sandbox import sandbox_children
+
+
+class LoopingFirstCandidate(ScriptedChatModel):
+    """
+    Candidate 0 of every speculative round never finishes its sandbox run, the sampled candidates are right.
+    """
+
+    def _generate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None, run_manager=None,
+                  **kwargs) -> ChatResult:
+        if messages[0].content == FIX_ERROR_SYSTEM_PROMPT.content and "temperature" not in kwargs:
+            content = json_block(self._task(messages)["fixed"] + "\nwhile True:\n    pass\n")
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+        return super()._generate(messages, stop, run_manager, **kwargs)
+
+
+@pytest.fixture
+def no_sandbox_cache():
+    sandbox.configure_cache(enabled=False)
+    yield
+    sandbox.configure_cache()
+
+
+@pytest.mark.skipif(not Path("/proc").is_dir(), reason="counts processes through /proc")
+def test_losing_candidates_leave_no_interpreters(no_sandbox_cache):
+    example = load_fixture()[0]
+    model = LoopingFirstCandidate.from_examples([example])
+    session = AgentSession({"model_name": "scripted", "max_iter": 3, "recursion_limit": 200, "speculative_k": 3},
+                           model=model)
+
+    async def fix() -> dict:
+        state = await session.afix_state(f"{example['declaration']}\n{example['buggy_solution']}",
+                                         example["docstring"])
+        # the losing candidates were cancelled, their runs only need the loop to process it
+        await asyncio.sleep(0.5)
+        assert sandbox_children() == 0
+        return state
+
+    state = asyncio.run(fix())
+    assert state["run_result"]["success"]
+    assert state["speculation"]["won_by_alternative"] == 1
+
+
+class FailingSampledCandidates(ScriptedChatModel):
+    """
+    Every sampled candidate fails, like a rate-limited request. Candidate 0 is right.
+    """
+
+    def _generate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None, run_manager=None,
+                  **kwargs) -> ChatResult:
+        if "temperature" in kwargs:
+            raise RuntimeError("rate limited")
+        return super()._generate(messages, stop, run_manager, **kwargs)
+
+
+def _speculative_session(model: ScriptedChatModel) -> AgentSession:
+    return AgentSession({"model_name": "scripted", "max_iter": 3, "recursion_limit": 200, "speculative_k": 3},
+                        model=model)
+
+
+@pytest.mark.skipif(not Path("/proc").is_dir(), reason="counts processes through /proc")
+def test_losing_candidates_of_the_sync_graph_are_killed(no_sandbox_cache):
+    example = load_fixture()[0]
+    session = _speculative_session(LoopingFirstCandidate.from_examples([example]))
+    state = session.fix_state(f"{example['declaration']}\n{example['buggy_solution']}", example["docstring"])
+    # the loser's thread notices the decided round within sandbox.CANCEL_POLL
+    time.sleep(0.5)
+    assert sandbox_children() == 0
+    assert state["run_result"]["success"]
+    assert state["speculation"]["won_by_alternative"] == 1
+
+
+def test_failing_candidates_only_lose(no_sandbox_cache):
+    example = load_fixture()[0]
+    session = _speculative_session(FailingSampledCandidates.from_examples([example], wrong_fixes=1))
+    state = session.fix_state(f"{example['declaration']}\n{example['buggy_solution']}", example["docstring"])
+    assert state["run_result"]["success"]
+    assert state["speculation"]["rounds"] == 2
+    assert state["speculation"]["won_by_alternative"] == 0
+
+    state = asyncio.run(session.afix_state(f"{example['declaration']}\n{example['buggy_solution']}",
+                                           example["docstring"]))
+    assert state["run_result"]["success"]
+    assert state["speculation"]["won_by_alternative"] == 0
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from agent.streaming import JsonBlockScanner
+from utils.utils import parse_json_content
+
+CODE = 'def f(s):\n    return s.replace("\\"", "{") + "}}"\n'
+ANSWER = "Here is the fix:\n```json\n" + json.dumps({"content": CODE}) + "\n```\nIt replaces the quotes."
+
+
+def _scan(text: str, chunk_size: int) -> tuple[JsonBlockScanner, int]:
+    """
+    :return: the scanner and the number of characters it was fed until it was complete (all of them if never)
+    """
+    scanner = JsonBlockScanner()
+    for start in range(0, len(text), chunk_size):
+        if scanner.feed(text[start:start + chunk_size]):
+            return scanner, start + chunk_size
+    return scanner, len(text)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 16, len(ANSWER)])
+def test_escaped_quotes_and_braces_in_strings(chunk_size):
+    scanner, fed = _scan(ANSWER, chunk_size)
+    assert scanner.complete
+    assert scanner.content == CODE
+    # the closing brace of the object ends the block, the fence and the explanation after it are not waited for
+    assert fed < ANSWER.index("\n```\nIt") + chunk_size
+
+
+def test_fence_split_across_chunks():
+    scanner = JsonBlockScanner()
+    assert not scanner.feed("Fixed:\n``")
+    assert not scanner.feed("`js")
+    assert not scanner.feed("on\n")
+    assert scanner.feed('{"content": "x = 1"}')
+    assert scanner.content == "x = 1"
+
+
+def test_block_that_is_not_an_object_is_read_to_the_end():
+    scanner, _ = _scan('```json\n["x = 1"]\n```\n{"content": "y"}', 4)
+    assert not scanner.complete
+    assert scanner.content is None
+    assert scanner.answer() == '```json\n["x = 1"]\n```\n{"content": "y"}'
+
+
+@pytest.mark.parametrize("block", ['{"code": "x = 1"}', '{"content": 1}', '{"content": {"code": "x = 1"}}', '{"a": }'])
+def test_without_string_content_the_answer_is_read_to_the_end(block):
+    text = f"```json\n{block}\n```\nmore text"
+    scanner, fed = _scan(text, 5)
+    assert not scanner.complete
+    assert fed == len(text)
+    assert scanner.answer() == text
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, len(ANSWER)])
+def test_answer_is_parsable(chunk_size):
+    scanner, _ = _scan(ANSWER, chunk_size)
+    assert parse_json_content(scanner.answer()) == CODE
+
+
+def test_incomplete_answer_is_the_whole_text():
+    scanner, _ = _scan('```json\n{"content": "x = ', 3)
+    assert not scanner.complete
+    assert scanner.answer() == '```json\n{"content": "x = '
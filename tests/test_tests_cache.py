@@ -0,0 +1,88 @@
+from typing import Optional
+
+import pytest
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import PrivateAttr
+
+from agent import sandbox, test_cache
+from agent.prompts import CREATE_TESTS_SYSTEM_PROMPT
+from agent.session import AgentSession
+from benchmarks.fake_model import ScriptedChatModel
+from benchmarks.offline import load_fixture
+
+CONFIG = {"model_name": "scripted", "max_iter": 3, "recursion_limit": 200}
+
+
+class CountingChatModel(ScriptedChatModel):
+    """
+    Counts the create_tests calls. With unparsable_tests its answers to them have no `json` block.
+    """
+
+    unparsable_tests: bool = False
+
+    _create_tests_calls: int = PrivateAttr(default=0)
+
+    def _generate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None, run_manager=None,
+                  **kwargs) -> ChatResult:
+        if messages[0].content == CREATE_TESTS_SYSTEM_PROMPT.content:
+            self._create_tests_calls += 1
+            if self.unparsable_tests:
+                message = AIMessage(content="Here are the tests: assert f(1) == 1")
+                return ChatResult(generations=[ChatGeneration(message=message)])
+        return super()._generate(messages, stop, run_manager, **kwargs)
+
+
+@pytest.fixture
+def tests_cache():
+    sandbox.configure_cache(enabled=False)
+    test_cache.configure()
+    yield
+    sandbox.configure_cache()
+    test_cache.configure()
+
+
+def _fix(example: dict, model: ScriptedChatModel, **config) -> dict:
+    session = AgentSession({**CONFIG, **config}, model=model)
+    return session.fix_state(f"{example['declaration']}\n{example['buggy_solution']}", example["docstring"])
+
+
+def test_key_ignores_bodies_and_docstring_whitespace():
+    key = test_cache.tests_key("def f(x):\n    return x\n", "Returns  x.\n")
+    assert key == test_cache.tests_key("def f(x):\n    return x + 1\n", "Returns x.")
+    assert key != test_cache.tests_key("def f(x, y):\n    return x\n", "Returns x.")
+    assert test_cache.tests_key("def f(x):\n    return x\n", None) is None
+    assert test_cache.tests_key("def f(x:\n", "Returns x.") is None
+
+
+def test_hit_skips_create_tests(tests_cache):
+    example = load_fixture()[0]
+    first = CountingChatModel.from_examples([example])
+    state = _fix(example, first)
+    assert state["tests_source"] == "llm"
+    assert first._create_tests_calls == 1
+
+    second = CountingChatModel.from_examples([example])
+    state = _fix(example, second)
+    assert state["tests_source"] == "cache"
+    assert state["tests"] == example["test"]
+    assert second._create_tests_calls == 0
+    assert test_cache.cache_stats()["memory_hits"] == 1
+
+
+def test_failed_fix_stores_nothing(tests_cache):
+    example = load_fixture()[0]
+    # every fix returns the buggy code, the tests never pass
+    _fix(example, CountingChatModel.from_examples([example], wrong_fixes=10), max_iter=1)
+    assert test_cache.lookup(test_cache.tests_key(f"{example['declaration']}\n{example['buggy_solution']}",
+                                                  example["docstring"])) is None
+
+
+def test_code_runs_without_tests_after_max_test_attempts(tests_cache):
+    example = load_fixture()[0]
+    model = CountingChatModel.from_examples([example], unparsable_tests=True)
+    state = _fix(example, model, max_test_attempts=2)
+    assert model._create_tests_calls == 2
+    assert state["test_attempts"] == 2
+    assert state["tests"] is None
+    assert state["run_result"]["success"]